@@ -1,14 +1,10 @@
 from datetime import datetime
 from typing import Any, Literal, Optional, TypedDict
 
-from PaulsLoggerManagement import setup_logger
-
 from GembaFileUpToDater.BAQMethod import BAQMethod
 from GembaFileUpToDater.epicor_communications import EpicorCommunicator
 
-from GembaFileUpToDater.parse_args import should_show_debug
-import logging
-logger = setup_logger("AccessGembaFiles", level=(logging.DEBUG if should_show_debug() else logging.INFO))
+from GembaFileUpToDater.package_logger import logger
 
 class GembaFileReference(TypedDict):
     Company: str
@@ -22,6 +18,19 @@ class GembaFileReference(TypedDict):
     SysRowID: str
 
 class AccessGembaFiles:
+
+    # Every column parse_raw_result reads
+    SELECTED_COLUMNS = (
+        'UD05_Company',
+        'UD05_Character01',
+        'UD05_ShortChar01',
+        'UD05_Key1',
+        'UD05_Key2',
+        'UD05_CheckBox02',
+        'RowMod',
+        'RowIdent',
+        'SysRowID',
+    )
     
     @staticmethod
     def parse_raw_result(raw: dict) -> GembaFileReference:
@@ -70,6 +79,35 @@ class AccessGembaFiles:
 
         return [AccessGembaFiles.parse_raw_result(g) for g in data]
 
+    @staticmethod
+    def get_records_since(post_date: str,
+                          company_ID: Optional[str]=None,
+                          API_key: Optional[str]=None,
+                          user_pass: Optional[str]=None,
+                          timeout: float=60.0) -> list[GembaFileReference]:
+        """ Execute the BAQ for only the rows posted at or after post_date.
+
+        PostDate is a ShortChar, so the filter is a string comparison. That
+        works because every PostDate is an ISO timestamp. Rows with exactly
+        post_date come back too, so the caller has to drop the ones it has
+        already seen.
+        """
+
+        company_ID, API_key, user_pass = EpicorCommunicator.get_id_api_pass(company_ID, API_key, user_pass)
+        url = AccessGembaFiles.__get_url(odata_method='Data')
+        escaped = post_date.replace("'", "''")
+        query = {
+            '$filter': f"UD05_ShortChar01 ge '{escaped}'",
+            '$select': ','.join(AccessGembaFiles.SELECTED_COLUMNS),
+            '$orderby': 'UD05_ShortChar01',
+        }
+
+        logger.debug(f'Sending GET request for AccessGembaFiles UBAQ rows since {post_date}')
+
+        data = BAQMethod.get_records(url, company_ID, API_key, user_pass, timeout, query=query)
+
+        return [AccessGembaFiles.parse_raw_result(g) for g in data]
+
     @staticmethod
     def delete_record(gemba_record: GembaFileReference,
                       company_ID: Optional[str]=None,
@@ -1,14 +1,12 @@
 import json
 from typing import Any, Literal, Optional
+from urllib.parse import quote, urlencode, urljoin
 
 import requests
-from PaulsLoggerManagement import setup_logger
 
 from GembaFileUpToDater.epicor_communications import EpicorCommunicator
 
-from GembaFileUpToDater.parse_args import should_show_debug
-import logging
-logger = setup_logger("AccessGembaFiles", level=(logging.DEBUG if should_show_debug() else logging.INFO))
+from GembaFileUpToDater.package_logger import logger
 
 class BAQMethod:
 
@@ -17,21 +15,39 @@ class BAQMethod:
                     company_ID: Optional[str]=None,
                     API_key: Optional[str]=None,
                     user_pass: Optional[str]=None,
-                    timeout: float=60.0) -> list[dict]:
+                    timeout: float=60.0,
+                    query: Optional[dict[str, str]]=None) -> list[dict]:
         """
         Execute the BAQ without updates.
+
+        query holds OData options such as $filter, $select and $orderby. If the
+        server pages the results, every page is fetched by following
+        @odata.nextLink.
         """
 
         company_ID, API_key, user_pass = EpicorCommunicator.get_id_api_pass(company_ID, API_key, user_pass)
 
         headers = BAQMethod.__get_headers(API_key, has_content=False)
 
-        response: requests.Response
-        response = EpicorCommunicator.get_request(url,
-                                                  headers=headers,
-                                                  timeout=timeout)
+        if query:
+            url = f'{url}?{urlencode(query, quote_via=quote)}'
+
+        data: list = []
+        next_url: Optional[str] = url
+        while next_url is not None:
+            response: requests.Response
+            response = EpicorCommunicator.get_request(next_url,
+                                                      headers=headers,
+                                                      timeout=timeout)
+
+            page = response.json()
+            data.extend(page.get('value', []))
+
+            next_link = page.get('@odata.nextLink')
+            next_url = urljoin(next_url, next_link) if next_link else None
+            if next_url is not None:
+                logger.debug(f'Following @odata.nextLink after {len(data)} records')
 
-        data: list = response.json().get('value', [])
         return data
 
     @staticmethod
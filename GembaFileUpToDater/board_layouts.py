@@ -0,0 +1,126 @@
+import json
+import math
+import os
+from typing import Any, Optional, TypedDict
+
+from GembaFileUpToDater import snapshots
+
+from GembaFileUpToDater.package_logger import logger
+
+# One <name>.json per board, drawn by scripts/boardRuntime.js
+BOARDS_DIR = 'boards'
+
+class BoardCheck(TypedDict):
+    # The files the board shows, in the order it draws them
+    images: list[str]
+    problems: list[str]
+
+def manifest_file_names(manifest_path: Optional[str]=None) -> set[str]:
+    """ The FileNames the boards can be served, from the manifest the web
+    server sends: the current snapshot's, or the one in the working directory.
+    """
+
+    if manifest_path is None:
+        current = snapshots.current_snapshot()
+        manifest_path = os.path.join(current, snapshots.MANIFEST_NAME) if current else snapshots.MANIFEST_NAME
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+
+    return {file['FileName'] for file in manifest}
+
+def layout_images(layout: dict[str, Any]) -> list[str]:
+    """ The files a layout shows in the order the runtime draws them, lowest
+    priority first and then in reading order.
+    """
+
+    images: list[tuple[float, int, str]] = []
+    for cell in layout.get('cells') or []:
+        halves = (cell['split'] or []) if isinstance(cell, dict) and 'split' in cell else [cell]
+        for image in halves:
+            if isinstance(image, dict) and isinstance(image.get('file'), str):
+                images.append((image.get('priority', math.inf), len(images), image['file']))
+
+    return [file for _, _, file in sorted(images)]
+
+def check_layout(layout: Any, file_names: Optional[set[str]]=None) -> list[str]:
+    """ Everything wrong with a layout, and with file_names every image it
+    shows that the manifest doesn't have.
+    """
+
+    if not isinstance(layout, dict):
+        return ['The layout has to be an object']
+
+    problems: list[str] = []
+
+    columns = layout.get('columns')
+    counts = list(columns.values()) if isinstance(columns, dict) else [columns]
+    if isinstance(columns, dict) and set(columns) != {'portrait', 'landscape'}:
+        problems.append('columns needs a portrait and a landscape count')
+    if not all(isinstance(c, int) and not isinstance(c, bool) and c > 0 for c in counts):
+        problems.append(f'columns has to be a positive number, not {columns!r}')
+
+    cells = layout.get('cells')
+    if not isinstance(cells, list):
+        return problems + ['cells has to be a list']
+
+    for index, cell in enumerate(cells):
+        if cell is None:
+            continue
+        if isinstance(cell, dict) and 'split' in cell:
+            halves = cell['split']
+            if not isinstance(halves, list) or len(halves) != 2:
+                problems.append(f'Cell {index} has to split into exactly two halves')
+                continue
+            problems += [p for half in halves if half is not None for p in __check_image(half, f'Cell {index}')]
+        else:
+            problems += __check_image(cell, f'Cell {index}')
+
+    images = layout_images(layout)
+    if not images:
+        problems.append('The board shows no images')
+
+    if file_names is not None:
+        problems += [f'{file} is not in the manifest' for file in dict.fromkeys(images) if file not in file_names]
+
+    return problems
+
+def check_boards(boards_dir: str=BOARDS_DIR, manifest_path: Optional[str]=None) -> dict[str, BoardCheck]:
+    """ Check every layout in boards_dir against the manifest. """
+
+    file_names = manifest_file_names(manifest_path)
+    results: dict[str, BoardCheck] = {}
+
+    for entry in sorted(os.listdir(boards_dir)):
+        name, extension = os.path.splitext(entry)
+        if extension != '.json':
+            continue
+
+        try:
+            with open(os.path.join(boards_dir, entry)) as f:
+                layout = json.load(f)
+        except (OSError, ValueError) as e:
+            results[name] = {'images': [], 'problems': [f'Could not read the layout: {e}']}
+            continue
+
+        images = layout_images(layout) if isinstance(layout, dict) else []
+        results[name] = {'images': images, 'problems': check_layout(layout, file_names)}
+
+        if results[name]['problems']:
+            for problem in results[name]['problems']:
+                logger.warning(f'{name}: {problem}')
+        else:
+            logger.info(f'{name}: {len(images)} images, {images[0]} first')
+
+    return results
+
+def __check_image(image: Any, where: str) -> list[str]:
+
+    if not isinstance(image, dict) or not isinstance(image.get('file'), str) or not image['file']:
+        return [f'{where} needs a file name, a split or null']
+
+    priority = image.get('priority')
+    if priority is not None and (isinstance(priority, bool) or not isinstance(priority, (int, float))):
+        return [f'{where} has a priority that is not a number']
+
+    return []
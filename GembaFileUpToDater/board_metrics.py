@@ -0,0 +1,98 @@
+import json
+import os
+from typing import Optional, TypedDict
+
+from GembaFileUpToDater.package_logger import logger
+
+# Written by nocache_server.py from what scripts/kioskRuntime.js reports, with
+# the previous file moved to .1 once it gets big
+METRICS_FILE = 'board_metrics.jsonl'
+
+class BoardUsage(TypedDict):
+    board: str
+    client: str
+    reports: int
+    # Seconds since the epoch of the first and last report
+    first: float
+    last: float
+    heap_first: Optional[int]
+    heap_last: Optional[int]
+    # How fast the JS heap grew between the first and last report, None with
+    # less than an hour of reports
+    heap_bytes_per_day: Optional[float]
+    decoded_images: int
+    decoded_images_max: int
+    # Worst 95th percentile frame time of any report, in ms
+    frame_p95_max: Optional[float]
+
+def read_reports(path: str=METRICS_FILE) -> list[dict]:
+    """ Every report in path and the file it was rotated to, oldest first. """
+
+    reports: list[dict] = []
+    for file in (path + '.1', path):
+        if not os.path.exists(file):
+            continue
+
+        with open(file) as f:
+            for line in f:
+                try:
+                    report = json.loads(line)
+                except ValueError:
+                    # A line cut short when the server stopped
+                    continue
+                if isinstance(report, dict) and isinstance(report.get('time'), (int, float)):
+                    reports.append(report)
+
+    return sorted(reports, key=lambda r: r['time'])
+
+def board_usage(reports: list[dict]) -> list[BoardUsage]:
+    """ Sum up the reports per board and kiosk. """
+
+    by_board: dict[tuple[str, str], list[dict]] = {}
+    for report in reports:
+        key = (str(report.get('board')), str(report.get('client')))
+        by_board.setdefault(key, []).append(report)
+
+    usage: list[BoardUsage] = []
+    for (board, client), board_reports in sorted(by_board.items()):
+        first, last = board_reports[0], board_reports[-1]
+        heaps = [r for r in board_reports if isinstance(r.get('jsHeapUsed'), int)]
+        images = [r.get('decodedImages') or 0 for r in board_reports]
+        p95s = [r['frameTime']['p95'] for r in board_reports if isinstance(r.get('frameTime'), dict)]
+
+        heap_per_day = None
+        if len(heaps) > 1 and heaps[-1]['time'] - heaps[0]['time'] >= 3600:
+            days = (heaps[-1]['time'] - heaps[0]['time']) / 86400
+            heap_per_day = (heaps[-1]['jsHeapUsed'] - heaps[0]['jsHeapUsed']) / days
+
+        usage.append({
+            'board': board,
+            'client': client,
+            'reports': len(board_reports),
+            'first': first['time'],
+            'last': last['time'],
+            'heap_first': heaps[0]['jsHeapUsed'] if heaps else None,
+            'heap_last': heaps[-1]['jsHeapUsed'] if heaps else None,
+            'heap_bytes_per_day': heap_per_day,
+            'decoded_images': images[-1],
+            'decoded_images_max': max(images),
+            'frame_p95_max': max(p95s) if p95s else None,
+        })
+
+    return usage
+
+def log_board_usage(path: str=METRICS_FILE) -> list[BoardUsage]:
+    usage = board_usage(read_reports(path))
+    if not usage:
+        logger.warning(f'No board metrics in {path}')
+
+    mb = lambda n: 'n/a' if n is None else f'{n / 1024 / 1024:.1f} MB'
+    for board in usage:
+        growth = 'n/a' if board['heap_bytes_per_day'] is None else f'{mb(board["heap_bytes_per_day"])}/day'
+        frame = 'n/a' if board['frame_p95_max'] is None else f'{board["frame_p95_max"]:.1f} ms'
+        logger.info(f'{board["board"]} on {board["client"]}: {board["reports"]} reports, '
+                    f'heap {mb(board["heap_first"])} -> {mb(board["heap_last"])} ({growth}), '
+                    f'{board["decoded_images"]} decoded images (max {board["decoded_images_max"]}), '
+                    f'worst p95 frame {frame}')
+
+    return usage
@@ -0,0 +1,168 @@
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+
+from GembaFileUpToDater.package_logger import logger
+
+try:
+    import brotli  # type: ignore[import-not-found]
+except ImportError:
+    brotli = None
+
+SVG_DIR = 'svg_files'
+
+# Blobs are named by the sha256 of their contents. Every svg_files/<FileName>
+# is a hard link to one, so identical files are only stored once.
+BLOB_DIR = os.path.join(SVG_DIR, '.blobs')
+
+# Downloads land here first so they can be compared before replacing anything
+INCOMING_DIR = os.path.join(SVG_DIR, '.incoming')
+
+# Pre-compressed copies served in place of the SVG when the browser accepts
+# them. nocache_server looks for the same extensions.
+SIDECAR_EXTENSIONS = {'gzip': '.gz', 'br': '.br'}
+# Only these get sidecars, bitmaps are compressed already. Same as
+# nocache_server's PRECOMPRESSED_SUFFIXES.
+COMPRESSED_EXTENSIONS = ('.svg',)
+
+# Set once link_into has had to copy, so that's only logged the once
+__COPYING_WARNED = False
+
+def new_hasher() -> 'hashlib._Hash':
+    return hashlib.sha256()
+
+def hash_file(path: str) -> str:
+    """ sha256 of a file on disk, read a block at a time. """
+
+    hasher = new_hasher()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def blob_path(content_hash: str, file_name: str) -> str:
+    """ Where the blob for content_hash lives. It keeps file_name's extension. """
+
+    return os.path.join(BLOB_DIR, content_hash + os.path.splitext(file_name)[1])
+
+def store_file(incoming_path: str, file_name: str, content_hash: str) -> str:
+    """ Move a downloaded file into the store and link it in as svg_files/file_name.
+
+    If a blob with the same contents already exists the download is thrown
+    away and the existing blob is linked instead. The link is swapped in with
+    a rename so svg_files/file_name is never missing or half written. Returns
+    the path of the blob.
+    """
+
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    blob = blob_path(content_hash, file_name)
+
+    if os.path.exists(blob):
+        os.remove(incoming_path)
+    else:
+        os.replace(incoming_path, blob)
+
+    # Compress once here rather than on every request. The sidecars belong to
+    # the blob, so files sharing it share those too.
+    if blob.lower().endswith(COMPRESSED_EXTENSIONS):
+        compress_blob(blob)
+
+    destination = os.path.join(SVG_DIR, file_name)
+    link_into(blob, destination)
+    for extension in SIDECAR_EXTENSIONS.values():
+        if os.path.exists(blob + extension):
+            link_into(blob + extension, destination + extension)
+        elif os.path.lexists(destination + extension):
+            # Don't leave a sidecar of the old contents behind
+            os.remove(destination + extension)
+
+    return blob
+
+def compress_blob(blob: str) -> None:
+    """ Write the .gz (and .br if brotli is installed) sidecars for a blob.
+
+    A sidecar that wouldn't be smaller than the blob isn't written, the
+    server sends the blob itself when there's none.
+    """
+
+    if not os.path.exists(blob + SIDECAR_EXTENSIONS['gzip']):
+        with open(blob, 'rb') as f:
+            data = f.read()
+        # mtime=0 keeps the output the same for the same input
+        __write_sidecar(blob, SIDECAR_EXTENSIONS['gzip'], len(data), gzip.compress(data, compresslevel=9, mtime=0))
+
+    if brotli is not None and not os.path.exists(blob + SIDECAR_EXTENSIONS['br']):
+        with open(blob, 'rb') as f:
+            data = f.read()
+        __write_sidecar(blob, SIDECAR_EXTENSIONS['br'], len(data), brotli.compress(data, quality=11))
+
+def __write_sidecar(blob: str, extension: str, size: int, compressed: bytes) -> None:
+
+    if len(compressed) >= size:
+        logger.debug(f'Not keeping {os.path.basename(blob)}{extension}, it would be {len(compressed)} bytes against {size}')
+        return
+
+    __write_atomic(blob + extension, compressed)
+    logger.debug(f'Compressed {os.path.basename(blob)} to {extension} from {size} to {len(compressed)} bytes')
+
+def __write_atomic(path: str, data: bytes) -> None:
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.part')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+def link_into(source: str, destination: str) -> None:
+    """ Atomically make destination a hard link to source.
+
+    Falls back to a copy on filesystems that can't hard link. Files aren't
+    shared then, and prune_blobs can only go by the hashes it's given.
+    """
+    global __COPYING_WARNED
+
+    directory = os.path.dirname(destination) or '.'
+    temp_path = os.path.join(directory, f'.{os.path.basename(destination)}.link')
+
+    if os.path.lexists(temp_path):
+        os.remove(temp_path)
+
+    try:
+        os.link(source, temp_path)
+    except OSError as e:
+        if not __COPYING_WARNED:
+            logger.warning(f'Hard links are not available ({e}), copying files instead of sharing them')
+            __COPYING_WARNED = True
+        shutil.copy2(source, temp_path)
+
+    os.replace(temp_path, destination)
+
+def prune_blobs(referenced: set[str]) -> int:
+    """ Delete blobs (and their sidecars) that nothing uses any more.
+
+    A blob is kept while its content hash is in referenced, the ContentHash of
+    every file in the manifest and the snapshots, or while anything else links
+    to it. The second alone isn't enough: where link_into had to copy, every
+    blob has a single link. Returns how many were removed.
+    """
+
+    if not os.path.isdir(BLOB_DIR):
+        return 0
+
+    removed = 0
+    for entry in os.scandir(BLOB_DIR):
+        if not entry.is_file(follow_symlinks=False):
+            continue
+
+        # <hash>.svg, and its sidecars <hash>.svg.gz and <hash>.svg.br
+        if entry.name.split('.', 1)[0] in referenced or entry.stat().st_nlink > 1:
+            continue
+
+        os.remove(entry.path)
+        removed += 1
+
+    if removed:
+        logger.debug(f'Removed {removed} unused blobs')
+
+    return removed
@@ -1,22 +1,38 @@
 import json
 import os
-from typing import TypedDict
-from PaulsLoggerManagement import setup_logger
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional, TypedDict
 from GembaFileUpToDater.epicor_communications import File_Operations, Ice_LIB_FileStoreSvc, EpicorCommunicator
-from GembaFileUpToDater.AccessGembaFiles import AccessGembaFiles
+from GembaFileUpToDater import content_store, prerender, request_metrics, snapshots, svg_optimizer
+from GembaFileUpToDater.AccessGembaFiles import AccessGembaFiles, GembaFileReference
+from GembaFileUpToDater.file_reconciliation import FileInformation, parse_post_date, reconcile_files
 from dotenv import dotenv_values
+import requests
 
-class FileInformation(TypedDict):
-    SysID: str
-    FileName: str
-    DatePosted: str
-    SequenceNumber: str
-
-from GembaFileUpToDater.parse_args import should_show_debug
-import logging
-logger = setup_logger("AccessGembaFiles", level=(logging.DEBUG if should_show_debug() else logging.INFO))
+from GembaFileUpToDater.package_logger import logger
 ID_FILE = 'downloaded_ids.json'
+WATERMARK_FILE = 'downloaded_ids.watermark.json'
+
+# Even with a good watermark, fetch the whole table this often so files that
+# were taken off the server get noticed.
+FULL_FETCH_INTERVAL = timedelta(hours=24)
+
+class FetchWatermark(TypedDict):
+    # The newest PostDate seen so far and the rows posted at exactly that time
+    PostDate: str
+    SysRowIDs: list[str]
+    # When the whole table was last fetched
+    FullFetchDate: str
+
+# How many ReadAllBytes requests can be in flight at once. Kinetic is the slow
+# part, so a few workers hide most of the latency without hammering the server.
+DEFAULT_DOWNLOAD_WORKERS = 4
+
+# ReadAllFiles returns every file on the server in one response, changed or
+# not, so it's only worth it when this many files are needed at once. 0 never
+# uses it.
+DEFAULT_BATCH_DOWNLOAD_MIN_FILES = 0
 
 my_dotenv_values: dict[str, str] = dotenv_values('.env') # type: ignore[reportAssignmentType, assignment]
 EpicorCommunicator.API_key = my_dotenv_values['DOWNLOAD_KEY']
@@ -24,6 +40,12 @@ EpicorCommunicator.user_pass = my_dotenv_values['DOWNLOAD_PASS']
 EpicorCommunicator.company_ID = 'PAUL01'
 EpicorCommunicator.url_domain = 'https://kinetic.paulsmachine.com'
 EpicorCommunicator.url_app_path = 'Kinetic'
+DOWNLOAD_WORKERS = int(my_dotenv_values.get('DOWNLOAD_WORKERS') or DEFAULT_DOWNLOAD_WORKERS)
+BATCH_DOWNLOAD_MIN_FILES = int(my_dotenv_values.get('BATCH_DOWNLOAD_MIN_FILES') or DEFAULT_BATCH_DOWNLOAD_MIN_FILES)
+RENDER_WORKERS = int(my_dotenv_values.get('RENDER_WORKERS') or prerender.DEFAULT_RENDER_WORKERS)
+
+# Every download worker should be able to hold on to its own connection
+EpicorCommunicator.pool_size = max(EpicorCommunicator.pool_size, DOWNLOAD_WORKERS)
 
 def __get_downloaded_file_ids() -> list[FileInformation]:
     
@@ -39,69 +61,346 @@ def __get_downloaded_file_ids() -> list[FileInformation]:
     
 def __store_downloaded_file_ids(id_pairs: list[FileInformation]) -> None:
 
-    with open(ID_FILE, 'w+') as f:
-        return json.dump(id_pairs, f, indent=4)
+    # Swapped in with a rename, the web server watches this file and shouldn't
+    # ever see it half written
+    temp_path = ID_FILE + '.part'
+    with open(temp_path, 'w+') as f:
+        json.dump(id_pairs, f, indent=4)
+    os.replace(temp_path, ID_FILE)
+
+def __get_watermark() -> Optional[FetchWatermark]:
+
+    if not os.path.exists(WATERMARK_FILE):
+        return None
+
+    try:
+        with open(WATERMARK_FILE, 'r') as f:
+            return json.load(f)
+
+    except json.JSONDecodeError:
+        return None
+
+def __store_watermark(watermark: FetchWatermark) -> None:
+
+    # Swapped in with a rename like the manifest, so a refresh killed halfway
+    # through never leaves half a watermark
+    temp_path = WATERMARK_FILE + '.part'
+    with open(temp_path, 'w+') as f:
+        json.dump(watermark, f, indent=4)
+    os.replace(temp_path, WATERMARK_FILE)
+
+def __watermark_is_usable(watermark: Optional[FetchWatermark], existing_files: list[FileInformation]) -> bool:
+    """ Whether an incremental fetch from this watermark can be trusted. """
+
+    # Without a manifest there is nothing for the new rows to be applied to
+    if watermark is None or len(existing_files) == 0:
+        return False
+
+    try:
+        post_date = parse_post_date(watermark['PostDate'])
+        full_fetch_date = datetime.fromisoformat(watermark['FullFetchDate'])
+        seen_ids = watermark['SysRowIDs']
+    except (KeyError, TypeError, ValueError):
+        logger.warning('The fetch watermark is malformed, doing a full fetch.')
+        return False
+
+    now = datetime.now()
+    if post_date == datetime.min or post_date > now + timedelta(days=1) or not isinstance(seen_ids, list):
+        logger.warning(f'The fetch watermark {watermark["PostDate"]} looks wrong, doing a full fetch.')
+        return False
+
+    if now - full_fetch_date > FULL_FETCH_INTERVAL:
+        logger.info('A full fetch is due.')
+        return False
+
+    return True
+
+def __next_watermark(rows: list[GembaFileReference],
+                     previous: Optional[FetchWatermark],
+                     full_fetch_date: str) -> Optional[FetchWatermark]:
+    """ Move the watermark up to the newest of rows. """
+
+    watermark = previous
+    newest = parse_post_date(previous['PostDate']) if previous else datetime.min
+
+    for row in rows:
+        posted = parse_post_date(row['PostDate'])
+        if posted == datetime.min:
+            continue
+
+        if watermark is None or posted > newest:
+            newest = posted
+            watermark = {'PostDate': row['PostDate'], 'SysRowIDs': [row['SysRowID']], 'FullFetchDate': full_fetch_date}
+        elif posted == newest and row['SysRowID'] not in watermark['SysRowIDs']:
+            watermark['SysRowIDs'].append(row['SysRowID'])
+
+    if watermark is not None:
+        watermark['FullFetchDate'] = full_fetch_date
+
+    return watermark
+
+def __get_server_files(existing_files: list[FileInformation],
+                       watermark: Optional[FetchWatermark],
+                       incremental: bool) -> tuple[list[GembaFileReference], bool]:
+    """ Get the rows to reconcile against and whether they are only a delta. """
+
+    if incremental and watermark is not None and __watermark_is_usable(watermark, existing_files):
+        try:
+            rows = AccessGembaFiles.get_records_since(watermark['PostDate'])
+        except requests.RequestException as e:
+            logger.warning(f'Incremental fetch failed, doing a full fetch: {e}')
+        else:
+            seen_ids = set(watermark['SysRowIDs'])
+            return [r for r in rows if r['SysRowID'] not in seen_ids], True
+
+    return AccessGembaFiles.get_records(), False
+
+def __local_hash(file: FileInformation) -> Optional[str]:
+    """ The content hash of a file we already have, if it's still on disk. """
+
+    path = os.path.join(content_store.SVG_DIR, file['FileName'])
+    if not os.path.exists(path):
+        return None
+
+    # Manifests written before hashes were recorded won't have one yet
+    return file.get('ContentHash') or content_store.hash_file(path)
+
+def __source_hash(file: FileInformation) -> Optional[str]:
+    """ The hash a file we already have had as it was downloaded. """
+
+    # Before SourceHash was recorded ContentHash was the hash of the download.
+    # One that was filled in from disk is of the optimized file, so it won't
+    # match and the file is stored once more, this time with its SourceHash.
+    return file.get('SourceHash') or __local_hash(file)
+
+def __optimize_file(path: str, file_name: str) -> None:
+    """ Shrink a downloaded SVG before it's stored and log what that bought. """
+
+    report = svg_optimizer.optimize_file(path)
+    if report is None:
+        return
+
+    saved = 1 - report['optimized_bytes'] / report['original_bytes'] if report['original_bytes'] else 0
+    message = f'Optimized {file_name} from {report["original_bytes"]} to {report["optimized_bytes"]} bytes ({saved:.0%} smaller) in {report["seconds"]:.2f}s'
+    if report['rasterize_before'] is not None and report['rasterize_after'] is not None:
+        message += f', rasterizing takes {report["rasterize_after"] * 1000:.0f}ms instead of {report["rasterize_before"] * 1000:.0f}ms'
+    if not report['lossy']:
+        message += ', coordinates kept as they were'
+    logger.info(message)
+
+def __download_file(file: FileInformation, previous: Optional[FileInformation]) -> Optional[FileInformation]:
+    """ Download a single file into svg_files. Returns None if it failed.
+
+    If the contents turn out to be the same as what we already have, nothing
+    is written and the previous SequenceNumber is kept so browsers don't
+    redraw it.
+    """
+
+    incoming_path = os.path.join(content_store.INCOMING_DIR, file['SysID'])
+    hasher = content_store.new_hasher()
 
-def download_new_files() -> None:
+    try:
+        Ice_LIB_FileStoreSvc.download_file(file['SysID'], incoming_path, hasher=hasher)
+    except (requests.RequestException, FileNotFoundError, ValueError) as e:
+        logger.warning(f'Failed to download {file["FileName"]} at {file["SysID"]}: {e}')
+        return None
+
+    return __store_incoming(file, previous, incoming_path, hasher.hexdigest())
+
+def __store_incoming(file: FileInformation,
+                     previous: Optional[FileInformation],
+                     incoming_path: str,
+                     source_hash: str) -> FileInformation:
+    """ Move a downloaded file from INCOMING_DIR into svg_files.
+
+    source_hash is the hash of the download. SVGs are optimized before they're
+    stored, so the stored file is named by, and its ContentHash is, the hash
+    of the optimized bytes.
+    """
+
+    if previous is not None and __source_hash(previous) == source_hash:
+        os.remove(incoming_path)
+        logger.info(f'{file["FileName"]} has not changed')
+
+        if 'SourceHash' in previous:
+            content_hash = previous['ContentHash']
+        else:
+            content_hash = content_store.hash_file(os.path.join(content_store.SVG_DIR, previous['FileName']))
+        unchanged: FileInformation = {**file, 'SequenceNumber': previous['SequenceNumber'], 'ContentHash': content_hash, 'SourceHash': source_hash}
+        if 'RenderFailedHash' in previous:
+            unchanged['RenderFailedHash'] = previous['RenderFailedHash']
+        return unchanged
+
+    logger.info(f'Updating {file["FileName"]}')
+    content_hash = source_hash
+    if file['FileName'].lower().endswith('.svg'):
+        __optimize_file(incoming_path, file['FileName'])
+        content_hash = content_store.hash_file(incoming_path)
+    content_store.store_file(incoming_path, file['FileName'], content_hash)
+
+    return {**file, 'ContentHash': content_hash, 'SourceHash': source_hash}
+
+def __download_batch(files: list[FileInformation],
+                     previous: list[Optional[FileInformation]]) -> list[Optional[FileInformation]]:
+    """ Fetch files with a single ReadAllFiles request.
+
+    Results line up with files. A file the response didn't have, or couldn't
+    be decoded, is None so it can be fetched on its own.
+    """
+
+    try:
+        stored_files = Ice_LIB_FileStoreSvc.read_all_files()
+    except Exception as e:
+        # read_all_files raises a plain Exception when nothing comes back
+        logger.warning(f'ReadAllFiles failed, downloading one file at a time: {e}')
+        return [None] * len(files)
+
+    by_id = {s['SysRowID'].lower(): s for s in stored_files}
+    logger.debug(f'ReadAllFiles returned {len(by_id)} files, {len(files)} are needed')
+
+    results: list[Optional[FileInformation]] = []
+    for file, prev in zip(files, previous):
+        stored = by_id.get(file['SysID'].lower())
+        if stored is None or not stored.get('Contents'):
+            results.append(None)
+            continue
+
+        incoming_path = os.path.join(content_store.INCOMING_DIR, file['SysID'])
+        try:
+            File_Operations.decode_file(stored['Contents'], incoming_path)
+        except (OSError, ValueError) as e:
+            logger.warning(f'Could not decode {file["FileName"]} from ReadAllFiles: {e}')
+            results.append(None)
+            continue
+
+        results.append(__store_incoming(file, prev, incoming_path, content_store.hash_file(incoming_path)))
+
+    return results
+
+def download_files(files: list[FileInformation],
+                   max_workers: int=DEFAULT_DOWNLOAD_WORKERS,
+                   existing_files: Optional[list[FileInformation]]=None,
+                   batch: bool=False) -> list[FileInformation]:
+    """ Download files with up to max_workers requests running at once.
+
+    With batch=True everything ReadAllFiles returns is taken from one
+    request first, and only the files it was missing are fetched one by one.
+    A file that fails to download is logged and left out of the result, the
+    rest of the batch carries on. Results keep the order of the input.
+    existing_files is the current manifest, used to skip writing files whose
+    contents didn't change.
+    """
+
+    if len(files) == 0:
+        return []
+
+    os.makedirs(content_store.INCOMING_DIR, exist_ok=True)
+
+    previous_by_name = {f['FileName']: f for f in existing_files or []}
+    previous = [previous_by_name.get(f['FileName']) for f in files]
+
+    results: list[Optional[FileInformation]] = __download_batch(files, previous) if batch else [None] * len(files)
+    missing = [i for i, result in enumerate(results) if result is None]
+    if batch and missing:
+        logger.info(f'{len(missing)} files were not in ReadAllFiles, downloading them one at a time')
+
+    max_workers = max(1, min(max_workers, len(missing)))
+    if max_workers == 1:
+        fetched = [__download_file(files[i], previous[i]) for i in missing]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='gemba-download') as executor:
+            fetched = list(executor.map(__download_file, [files[i] for i in missing], [previous[i] for i in missing]))
+
+    for i, result in zip(missing, fetched):
+        results[i] = result
+
+    return [f for f in results if f is not None]
+
+def download_new_files(max_workers: int=DOWNLOAD_WORKERS, incremental: bool=True) -> None:
+    """ Bring svg_files and the manifest up to date with the server.
+
+    With incremental=True only rows posted since the last run are fetched,
+    unless the saved watermark can't be trusted or a full fetch is due. The
+    requests it took are summarized in refresh_metrics.json and
+    refresh_metrics.prom, even when it fails.
+    """
+
+    try:
+        __refresh(max_workers, incremental)
+    finally:
+        __write_request_metrics()
+
+def __write_request_metrics() -> None:
+
+    try:
+        summary = EpicorCommunicator.metrics.write(request_metrics.METRICS_JSON_FILE, request_metrics.METRICS_PROMETHEUS_FILE)
+        request_metrics.log_summary(summary)
+    except OSError as e:
+        logger.warning(f'Could not write the request metrics: {e}')
+
+    # Start the next refresh from nothing, the daemon reuses this process
+    EpicorCommunicator.metrics.reset()
+
+def __refresh(max_workers: int, incremental: bool) -> None:
 
     # Get a list of the existing files already downloaded and a list of those on
     # the server.
     existing_files = __get_downloaded_file_ids()
-    online_files = AccessGembaFiles.get_records()
-    logger.info(f'Found {len(existing_files)} local files and {len(online_files)} files on the server.')
-
-    # Put those into a DataFrame then sort the DataFrame so that we can get the
-    # list of newest files.
-    server_files_df = pd.DataFrame(online_files)
-    server_files_df = server_files_df.astype({'PostDate': 'datetime64[ns]'})
-    server_files_df = server_files_df.sort_values(['FileName', 'PostDate'], ascending=[True, False])
-    newest_files_df_2 = server_files_df.groupby(['FileName']).head(1)
-    newest_files: list[FileInformation] = [
-        {'FileName': row['FileName'], 'SysID': row['FileSysRowID'], 'DatePosted': row['PostDate'].isoformat(), 'SequenceNumber': row['Key2'][-5:]}
-        for _, row in newest_files_df_2.iterrows()
-    ]
-
-    # Get a list of old files that we have downloaded. Old files will be those
-    # where the SysID is not in the newest ids.
-    newest_ids = [f['SysID'] for f in newest_files]
-    old_files = [f for f in existing_files if f['SysID'] not in newest_ids]
-    logger.info(f'{len(old_files)} are not the latest on the server')
-
-
-    # Files we need to download will be those not in the old list
-    old_file_names = [o['FileName'] for o in old_files]
-    files_need_updating = [g for g in newest_files if g['FileName'] in old_file_names]
-
-    # There also may be new files. Get a list of the files that we don't have
-    # but are on the server.
-    existing_file_names = [e['FileName'] for e in existing_files]
-    files_dont_have = [f for f in newest_files if f['FileName'] not in existing_file_names]
-    logger.info(f'There are {len(files_dont_have)} new files that are not yet local.')
+    watermark = __get_watermark()
+    online_files, partial = __get_server_files(existing_files, watermark, incremental)
+    if partial:
+        logger.info(f'Found {len(existing_files)} local files and {len(online_files)} changed rows on the server.')
+    else:
+        logger.info(f'Found {len(existing_files)} local files and {len(online_files)} files on the server.')
 
-    
-    # Lastly, files not updated are files that are not "old"
-    files_not_updated = [f for f in existing_files if f not in old_files]
+    # Work out which files are new, which need updating and which are fine
+    diff = reconcile_files(existing_files, online_files, partial=partial)
+    files_need_updating = diff['updated']
+    files_dont_have = diff['new']
+    files_not_updated = diff['unchanged']
+    logger.info(f'{len(files_need_updating)} are not the latest on the server')
+    logger.info(f'There are {len(files_dont_have)} new files that are not yet local.')
+    logger.info(f'{len(diff["removed"])} are no longer on the server.')
     logger.info(f'{len(files_not_updated)} will remain unchanged.')
     
     # Make the svg_files folder if it doesn't exist
-    os.makedirs('svg_files', exist_ok=True)
+    os.makedirs(content_store.SVG_DIR, exist_ok=True)
 
-    # Loop over all of those files and download them
-    files_updated: list[FileInformation] = []
-    for file in files_need_updating + files_dont_have:
+    # Download all of those files
+    files_to_download = files_need_updating + files_dont_have
+    batch = 0 < BATCH_DOWNLOAD_MIN_FILES <= len(files_to_download)
+    files_updated = download_files(files_to_download, max_workers, existing_files, batch=batch)
 
-        file_bytes = Ice_LIB_FileStoreSvc.read_all_bytes(file['SysID'])
-        if file_bytes is None:
-            logger.warning(f'Failed to download {file["FileName"]} at {file["SysID"]}')
-            continue
-        
-        logger.info(f'Updating {file["FileName"]}')
-        write_to = f'svg_files/{file["FileName"]}'
-        bytes_str = file_bytes['returnObj']
-        File_Operations.decode_file(contents=bytes_str, path=write_to)
+    # Fill in hashes for anything recorded before they were kept
+    for file in files_not_updated:
+        if 'ContentHash' not in file:
+            content_hash = __local_hash(file)
+            if content_hash is not None:
+                file['ContentHash'] = content_hash
+
+    # Rasterize anything new for the boards, if cairosvg is installed
+    manifest = prerender.render_files(files_updated + files_not_updated, RENDER_WORKERS)
 
-        files_updated.append(file)
+    # Update the record of what files we have, then hand the whole set to the
+    # web server in one go
+    __store_downloaded_file_ids(manifest)
+    snapshots.publish(manifest)
+    content_hashes = {f['ContentHash'] for f in manifest if 'ContentHash' in f}
+    content_store.prune_blobs(content_hashes | snapshots.content_hashes())
+    prerender.prune_renders(content_hashes)
 
+    # Only move the watermark on once everything it covers is local. A failed
+    # file drops out of the manifest, so the next run has to look at the whole
+    # table again to find it.
+    if len(files_updated) == len(files_to_download):
+        full_fetch_date = watermark['FullFetchDate'] if partial and watermark else datetime.now().isoformat()
+        next_watermark = __next_watermark(online_files, watermark if partial else None, full_fetch_date)
+        if next_watermark is not None:
+            __store_watermark(next_watermark)
+    else:
+        logger.warning(f'{len(files_to_download) - len(files_updated)} files failed, the next run will do a full fetch.')
+        if os.path.exists(WATERMARK_FILE):
+            os.remove(WATERMARK_FILE)
 
-    # Update the record of what files we have
-    __store_downloaded_file_ids(files_updated + files_not_updated)
+    stats = EpicorCommunicator.connection_stats()
+    logger.debug(f'{stats["requests"]} requests used {stats["new_connections"]} new connections and reused {stats["reused_connections"]}')
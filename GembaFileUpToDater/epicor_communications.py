@@ -2,17 +2,26 @@ from __future__ import annotations
 
 import base64
 import json
+import os
+import tempfile
+import threading
 import time
-from typing import Any, Literal, Optional, TypedDict
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, Literal, Optional, TypedDict
 
 import requests
-from PaulsLoggerManagement import setup_logger
-from PIL.ImageFile import ImageFile
-from requests.exceptions import HTTPError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from GembaFileUpToDater.parse_args import should_show_debug
-import logging
-logger = setup_logger("AccessGembaFiles", level=(logging.DEBUG if should_show_debug() else logging.INFO))
+from GembaFileUpToDater.request_metrics import RequestMetrics, endpoint_name
+
+if TYPE_CHECKING:
+    # Only for the type hints, PIL is slow to import
+    from PIL.ImageFile import ImageFile
+
+from GembaFileUpToDater.package_logger import logger
+
+# How much of a streamed response to read at once
+STREAM_CHUNK_SIZE = 64 * 1024
 
 class EpicorImage(TypedDict):
     Company: str
@@ -36,6 +45,11 @@ class StoredFile(TypedDict):
     FileName: str
     Contents: str
 
+class ConnectionStats(TypedDict):
+    requests: int
+    new_connections: int
+    reused_connections: int
+
 class EpicorCommunicator:
     company_ID: str = ''
     url_domain: str = ''
@@ -43,6 +57,21 @@ class EpicorCommunicator:
     API_key: str = ''
     user_pass: str = ''
 
+    # Session settings. These are read when the session is first made, so set
+    # them before the first request (or call close_session to start over).
+    pool_size: int = 8
+    max_retries: int = 3
+    backoff_factor: float = 0.5
+    retry_statuses: tuple[int, ...] = (429, 500, 502, 503, 504)
+    connect_timeout: float = 10.0
+
+    _session: Optional[requests.Session] = None
+    _write_session: Optional[requests.Session] = None
+    _session_lock = threading.Lock()
+
+    # Every request is recorded here, download_new_files writes it out
+    metrics = RequestMetrics()
+
     @staticmethod
     def get_id_api_pass(company_ID: str | None, API_key: str | None, user_pass: str | None) -> tuple[str, str, str]:
 
@@ -61,44 +90,143 @@ class EpicorCommunicator:
         return company_ID, API_key
 
     @staticmethod
-    def patch_request(url: str, headers: dict[str, Any], timeout: float, data: Optional[str] = None) -> requests.Response:
-        response: requests.Response
+    def get_session(retry: bool = True) -> requests.Session:
+        """ The shared session every request to Kinetic goes through.
 
-        try:
-            Reporting_Statistics.initialize_reporting()
-            response = requests.patch(url,
-                                      headers=headers,
-                                      data=data,
-                                      timeout=timeout)
-            Reporting_Statistics.log_timing_metrics(response)
+        Keeping one session around means connections (and their TLS
+        handshakes) are reused between the BAQ call and every file download.
+        Retries with backoff are handled by urllib3 for 429 and 5xx responses.
 
-            if not response.ok:
-                logger.warning(f'Response returned status of {response.status_code}')
+        Requests that write (PATCH, and the FileStoreSvc POSTs that create or
+        delete) must not be sent twice, so with retry=False a second session
+        is returned that only retries when the connection couldn't be made.
+        """
 
-            response.raise_for_status()
+        with EpicorCommunicator._session_lock:
+            if retry:
+                if EpicorCommunicator._session is None:
+                    EpicorCommunicator._session = EpicorCommunicator.__new_session(retry_sent=True)
+                return EpicorCommunicator._session
 
-            return response
+            if EpicorCommunicator._write_session is None:
+                EpicorCommunicator._write_session = EpicorCommunicator.__new_session(retry_sent=False)
+            return EpicorCommunicator._write_session
 
-        except requests.HTTPError as e:
-            logger.error(f"Request failed: {e}")
-            logger.info(f'Headers: {headers}')
-            logger.info(f'Timeout: {timeout}')
-            raise
-        
     @staticmethod
-    def get_request(url: str, headers: dict[str, Any], timeout: float, data: Optional[str] = None) -> requests.Response:
+    def __new_session(retry_sent: bool) -> requests.Session:
+
+        # Failed connects are always retried, nothing reached the server.
+        # retry_sent decides whether a request is sent again after a read
+        # error or one of retry_statuses.
+        sent_retries = None if retry_sent else 0
+        retry = Retry(total=EpicorCommunicator.max_retries,
+                      read=sent_retries,
+                      status=sent_retries,
+                      other=sent_retries,
+                      backoff_factor=EpicorCommunicator.backoff_factor,
+                      status_forcelist=EpicorCommunicator.retry_statuses,
+                      allowed_methods=frozenset({'GET', 'POST'}),
+                      respect_retry_after_header=True,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=EpicorCommunicator.pool_size,
+                              max_retries=retry)
+
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    @staticmethod
+    def close_session() -> None:
+        """ Close the shared sessions and all of their pooled connections. """
+
+        with EpicorCommunicator._session_lock:
+            for session in (EpicorCommunicator._session, EpicorCommunicator._write_session):
+                if session is not None:
+                    session.close()
+            EpicorCommunicator._session = None
+            EpicorCommunicator._write_session = None
+
+    @staticmethod
+    def connection_stats() -> ConnectionStats:
+        """ How many requests were sent and how many connections that took.
+
+        Every request that didn't need a new connection reused one from the
+        pool.
+        """
+
+        num_requests = 0
+        num_connections = 0
+
+        for session in (EpicorCommunicator._session, EpicorCommunicator._write_session):
+            if session is None:
+                continue
+            adapters = {id(a): a for a in session.adapters.values()}.values()
+            for adapter in adapters:
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools[key]
+                    num_requests += pool.num_requests
+                    num_connections += pool.num_connections
+
+        return {
+            'requests': num_requests,
+            'new_connections': num_connections,
+            'reused_connections': max(0, num_requests - num_connections),
+        }
+
+    @staticmethod
+    def get_timeout(timeout: float) -> tuple[float, float]:
+        """ Split a timeout into (connect, read).
+
+        Callers only pass how long they are willing to wait for an answer, the
+        connect timeout is kept short so an unreachable server fails fast.
+        """
+
+        return min(EpicorCommunicator.connect_timeout, timeout), timeout
+
+    @staticmethod
+    def send_request(method: Literal['GET', 'POST', 'PATCH'],
+                     url: str,
+                     headers: dict[str, Any],
+                     timeout: float,
+                     data: Optional[str] = None,
+                     stream: bool = False,
+                     retry: bool = True) -> requests.Response:
+        """ Send a request with the shared session.
+
+        With stream=True the body is left unread so it can be consumed with
+        iter_content, the caller is then responsible for closing the response.
+        Pass retry=False for requests that change something on the server.
+        """
         response: requests.Response
+        endpoint = endpoint_name(url)
+        start = time.perf_counter()
 
         try:
-            Reporting_Statistics.initialize_reporting()
-            response = requests.get(url,
-                                    headers=headers,
-                                    data=data,
-                                    timeout=timeout)
-            Reporting_Statistics.log_timing_metrics(response)
+            try:
+                response = EpicorCommunicator.get_session(retry).request(method,
+                                                                    url,
+                                                                    headers=headers,
+                                                                    data=data,
+                                                                    timeout=EpicorCommunicator.get_timeout(timeout),
+                                                                    stream=stream)
+            except requests.RequestException:
+                EpicorCommunicator.metrics.record(endpoint, time.perf_counter() - start, None, None, None)
+                raise
+
+            if stream:
+                # The body is read after we return, so it's measured once the
+                # caller closes the response
+                EpicorCommunicator.__record_when_closed(response, endpoint, start)
+            else:
+                EpicorCommunicator.__record(response, endpoint, start)
 
             if not response.ok:
                 logger.warning(f'Response returned status of {response.status_code}')
+                if stream:
+                    response.close()
 
             response.raise_for_status()
 
@@ -110,6 +238,53 @@ class EpicorCommunicator:
             logger.info(f'Timeout: {timeout}')
             raise
 
+    @staticmethod
+    def __record(response: requests.Response, endpoint: str, start: float) -> None:
+
+        total_time = time.perf_counter() - start
+        elapsed_sec = response.elapsed.total_seconds()
+
+        # Streamed bodies are never held in memory, count what came over the wire
+        if response._content_consumed and isinstance(response._content, bytes):
+            content_size = len(response._content)
+        else:
+            content_size = response.raw.tell() if hasattr(response.raw, 'tell') else int(response.headers.get('Content-Length', 0))
+
+        # urllib3 keeps the history of its retries on the response
+        retries = getattr(response.raw, 'retries', None)
+        retry_count = len(retries.history) if retries is not None else 0
+
+        EpicorCommunicator.metrics.record(endpoint, total_time, elapsed_sec, content_size, response.status_code, retry_count)
+        logger.debug(f"{endpoint}: server took {elapsed_sec:.3f} seconds. Request took {total_time:.3f} seconds. "
+                     f"Returned {content_size / 2 ** 20:.3f} MiB")
+
+    @staticmethod
+    def __record_when_closed(response: requests.Response, endpoint: str, start: float) -> None:
+
+        close = response.close
+        recorded = False
+
+        def close_and_record() -> None:
+            nonlocal recorded
+            if not recorded:
+                recorded = True
+                EpicorCommunicator.__record(response, endpoint, start)
+            close()
+
+        response.close = close_and_record  # type: ignore[method-assign]
+
+    @staticmethod
+    def patch_request(url: str, headers: dict[str, Any], timeout: float, data: Optional[str] = None) -> requests.Response:
+        return EpicorCommunicator.send_request('PATCH', url, headers, timeout, data, retry=False)
+        
+    @staticmethod
+    def get_request(url: str, headers: dict[str, Any], timeout: float, data: Optional[str] = None) -> requests.Response:
+        return EpicorCommunicator.send_request('GET', url, headers, timeout, data)
+
+    @staticmethod
+    def post_request(url: str, headers: dict[str, Any], timeout: float, data: Optional[str] = None, stream: bool = False, retry: bool = True) -> requests.Response:
+        return EpicorCommunicator.send_request('POST', url, headers, timeout, data, stream, retry)
+
 
 class Ice_LIB_FileStoreSvc:
     """
@@ -147,17 +322,13 @@ class Ice_LIB_FileStoreSvc:
 
         response: requests.Response
         try:
-            Reporting_Statistics.initialize_reporting()
-            response = requests.post(url,
-                                     headers=headers,
-                                     data=json.dumps(payload),
-                                     timeout=timeout)
-            Reporting_Statistics.log_timing_metrics(response)
-
-            if not response.ok:
-                logger.warning(f'Response returned status of {response.status_code}')
-            
-            response.raise_for_status()
+            # Sent once, a retry after the server already stored it would
+            # store it twice
+            response = EpicorCommunicator.post_request(url,
+                                                       headers=headers,
+                                                       data=json.dumps(payload),
+                                                       timeout=timeout,
+                                                       retry=False)
 
             data = response.json().get('returnObj', '')
 
@@ -167,10 +338,6 @@ class Ice_LIB_FileStoreSvc:
             
             return data
 
-        except HTTPError as e:
-            logger.error(f"Request failed: {e}")
-            raise
-
         except requests.JSONDecodeError as e:
             logger.error("Didn't receive valid JSON in response")
             logger.error(e)
@@ -193,17 +360,10 @@ class Ice_LIB_FileStoreSvc:
 
         response: requests.Response
         try:
-            Reporting_Statistics.initialize_reporting()
-            response = requests.post(url,
-                                     headers=headers,
-                                     data=json.dumps(payload),
-                                     timeout=timeout)
-            Reporting_Statistics.log_timing_metrics(response)
-
-            if not response.ok:
-                logger.warning(f'Response returned status of {response.status_code}')
-            
-            response.raise_for_status()
+            response = EpicorCommunicator.post_request(url,
+                                                       headers=headers,
+                                                       data=json.dumps(payload),
+                                                       timeout=timeout)
 
             data = response.json()
 
@@ -212,15 +372,47 @@ class Ice_LIB_FileStoreSvc:
             
             return data
 
-        except HTTPError as e:
-            logger.error(f"Request failed: {e}")
-            raise
-
         except requests.JSONDecodeError as e:
             logger.error("Didn't receive valid JSON in response")
             logger.error(e)
             raise
 
+    @staticmethod
+    def download_file(id: str,
+                      path: str,
+                      company_ID: Optional[str]=None,
+                      API_key: Optional[str]=None,
+                      user_pass: Optional[str]=None,
+                      timeout: float=60.0,
+                      hasher: Optional[Any]=None) -> int:
+        """ Read a file straight to disk.
+
+        Unlike read_all_bytes the response is never held in memory. The
+        base64 contents are decoded as they arrive and the file only appears
+        at path once it is complete. If a hashlib hasher is given it is fed
+        the decoded bytes. Returns the number of bytes written.
+        """
+
+        company_ID, API_key, user_pass = EpicorCommunicator.get_id_api_pass(company_ID, API_key, user_pass)
+
+        logger.debug('Sending POST request for Ice.LIB.FileStoreService/ReadAllBytes')
+        url = Ice_LIB_FileStoreSvc.get_url(method_name='ReadAllBytes')
+        headers = Ice_LIB_FileStoreSvc.get_headers(API_key, user_pass, has_content=True)
+        payload = { 'id': id }
+
+        response = EpicorCommunicator.post_request(url,
+                                                   headers=headers,
+                                                   data=json.dumps(payload),
+                                                   timeout=timeout,
+                                                   stream=True)
+        with response:
+            written = File_Operations.decode_stream(response.iter_content(chunk_size=STREAM_CHUNK_SIZE), path, hasher=hasher)
+
+        if written == 0:
+            raise FileNotFoundError(f'No file was associated with id: {id}')
+
+        return written
+
     @staticmethod
     def delete(id: str,
                company_ID: Optional[str]=None,
@@ -236,23 +428,11 @@ class Ice_LIB_FileStoreSvc:
         headers = Ice_LIB_FileStoreSvc.get_headers(API_key, user_pass, has_content=True)
         payload = { 'id': id }
 
-        response: requests.Response
-        try:
-            Reporting_Statistics.initialize_reporting()
-            response = requests.post(url,
-                                     headers=headers,
-                                     data=json.dumps(payload),
-                                     timeout=timeout)
-            Reporting_Statistics.log_timing_metrics(response)
-
-            if not response.ok:
-                logger.warning(f'Response returned status of {response.status_code}')
-            
-            response.raise_for_status()
-
-        except HTTPError as e:
-            logger.error(f"Request failed: {e}")
-            raise
+        EpicorCommunicator.post_request(url,
+                                        headers=headers,
+                                        data=json.dumps(payload),
+                                        timeout=timeout,
+                                        retry=False)
 
     @staticmethod
     def read_all_files(foreign_sys_row_ID="00000000-0000-0000-0000-000000000000",
@@ -271,17 +451,10 @@ class Ice_LIB_FileStoreSvc:
 
         response: requests.Response
         try:
-            Reporting_Statistics.initialize_reporting()
-            response = requests.post(url,
-                                     headers=headers,
-                                     data=json.dumps(payload),
-                                     timeout=timeout)
-            Reporting_Statistics.log_timing_metrics(response)
-
-            if not response.ok:
-                logger.warning(f'Response returned status of {response.status_code}')
-            
-            response.raise_for_status()
+            response = EpicorCommunicator.post_request(url,
+                                                       headers=headers,
+                                                       data=json.dumps(payload),
+                                                       timeout=timeout)
 
             data = response.json().get('returnObj', [])
 
@@ -290,10 +463,6 @@ class Ice_LIB_FileStoreSvc:
             
             return data
 
-        except HTTPError as e:
-            logger.error(f"Request failed: {e}")
-            raise
-
         except requests.JSONDecodeError as e:
             logger.error("Didn't receive valid JSON in response")
             logger.error(e)
@@ -329,24 +498,6 @@ class Ice_LIB_FileStoreSvc:
         return f"{domain}/{app_path}/api/v2/odata/{company_id}/Ice.LIB.FileStoreSvc/{method_name}"
 
 
-class Reporting_Statistics:
-
-    start_time: float
-
-    @staticmethod
-    def initialize_reporting():
-        Reporting_Statistics.start_time = time.time()
-
-    @staticmethod
-    def log_timing_metrics(response: requests.Response):
-
-        total_time: float   = round(time.time() - Reporting_Statistics.start_time, 3)
-        elapsed_sec: float  = round(response.elapsed.total_seconds(), 3)
-        content_size: float = round(len(response.content) / 2 ** 20, 3)
-
-        logger.debug(f"Server took {elapsed_sec} seconds. Request took {total_time} seconds. Returned {content_size} MiB")
-
-
 class File_Operations:
 
     @staticmethod
@@ -364,3 +515,135 @@ class File_Operations:
         
         with open(path, 'wb') as f:
             f.write(image_data)
+
+    @staticmethod
+    def decode_stream(chunks: Iterable[bytes], path: str, key: str='returnObj', hasher: Optional[Any]=None) -> int:
+        """ Decode the base64 string under key in a JSON byte stream to path.
+
+        Only a chunk or so is held in memory at a time. The output goes to a
+        temp file next to path that is renamed over it when done, so nothing
+        reading path ever sees half a file. An empty value writes nothing and
+        returns 0. If a hashlib hasher is given it is fed the decoded bytes.
+        """
+
+        directory = os.path.dirname(path) or '.'
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.part')
+        written = 0
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pending = b''
+                for encoded in File_Operations.iter_json_string(chunks, key):
+                    pending += encoded
+
+                    # base64 decodes in groups of 4 characters
+                    usable = len(pending) - len(pending) % 4
+                    if usable:
+                        decoded = base64.b64decode(pending[:usable], validate=True)
+                        f.write(decoded)
+                        if hasher is not None:
+                            hasher.update(decoded)
+                        written += len(decoded)
+                        pending = pending[usable:]
+
+                if pending:
+                    raise ValueError(f'Truncated base64 in "{key}"')
+
+            if written == 0:
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, path)
+
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        return written
+
+    @staticmethod
+    def iter_json_string(chunks: Iterable[bytes], key: str) -> Iterator[bytes]:
+        """ Yield the raw contents of a JSON string value as it streams in.
+
+        This is not a JSON parser. It looks for the first "key" and then
+        yields everything up to the closing quote of its value, which is all
+        that's needed for a base64 payload. The only escapes base64 can come
+        back with are \\/ and line breaks, anything else is an error. A null
+        value yields nothing.
+        """
+
+        token = b'"' + key.encode() + b'"'
+        chunk_iter = iter(chunks)
+        buffer = b''
+
+        # Find the key, keeping enough of the tail to catch one split in two
+        for chunk in chunk_iter:
+            buffer += chunk
+            index = buffer.find(token)
+            if index >= 0:
+                buffer = buffer[index + len(token):]
+                break
+            buffer = buffer[-(len(token) - 1):]
+        else:
+            raise ValueError(f'"{key}" not found in response')
+
+        # Skip over the colon to the opening quote
+        expecting = b':'
+        while True:
+            buffer = buffer.lstrip()
+            if buffer == b'':
+                buffer = next(chunk_iter, None)
+                if buffer is None:
+                    raise ValueError(f'Response ended before the value of "{key}"')
+                continue
+
+            if expecting == b':':
+                if buffer[:1] != b':':
+                    raise ValueError(f'Expected ":" after "{key}"')
+                buffer = buffer[1:]
+                expecting = b'"'
+                continue
+
+            if buffer[:1] == b'n':
+                return
+            if buffer[:1] != b'"':
+                raise ValueError(f'The value of "{key}" is not a string')
+            buffer = buffer[1:]
+            break
+
+        # Hand out the string until its closing quote
+        while True:
+            end = buffer.find(b'"')
+            piece = buffer if end < 0 else buffer[:end]
+
+            # Leave a trailing backslash for the next chunk to finish
+            carry = b''
+            if end < 0 and piece.endswith(b'\\') and (len(piece) - len(piece.rstrip(b'\\'))) % 2 == 1:
+                piece, carry = piece[:-1], b'\\'
+
+            if b'\\' in piece:
+                piece = File_Operations.__unescape_base64(piece)
+            if piece:
+                yield piece
+
+            if end >= 0:
+                return
+
+            chunk = next(chunk_iter, None)
+            if chunk is None:
+                raise ValueError(f'Response ended inside the value of "{key}"')
+            buffer = carry + chunk
+
+    @staticmethod
+    def __unescape_base64(piece: bytes) -> bytes:
+
+        parts = piece.split(b'\\')
+        ret = [parts[0]]
+        for part in parts[1:]:
+            if part[:1] == b'/':
+                ret.append(part)
+            elif part[:1] in (b'n', b'r'):
+                ret.append(part[1:])
+            else:
+                raise ValueError(f'Unexpected escape in base64 string: \\{part[:1].decode(errors="replace")}')
+        return b''.join(ret)
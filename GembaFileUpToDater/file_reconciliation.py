@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, NotRequired, TypedDict
+
+if TYPE_CHECKING:
+    # Only for the type hints, importing it pulls in requests
+    from GembaFileUpToDater.AccessGembaFiles import GembaFileReference
+
+from GembaFileUpToDater.package_logger import logger
+
+class ImageVariant(TypedDict):
+    # A pre-rendered bitmap of the file, relative to the web root
+    url: str
+    width: int
+    height: int
+
+class FileInformation(TypedDict):
+    SysID: str
+    FileName: str
+    DatePosted: str
+    SequenceNumber: str
+    # sha256 of the contents, so clients can tell when a file really changed
+    ContentHash: NotRequired[str]
+    # sha256 of the file as it was downloaded. SVGs are optimized before
+    # they're stored, so this is what the next download is compared with.
+    SourceHash: NotRequired[str]
+    # Bitmaps boards can draw instead of rasterizing the SVG themselves
+    Variants: NotRequired[list[ImageVariant]]
+    # ContentHash of contents that couldn't be pre-rendered, so they're only
+    # tried again once they change
+    RenderFailedHash: NotRequired[str]
+
+class ManifestDiff(TypedDict):
+    # Newest versions of files that aren't local yet
+    new: list[FileInformation]
+    # Newest versions of files whose local copy is out of date
+    updated: list[FileInformation]
+    # Local entries that are still the newest on the server
+    unchanged: list[FileInformation]
+    # Local entries for files that are no longer on the server at all
+    removed: list[FileInformation]
+
+def parse_post_date(post_date: str) -> datetime:
+    """ Parse a UD05 PostDate into a naive datetime.
+
+    Anything with a timezone is moved to UTC first so everything compares.
+    Dates that can't be parsed sort before everything else.
+    """
+
+    try:
+        parsed = datetime.fromisoformat(post_date)
+    except (TypeError, ValueError):
+        logger.warning(f'Could not parse PostDate {post_date!r}')
+        return datetime.min
+
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return parsed
+
+def newest_versions(server_files: list[GembaFileReference]) -> list[FileInformation]:
+    """ The newest version of each file on the server, sorted by FileName.
+
+    When two versions have the same PostDate the first one listed wins.
+    """
+
+    newest: dict[str, tuple[datetime, GembaFileReference]] = {}
+    for record in server_files:
+        posted = parse_post_date(record['PostDate'])
+        current = newest.get(record['FileName'])
+        if current is None or posted > current[0]:
+            newest[record['FileName']] = (posted, record)
+
+    return [
+        {
+            'FileName': file_name,
+            'SysID': record['FileSysRowID'],
+            'DatePosted': posted.isoformat(),
+            'SequenceNumber': record['Key2'][-5:],
+        }
+        for file_name, (posted, record) in sorted(newest.items())
+    ]
+
+def reconcile_files(existing_files: list[FileInformation],
+                    server_files: list[GembaFileReference],
+                    partial: bool=False) -> ManifestDiff:
+    """ Work out what has to be downloaded to match the server.
+
+    Everything is looked up through dicts and sets keyed by FileName and SysID
+    so this stays linear in the number of rows.
+
+    With partial=True server_files is only the rows that changed since the
+    last fetch. Local files it doesn't mention are then unchanged rather than
+    removed, and nothing is ever reported as removed.
+    """
+
+    newest_files = newest_versions(server_files)
+    newest_ids = {f['SysID'] for f in newest_files}
+    newest_names = {f['FileName'] for f in newest_files}
+
+    def is_current(f: FileInformation) -> bool:
+        return f['SysID'] in newest_ids or (partial and f['FileName'] not in newest_names)
+
+    # A local entry is stale when its SysID isn't the newest one any more
+    stale_files = [f for f in existing_files if not is_current(f)]
+    stale_names = {f['FileName'] for f in stale_files}
+    existing_names = {f['FileName'] for f in existing_files}
+
+    return {
+        'new': [f for f in newest_files if f['FileName'] not in existing_names],
+        'updated': [f for f in newest_files if f['FileName'] in stale_names],
+        'unchanged': [f for f in existing_files if is_current(f)],
+        'removed': [f for f in stale_files if f['FileName'] not in newest_names],
+    }
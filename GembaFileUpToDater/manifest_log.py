@@ -0,0 +1,68 @@
+import json
+from typing import Optional, TypedDict
+
+from GembaFileUpToDater.file_reconciliation import FileInformation
+
+# Published next to the manifest in every snapshot. nocache_server answers
+# /manifest?since=<version> from it with only what changed.
+MANIFEST_LOG_NAME = 'manifest_changes.json'
+
+# Changes kept in the log. A board that is further behind than that gets the
+# whole manifest instead.
+MAX_LOGGED_CHANGES = 1000
+
+class ManifestChange(TypedDict):
+    # The manifest version the file changed or went away in
+    version: int
+    FileName: str
+
+class ManifestLog(TypedDict):
+    # Goes up by one with every manifest that is published
+    version: int
+    # The oldest version whose changes are all still logged. A board that saw
+    # oldest - 1 or later can catch up with changes alone.
+    oldest: int
+    changes: list[ManifestChange]
+
+def read_log(path: str) -> Optional[ManifestLog]:
+    try:
+        with open(path) as f:
+            log = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(log, dict) or not isinstance(log.get('version'), int):
+        return None
+    return log
+
+def next_log(log: Optional[ManifestLog],
+             previous: list[FileInformation],
+             manifest: list[FileInformation],
+             max_changes: int=MAX_LOGGED_CHANGES) -> ManifestLog:
+    """ The log for manifest, published after previous.
+
+    Every file that was added, changed in any way or removed is logged under
+    the new version. Whole versions are dropped from the front once there
+    are more than max_changes, so a board is never sent half of one.
+    """
+
+    if log is None:
+        # Nothing before this can be caught up from
+        version = 1
+        log = {'version': 0, 'oldest': version, 'changes': []}
+    else:
+        version = log['version'] + 1
+
+    before = {f['FileName']: f for f in previous}
+    after = {f['FileName']: f for f in manifest}
+    changed = [name for name, file in after.items() if before.get(name) != file]
+    changed += [name for name in before if name not in after]
+
+    changes = log['changes'] + [{'version': version, 'FileName': name} for name in changed]
+    oldest = log['oldest']
+    while len(changes) > max_changes:
+        dropped = changes[0]['version']
+        changes = [c for c in changes if c['version'] > dropped]
+        oldest = dropped + 1
+
+    return {'version': version, 'oldest': oldest, 'changes': changes}
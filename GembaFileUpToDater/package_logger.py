@@ -0,0 +1,32 @@
+import logging
+import threading
+from typing import Any, Optional
+
+from GembaFileUpToDater.parse_args import should_show_debug
+
+class LazyLogger:
+    """ Stands in for a logger until the first message.
+
+    Every module used to set up the same logger with PaulsLoggerManagement
+    as it was imported. Now it's imported and set up once, when something is
+    first logged, after parse_args has decided whether to show debug.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._logger: Optional[logging.Logger] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> logging.Logger:
+        if self._logger is None:
+            with self._lock:
+                if self._logger is None:
+                    from PaulsLoggerManagement import setup_logger
+                    self._logger = setup_logger(self._name, level=(logging.DEBUG if should_show_debug() else logging.INFO))
+
+        return self._logger
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.get(), name)
+
+logger = LazyLogger("AccessGembaFiles")
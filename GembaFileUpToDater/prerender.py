@@ -0,0 +1,219 @@
+import functools
+import io
+import os
+import re
+import tempfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Optional
+
+from GembaFileUpToDater.content_store import SVG_DIR
+from GembaFileUpToDater.file_reconciliation import FileInformation, ImageVariant
+
+from GembaFileUpToDater.package_logger import logger
+
+RENDER_DIR = os.path.join(SVG_DIR, 'rendered')
+
+# The canvas sizes the boards draw at, from setWidth/setHeight in the static
+# boards. Each SVG is fitted inside every box keeping its aspect ratio.
+RENDER_SIZES: tuple[tuple[int, int], ...] = (
+    (752, 1080),
+    (781, 1260),
+    (1040, 1080),
+    (877, 540),
+    (877, 618),
+)
+
+# Rasterizing is CPU bound, but the kiosks are small machines
+DEFAULT_RENDER_WORKERS = min(os.cpu_count() or 1, 4)
+
+@functools.cache
+def load_cairosvg() -> Any:
+    """ cairosvg, or None when it isn't installed.
+
+    Imported the first time something needs rendering rather than with this
+    module, loading it and libcairo is a good part of a refresh where nothing
+    changed.
+    """
+
+    try:
+        import cairosvg  # type: ignore[import-not-found]
+    except (ImportError, OSError):
+        # OSError when the package is there but libcairo isn't
+        return None
+
+    return cairosvg
+
+def can_render() -> bool:
+    return load_cairosvg() is not None
+
+@functools.cache
+def render_format() -> str:
+
+    # Lossless WebP is a fraction of the size of PNG for these charts
+    from PIL import features
+    return 'webp' if features.check('webp') else 'png'
+
+def variant_path(content_hash: str, width: int, height: int) -> str:
+    return os.path.join(RENDER_DIR, f'{content_hash}-{width}x{height}.{render_format()}')
+
+def svg_size(path: str) -> Optional[tuple[float, float]]:
+    """ The intrinsic size of an SVG from its viewBox, or width and height. """
+
+    # Only the root element is needed, don't parse the rest
+    try:
+        with open(path, 'rb') as f:
+            for _, root in ET.iterparse(f, events=('start',)):
+                break
+            else:
+                return None
+    except (OSError, ET.ParseError):
+        return None
+
+    return svg_size_of(root)
+
+def svg_size_of(root: ET.Element) -> Optional[tuple[float, float]]:
+    """ The intrinsic size of an already parsed <svg> element. """
+
+    view_box = root.get('viewBox')
+    if view_box:
+        parts = re.split(r'[\s,]+', view_box.strip())
+        if len(parts) == 4:
+            try:
+                width, height = float(parts[2]), float(parts[3])
+            except ValueError:
+                pass
+            else:
+                if width > 0 and height > 0:
+                    return width, height
+
+    try:
+        width = float(re.sub(r'[a-z%]+$', '', root.get('width', '')))
+        height = float(re.sub(r'[a-z%]+$', '', root.get('height', '')))
+    except ValueError:
+        return None
+
+    return (width, height) if width > 0 and height > 0 else None
+
+def fit(size: tuple[float, float], box: tuple[int, int]) -> tuple[int, int]:
+    """ size scaled to fit inside box, the way drawImageToCanvas does it. """
+
+    scale = min(box[0] / size[0], box[1] / size[1])
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+def render_variants(svg_path: str, content_hash: str) -> list[ImageVariant]:
+    """ Rasterize one SVG at every RENDER_SIZES box it hasn't been rendered at yet.
+
+    Runs in a worker process. Bitmaps are named by the content hash, so a file
+    that comes back unchanged or is shared between boards is only rendered
+    once.
+    """
+
+    size = svg_size(svg_path)
+    if size is None:
+        logger.warning(f'Could not work out the size of {svg_path}, not pre-rendering it')
+        return []
+
+    variants: list[ImageVariant] = []
+    for width, height in dict.fromkeys(fit(size, box) for box in RENDER_SIZES):
+        path = variant_path(content_hash, width, height)
+        if not os.path.exists(path):
+            png = load_cairosvg().svg2png(url=svg_path, output_width=width, output_height=height)
+            __save_bitmap(png, path)
+
+        variants.append({'url': path.replace(os.sep, '/'), 'width': width, 'height': height})
+
+    return variants
+
+def __save_bitmap(png: bytes, path: str) -> None:
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if render_format() == 'png':
+                f.write(png)
+            else:
+                from PIL import Image
+                Image.open(io.BytesIO(png)).save(f, format=render_format(), lossless=True, method=4)
+        os.replace(temp_path, path)
+    except (OSError, ValueError, KeyError):
+        # PIL raises OSError for what it can't read (UnidentifiedImageError),
+        # ValueError for bad options and KeyError for a format it can't write
+        os.remove(temp_path)
+        raise
+
+def __variants_exist(file: FileInformation) -> bool:
+    variants = file.get('Variants')
+    return bool(variants) and all(os.path.exists(v['url']) for v in variants)
+
+def __needs_render(file: FileInformation) -> bool:
+
+    if 'ContentHash' not in file or not file['FileName'].lower().endswith('.svg'):
+        return False
+
+    if file.get('RenderFailedHash') == file['ContentHash'] or __variants_exist(file):
+        return False
+
+    return os.path.exists(os.path.join(SVG_DIR, file['FileName']))
+
+def render_files(files: list[FileInformation], max_workers: int=DEFAULT_RENDER_WORKERS) -> list[FileInformation]:
+    """ Make sure every file has its bitmaps and list them in its Variants.
+
+    Files are rendered in a process pool. A file that fails to render keeps
+    no Variants and boards carry on drawing its SVG. It isn't tried again
+    until its contents change. Does nothing when cairosvg isn't installed.
+    """
+
+    todo = [i for i, f in enumerate(files) if __needs_render(f)]
+    if len(todo) == 0:
+        return files
+
+    # Only now, when there's something to render, is cairosvg loaded
+    if not can_render():
+        logger.debug('cairosvg is not installed, boards will rasterize the SVGs themselves')
+        return files
+
+    os.makedirs(RENDER_DIR, exist_ok=True)
+    logger.info(f'Pre-rendering {len(todo)} files')
+
+    rendered = list(files)
+    with ProcessPoolExecutor(max_workers=max(1, min(max_workers, len(todo)))) as executor:
+        futures = {
+            i: executor.submit(render_variants, os.path.join(SVG_DIR, files[i]['FileName']), files[i]['ContentHash'])
+            for i in todo
+        }
+
+        for i, future in futures.items():
+            file = {**files[i]}
+            file.pop('Variants', None)
+            file.pop('RenderFailedHash', None)
+            try:
+                variants = future.result()
+            except Exception as e:
+                logger.warning(f'Failed to pre-render {files[i]["FileName"]}: {e}')
+                variants = []
+
+            if variants:
+                file['Variants'] = variants
+            else:
+                file['RenderFailedHash'] = files[i]['ContentHash']
+            rendered[i] = file  # type: ignore[assignment]
+
+    return rendered
+
+def prune_renders(content_hashes: set[str]) -> int:
+    """ Delete bitmaps of contents that aren't in the manifest any more. Returns how many. """
+
+    if not os.path.isdir(RENDER_DIR):
+        return 0
+
+    removed = 0
+    for entry in os.scandir(RENDER_DIR):
+        if entry.is_file() and entry.name.split('-', 1)[0] not in content_hashes:
+            os.remove(entry.path)
+            removed += 1
+
+    if removed:
+        logger.debug(f'Removed {removed} unused pre-rendered bitmaps')
+
+    return removed
@@ -0,0 +1,171 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, TypedDict
+
+import requests
+
+from GembaFileUpToDater.AccessGembaFiles import AccessGembaFiles, GembaFileReference
+from GembaFileUpToDater.epicor_communications import Ice_LIB_FileStoreSvc
+from GembaFileUpToDater.file_reconciliation import parse_post_date
+
+# Reads .env and points EpicorCommunicator at Kinetic, like a refresh does
+from GembaFileUpToDater.download_from_server import DOWNLOAD_WORKERS
+
+from GembaFileUpToDater.package_logger import logger
+
+# The newest version is what the boards show, the ones before it are kept so
+# a bad upload can be rolled back by hand
+DEFAULT_KEEP_VERSIONS = 3
+
+class PruneReport(TypedDict):
+    dry_run: bool
+    rows_before: int
+    # UD05 rows deleted, or that would be with dry_run
+    rows: int
+    # Files deleted from the file store. A file a newer row still points at
+    # is left alone.
+    files: int
+    # Decoded size of those files, None when sizes weren't measured
+    bytes: Optional[int]
+    failed: int
+
+class VersionResult(TypedDict):
+    row_deleted: bool
+    file_deleted: bool
+    size: Optional[int]
+
+def stale_versions(records: list[GembaFileReference], keep: int=DEFAULT_KEEP_VERSIONS) -> list[GembaFileReference]:
+    """ Every row but the newest keep of each FileName.
+
+    Versions are ordered by PostDate like newest_versions, and rows with the
+    same PostDate keep the order they were listed in, so the version the
+    boards show is always kept.
+    """
+
+    if keep < 1:
+        raise ValueError('At least the newest version of each file has to be kept')
+
+    by_name: dict[str, list[GembaFileReference]] = {}
+    for record in records:
+        by_name.setdefault(record['FileName'], []).append(record)
+
+    stale: list[GembaFileReference] = []
+    for versions in by_name.values():
+        # Stable, so the first listed of equal PostDates stays in front
+        versions = sorted(versions, key=lambda r: parse_post_date(r['PostDate']), reverse=True)
+        stale += versions[keep:]
+
+    return stale
+
+def prune_versions(keep: int=DEFAULT_KEEP_VERSIONS,
+                   dry_run: bool=False,
+                   max_workers: int=DOWNLOAD_WORKERS,
+                   measure_sizes: bool=True) -> PruneReport:
+    """ Delete all but the newest keep versions of every file.
+
+    Each stale version's file is deleted from the file store first and then
+    its UD05 row, so a file is never left in the store with no row pointing
+    at it. If deleting the file fails the row is kept for the next run to try
+    again. Up to max_workers versions are deleted at once.
+
+    With measure_sizes every stale file is streamed once to count its bytes.
+    With dry_run nothing is deleted, only counted.
+    """
+
+    records = AccessGembaFiles.get_records()
+    stale = stale_versions(records, keep)
+
+    # Two rows can point at the same file, only delete it once nothing kept does
+    stale_row_ids = {r['SysRowID'] for r in stale}
+    kept_files = {r['FileSysRowID'] for r in records if r['SysRowID'] not in stale_row_ids}
+    claimed: set[str] = set()
+    delete_file = []
+    for record in stale:
+        file_id = record['FileSysRowID']
+        delete_file.append(file_id not in kept_files and file_id not in claimed)
+        claimed.add(file_id)
+
+    logger.info(f'{len(records)} rows, {len(stale)} are older than the newest {keep} versions of their file'
+                + (', dry run' if dry_run else ''))
+
+    results: list[VersionResult] = []
+    if stale:
+        workers = max(1, min(max_workers, len(stale)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='gemba-prune') as executor:
+            results = list(executor.map(lambda args: __prune_version(*args, dry_run, measure_sizes),
+                                        zip(stale, delete_file)))
+
+    sizes = [r['size'] for r in results if r['file_deleted'] and r['size'] is not None]
+    report: PruneReport = {
+        'dry_run': dry_run,
+        'rows_before': len(records),
+        'rows': sum(r['row_deleted'] for r in results),
+        'files': sum(r['file_deleted'] for r in results),
+        'bytes': sum(sizes) if measure_sizes else None,
+        'failed': sum(not r['row_deleted'] for r in results),
+    }
+
+    verb = 'Would delete' if dry_run else 'Deleted'
+    reclaimed = f', {report["bytes"]} bytes' if report['bytes'] is not None else ''
+    logger.info(f'{verb} {report["rows"]} rows and {report["files"]} files{reclaimed}')
+    if report['failed']:
+        logger.warning(f'{report["failed"]} versions could not be deleted, the next run will try again')
+
+    return report
+
+def __prune_version(record: GembaFileReference, delete_file: bool, dry_run: bool, measure_sizes: bool) -> VersionResult:
+
+    file_id = record['FileSysRowID']
+    size: Optional[int] = None
+    file_exists = True
+
+    if delete_file and measure_sizes:
+        try:
+            size = __file_size(file_id)
+        except FileNotFoundError:
+            # Deleted by an earlier run that then failed on the row
+            file_exists = False
+        except (requests.RequestException, ValueError) as e:
+            logger.warning(f'Could not measure {record["FileName"]} at {file_id}: {e}')
+
+    if dry_run:
+        return {'row_deleted': True, 'file_deleted': delete_file and file_exists, 'size': size}
+
+    file_deleted = False
+    if delete_file and file_exists:
+        try:
+            Ice_LIB_FileStoreSvc.delete(file_id)
+            file_deleted = True
+        except requests.RequestException as e:
+            if __file_is_gone(file_id):
+                logger.debug(f'The file for {record["FileName"]} posted {record["PostDate"]} was already deleted')
+            else:
+                logger.warning(f'Failed to delete the file for {record["FileName"]} posted {record["PostDate"]}: {e}')
+                return {'row_deleted': False, 'file_deleted': False, 'size': None}
+
+    try:
+        # delete_record sets the flags on what it's given
+        AccessGembaFiles.delete_record({**record})
+    except requests.RequestException as e:
+        logger.warning(f'Failed to delete the row for {record["FileName"]} posted {record["PostDate"]}: {e}')
+        return {'row_deleted': False, 'file_deleted': file_deleted, 'size': size}
+
+    logger.debug(f'Deleted {record["FileName"]} posted {record["PostDate"]}')
+    return {'row_deleted': True, 'file_deleted': file_deleted, 'size': size}
+
+def __file_is_gone(file_id: str) -> bool:
+    try:
+        __file_size(file_id)
+    except FileNotFoundError:
+        return True
+    except (requests.RequestException, ValueError):
+        pass
+
+    return False
+
+def __file_size(file_id: str) -> int:
+    """ The decoded size of a stored file, streamed so it's never all in memory. """
+
+    with tempfile.TemporaryDirectory() as directory:
+        return Ice_LIB_FileStoreSvc.download_file(file_id, os.path.join(directory, 'measure'))
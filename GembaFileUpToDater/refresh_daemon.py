@@ -0,0 +1,206 @@
+import json
+import os
+import random
+import signal
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from typing import Callable, Literal, Optional, TypedDict
+
+from GembaFileUpToDater.download_from_server import download_new_files
+
+from GembaFileUpToDater.package_logger import logger
+
+class ScheduleEntry(TypedDict):
+    # Monday is 0
+    Weekdays: tuple[int, ...]
+    # (hour, minute)
+    Times: tuple[tuple[int, int], ...]
+    # Each run starts somewhere between its time and this much later, so the
+    # kiosks don't all hit Kinetic at once
+    Jitter: timedelta
+
+class RefreshStatus(TypedDict):
+    State: Literal['starting', 'idle', 'refreshing', 'stopped']
+    # Seconds from the process starting to being ready for the first cycle
+    StartupSeconds: Optional[float]
+    Cycles: int
+    LastCycleStart: Optional[str]
+    LastCycleSeconds: Optional[float]
+    LastCycleSucceeded: Optional[bool]
+    LastError: Optional[str]
+    NextCycle: Optional[str]
+
+WEEKDAYS = (0, 1, 2, 3, 4)
+
+# The same as refresh-image.timer and refresh-image-early.timer
+REFRESH_SCHEDULE: tuple[ScheduleEntry, ...] = (
+    {'Weekdays': WEEKDAYS, 'Times': tuple((hour, 0) for hour in range(5, 21)), 'Jitter': timedelta(minutes=15)},
+    {'Weekdays': WEEKDAYS, 'Times': ((5, 29),), 'Jitter': timedelta(minutes=3)},
+)
+
+# Where the daemon says what it's doing. It's in the web root, so it can be
+# checked at http://127.0.0.1:8000/refresh_status.json
+STATUS_FILE = 'refresh_status.json'
+
+# Never sleep longer than this in one go, so a clock change or a suspend
+# doesn't make us miss a run by hours
+MAX_SLEEP = 60.0
+
+def next_slot(after: datetime, schedule: tuple[ScheduleEntry, ...]=REFRESH_SCHEDULE) -> tuple[datetime, timedelta]:
+    """ The first scheduled time strictly after after, and its jitter. """
+
+    candidates = []
+    for days_ahead in range(8):
+        day = (after + timedelta(days=days_ahead)).date()
+        for entry in schedule:
+            if day.weekday() not in entry['Weekdays']:
+                continue
+            for hour, minute in entry['Times']:
+                slot = datetime(day.year, day.month, day.day, hour, minute)
+                if slot > after:
+                    candidates.append((slot, entry['Jitter']))
+
+        if candidates:
+            return min(candidates)
+
+    raise ValueError('The refresh schedule never runs')
+
+def previous_slot(before: datetime, schedule: tuple[ScheduleEntry, ...]=REFRESH_SCHEDULE) -> Optional[datetime]:
+    """ The last scheduled time at or before before, within the past week. """
+
+    slots = [
+        datetime(day.year, day.month, day.day, hour, minute)
+        for day in ((before - timedelta(days=days_back)).date() for days_back in range(8))
+        for entry in schedule if day.weekday() in entry['Weekdays']
+        for hour, minute in entry['Times']
+    ]
+    slots = [s for s in slots if s <= before]
+    return max(slots) if slots else None
+
+class RefreshDaemon:
+    """ Stay running and refresh on the schedule, or straight away on SIGHUP.
+
+    The interpreter, the imports, .env and Kinetic's HTTP sessions are all set
+    up once instead of for every refresh.
+    """
+
+    def __init__(self,
+                 schedule: tuple[ScheduleEntry, ...]=REFRESH_SCHEDULE,
+                 status_path: str=STATUS_FILE,
+                 refresh: Callable[[], None]=download_new_files,
+                 started_at: Optional[float]=None):
+        self.schedule = schedule
+        self.status_path = status_path
+        self.refresh = refresh
+        self._trigger = threading.Event()
+        self._stop = threading.Event()
+        self._status: RefreshStatus = {
+            'State': 'starting',
+            'StartupSeconds': None,
+            'Cycles': 0,
+            'LastCycleStart': None,
+            'LastCycleSeconds': None,
+            'LastCycleSucceeded': None,
+            'LastError': None,
+            'NextCycle': None,
+        }
+        self._started_at = started_at
+
+    def install_signal_handlers(self) -> None:
+        signal.signal(signal.SIGHUP, lambda signum, frame: self.trigger())
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: self.stop())
+
+    def trigger(self) -> None:
+        """ Refresh as soon as possible, out of schedule. """
+        self._trigger.set()
+
+    def stop(self) -> None:
+        """ Stop after the current cycle, if one is running. """
+        self._stop.set()
+        self._trigger.set()
+
+    def run_forever(self) -> None:
+        if self._started_at is not None:
+            self._status['StartupSeconds'] = round(time.perf_counter() - self._started_at, 3)
+
+        now = datetime.now()
+        last_slot = now
+
+        # Like Persistent=true on the timer, catch up on a run missed while we
+        # weren't running
+        missed = previous_slot(now, self.schedule)
+        last_run = self.__previous_cycle_start()
+        if missed is not None and (last_run is None or last_run < missed):
+            logger.info(f'Missed the refresh at {missed:%a %H:%M}, refreshing now')
+            self.trigger()
+
+        while not self._stop.is_set():
+            slot, jitter = next_slot(max(last_slot, datetime.now()), self.schedule)
+            run_at = slot + timedelta(seconds=random.uniform(0, jitter.total_seconds()))
+            self.__update_status(State='idle', NextCycle=run_at.isoformat(timespec='seconds'))
+            logger.debug(f'Next refresh at {run_at:%a %H:%M:%S}')
+
+            while not self._stop.is_set():
+                remaining = (run_at - datetime.now()).total_seconds()
+                if self._trigger.wait(timeout=max(0.0, min(remaining, MAX_SLEEP))):
+                    break
+                if remaining <= MAX_SLEEP:
+                    last_slot = slot
+                    break
+
+            if self._stop.is_set():
+                break
+
+            self._trigger.clear()
+            self.run_cycle()
+
+        self.__update_status(State='stopped', NextCycle=None)
+        logger.info('Refresh daemon stopped')
+
+    def run_cycle(self) -> None:
+        """ One refresh. Errors are logged and recorded, the daemon carries on. """
+
+        started = datetime.now()
+        start = time.perf_counter()
+        self.__update_status(State='refreshing', LastCycleStart=started.isoformat(timespec='seconds'))
+
+        error = None
+        try:
+            self.refresh()
+        except Exception as e:
+            # Whatever went wrong, the next cycle might go better
+            logger.error(f'Refresh failed: {e}\n{traceback.format_exc()}')
+            error = f'{type(e).__name__}: {e}'
+
+        seconds = time.perf_counter() - start
+        logger.info(f'Refresh took {seconds:.1f}s')
+        self.__update_status(
+            Cycles=self._status['Cycles'] + 1,
+            LastCycleSeconds=round(seconds, 3),
+            LastCycleSucceeded=error is None,
+            LastError=error,
+        )
+
+    def __previous_cycle_start(self) -> Optional[datetime]:
+        try:
+            with open(self.status_path, 'r') as f:
+                return datetime.fromisoformat(json.load(f)['LastCycleStart'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def __update_status(self, **changes) -> None:
+        self._status.update(changes)  # type: ignore[typeddict-item]
+
+        temp_path = self.status_path + '.part'
+        with open(temp_path, 'w') as f:
+            json.dump(self._status, f, indent=4)
+        os.replace(temp_path, self.status_path)
+
+def run_daemon(started_at: Optional[float]=None) -> None:
+    daemon = RefreshDaemon(started_at=started_at)
+    daemon.install_signal_handlers()
+    logger.info('Refresh daemon started, send SIGHUP to refresh now')
+    daemon.run_forever()
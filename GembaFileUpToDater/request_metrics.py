@@ -0,0 +1,252 @@
+import bisect
+import json
+import math
+import os
+import re
+import threading
+from datetime import datetime
+from typing import Optional, TypedDict
+from urllib.parse import urlsplit
+
+from GembaFileUpToDater.package_logger import logger
+
+# Upper bounds of the histogram buckets, Prometheus style. Anything larger
+# lands in the +Inf bucket.
+SECONDS_BUCKETS: tuple[float, ...] = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS: tuple[float, ...] = tuple(float(2 ** n) for n in range(10, 28, 2))
+
+# Written at the end of every refresh, in the web root next to the manifest
+METRICS_JSON_FILE = 'refresh_metrics.json'
+METRICS_PROMETHEUS_FILE = 'refresh_metrics.prom'
+
+class HistogramSummary(TypedDict):
+    count: int
+    sum: float
+    p50: Optional[float]
+    p95: Optional[float]
+    max: Optional[float]
+
+class EndpointSummary(TypedDict):
+    requests: int
+    retries: int
+    # How many responses had each status, 'error' for ones that never got one
+    statuses: dict[str, int]
+    # From sending the request to the body being read
+    seconds: HistogramSummary
+    # Until the response headers arrived, which is mostly the server working
+    server_seconds: HistogramSummary
+    payload_bytes: HistogramSummary
+
+class MetricsSummary(TypedDict):
+    started: str
+    finished: str
+    total_bytes: int
+    endpoints: dict[str, EndpointSummary]
+
+class Histogram:
+    """ Counts per bucket for exporting, and every value for exact percentiles.
+
+    A refresh makes at most a few hundred requests, so keeping the values is
+    cheap. Not thread safe on its own, RequestMetrics locks around it.
+    """
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.values: list[float] = []
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.values.append(value)
+        self.sum += value
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """ The nearest rank percentile, None before anything is observed. """
+
+        if not self.values:
+            return None
+
+        ordered = sorted(self.values)
+        rank = max(1, math.ceil(percent / 100 * len(ordered)))
+        return ordered[rank - 1]
+
+    def summary(self, digits: int=3) -> HistogramSummary:
+
+        def rounded(value: Optional[float]) -> Optional[float]:
+            if value is None:
+                return None
+            return round(value, digits) if digits > 0 else round(value)
+
+        return {
+            'count': len(self.values),
+            'sum': rounded(self.sum) or 0,
+            'p50': rounded(self.percentile(50)),
+            'p95': rounded(self.percentile(95)),
+            'max': rounded(max(self.values, default=None)),
+        }
+
+class EndpointMetrics:
+
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.statuses: dict[str, int] = {}
+        self.seconds = Histogram(SECONDS_BUCKETS)
+        self.server_seconds = Histogram(SECONDS_BUCKETS)
+        self.payload_bytes = Histogram(BYTES_BUCKETS)
+
+class RequestMetrics:
+    """ Latency, server time, size, status and retries of every request to
+    Kinetic, by endpoint.
+
+    Safe to record into from the download workers at the same time. Each
+    refresh writes a summary and then resets it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints: dict[str, EndpointMetrics] = {}
+        self._started = datetime.now()
+
+    def record(self,
+               endpoint: str,
+               seconds: float,
+               server_seconds: Optional[float],
+               payload_bytes: Optional[int],
+               status: Optional[int],
+               retries: int=0) -> None:
+
+        with self._lock:
+            metrics = self._endpoints.get(endpoint)
+            if metrics is None:
+                metrics = self._endpoints[endpoint] = EndpointMetrics()
+
+            metrics.requests += 1
+            metrics.retries += retries
+            status_name = str(status) if status is not None else 'error'
+            metrics.statuses[status_name] = metrics.statuses.get(status_name, 0) + 1
+            metrics.seconds.observe(seconds)
+            if server_seconds is not None:
+                metrics.server_seconds.observe(server_seconds)
+            if payload_bytes is not None:
+                metrics.payload_bytes.observe(payload_bytes)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._endpoints = {}
+            self._started = datetime.now()
+
+    def summary(self) -> MetricsSummary:
+
+        with self._lock:
+            endpoints: dict[str, EndpointSummary] = {
+                name: {
+                    'requests': m.requests,
+                    'retries': m.retries,
+                    'statuses': dict(m.statuses),
+                    'seconds': m.seconds.summary(),
+                    'server_seconds': m.server_seconds.summary(),
+                    'payload_bytes': m.payload_bytes.summary(digits=0),
+                }
+                for name, m in sorted(self._endpoints.items())
+            }
+
+            return {
+                'started': self._started.isoformat(timespec='seconds'),
+                'finished': datetime.now().isoformat(timespec='seconds'),
+                'total_bytes': int(sum(m.payload_bytes.sum for m in self._endpoints.values())),
+                'endpoints': endpoints,
+            }
+
+    def prometheus_text(self) -> str:
+        """ Everything in the Prometheus text format, for node_exporter's
+        textfile collector or anything else that reads it. """
+
+        lines = []
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+
+            lines += ['# HELP gemba_requests_total Requests sent to Kinetic by endpoint and status',
+                      '# TYPE gemba_requests_total counter']
+            for name, m in endpoints:
+                for status, count in sorted(m.statuses.items()):
+                    lines.append(f'gemba_requests_total{{endpoint="{RequestMetrics.__escape(name)}",status="{status}"}} {count}')
+
+            lines += ['# HELP gemba_request_retries_total Retries urllib3 made by endpoint',
+                      '# TYPE gemba_request_retries_total counter']
+            for name, m in endpoints:
+                lines.append(f'gemba_request_retries_total{{endpoint="{RequestMetrics.__escape(name)}"}} {m.retries}')
+
+            for metric, attribute, help_text in (
+                ('gemba_request_seconds', 'seconds', 'Time from sending a request to its body being read'),
+                ('gemba_request_server_seconds', 'server_seconds', 'Time until the response headers arrived'),
+                ('gemba_request_payload_bytes', 'payload_bytes', 'Size of the response body'),
+            ):
+                lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} histogram']
+                for name, m in endpoints:
+                    lines += RequestMetrics.__histogram_lines(metric, RequestMetrics.__escape(name), getattr(m, attribute))
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, json_path: str=METRICS_JSON_FILE, prometheus_path: Optional[str]=METRICS_PROMETHEUS_FILE) -> MetricsSummary:
+        """ Write the summary as JSON, and in the Prometheus format if
+        prometheus_path is given. Returns the summary. """
+
+        summary = self.summary()
+        RequestMetrics.__write_atomic(json_path, json.dumps(summary, indent=4))
+        if prometheus_path is not None:
+            RequestMetrics.__write_atomic(prometheus_path, self.prometheus_text())
+
+        return summary
+
+    @staticmethod
+    def __histogram_lines(metric: str, endpoint: str, histogram: Histogram) -> list[str]:
+
+        lines = []
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{endpoint="{endpoint}",le="{bound:g}"}} {cumulative}')
+
+        lines.append(f'{metric}_bucket{{endpoint="{endpoint}",le="+Inf"}} {len(histogram.values)}')
+        lines.append(f'{metric}_sum{{endpoint="{endpoint}"}} {histogram.sum:g}')
+        lines.append(f'{metric}_count{{endpoint="{endpoint}"}} {len(histogram.values)}')
+        return lines
+
+    @staticmethod
+    def __escape(label: str) -> str:
+        return label.replace('\\', '\\\\').replace('"', '\\"')
+
+    @staticmethod
+    def __write_atomic(path: str, text: str) -> None:
+
+        temp_path = path + '.part'
+        with open(temp_path, 'w') as f:
+            f.write(text)
+        os.replace(temp_path, path)
+
+def endpoint_name(url: str) -> str:
+    """ A short label for a Kinetic URL, like 'BAQ Data' or 'ReadAllBytes'. """
+
+    parts = [p for p in urlsplit(url).path.split('/') if p]
+    if 'odata' in parts:
+        # Drop everything up to and including the company
+        parts = parts[parts.index('odata') + 2:]
+
+    if not parts:
+        return 'unknown'
+
+    # Data('key') and the like
+    method = re.sub(r'\(.*\)$', '', parts[-1])
+    if parts[0] == 'BaqSvc':
+        return f'BAQ {method}'
+    return method
+
+def log_summary(summary: MetricsSummary) -> None:
+
+    for name, endpoint in summary['endpoints'].items():
+        seconds = endpoint['seconds']
+        logger.debug(f'{name}: {endpoint["requests"]} requests, p50 {seconds["p50"]}s, p95 {seconds["p95"]}s, '
+                     f'max {seconds["max"]}s, {int(endpoint["payload_bytes"]["sum"])} bytes, {endpoint["retries"]} retries')
+    logger.debug(f'{summary["total_bytes"]} bytes in total')
@@ -0,0 +1,170 @@
+import json
+import os
+import shutil
+from datetime import datetime
+from typing import Optional
+
+from GembaFileUpToDater import content_store, manifest_log
+from GembaFileUpToDater.file_reconciliation import FileInformation
+
+from GembaFileUpToDater.package_logger import logger
+
+# Every published refresh is a folder in here holding the manifest and hard
+# links to the files it lists
+SNAPSHOT_DIR = 'snapshots'
+
+# A symlink to the snapshot the web server should serve, swapped atomically
+CURRENT_LINK = 'current'
+
+MANIFEST_NAME = 'downloaded_ids.json'
+
+# Older snapshots are kept for browsers that are still loading from them
+KEEP_SNAPSHOTS = 3
+
+STAGING_PREFIX = '.staging-'
+
+def current_snapshot() -> Optional[str]:
+    """ The folder current points at, if there is one. """
+
+    if not os.path.islink(CURRENT_LINK):
+        return None
+
+    target = os.path.join(os.path.dirname(CURRENT_LINK), os.readlink(CURRENT_LINK))
+    return target if os.path.isdir(target) else None
+
+def content_hashes() -> set[str]:
+    """ The ContentHash of every file in every snapshot that's kept. """
+
+    hashes: set[str] = set()
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return hashes
+
+    for name in os.listdir(SNAPSHOT_DIR):
+        manifest_bytes = __read_bytes(os.path.join(SNAPSHOT_DIR, name, MANIFEST_NAME))
+        if manifest_bytes is None:
+            continue
+
+        try:
+            hashes.update(f['ContentHash'] for f in json.loads(manifest_bytes) if 'ContentHash' in f)
+        except (ValueError, TypeError):
+            logger.warning(f'Could not read the manifest of snapshot {name}')
+
+    return hashes
+
+def publish(manifest: list[FileInformation]) -> Optional[str]:
+    """ Make manifest and the files it lists what the web server serves.
+
+    The snapshot is built in a staging folder, renamed into place and then
+    current is switched over to it with a rename, so a reader sees either the
+    old set of files or the new one and never a mix. Nothing is published if
+    the manifest is the same as the current one. Returns the new snapshot.
+
+    Each snapshot also gets the next manifest_log, which files changed in
+    which version, so boards can ask for only what changed.
+    """
+
+    manifest_bytes = json.dumps(manifest, indent=4).encode()
+
+    current = current_snapshot()
+    current_bytes = __read_bytes(os.path.join(current, MANIFEST_NAME)) if current is not None else None
+    if current_bytes == manifest_bytes:
+        logger.debug('Nothing changed, keeping the current snapshot')
+        return None
+
+    previous_log = manifest_log.read_log(os.path.join(current, manifest_log.MANIFEST_LOG_NAME)) if current else None
+    previous = json.loads(current_bytes) if current_bytes is not None and previous_log is not None else []
+    log = manifest_log.next_log(previous_log, previous, manifest)
+
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    version = __new_version()
+    staging = os.path.join(SNAPSHOT_DIR, STAGING_PREFIX + version)
+    snapshot = os.path.join(SNAPSHOT_DIR, version)
+
+    try:
+        os.makedirs(os.path.join(staging, content_store.SVG_DIR))
+        for file in manifest:
+            __link_file(file, staging)
+
+        with open(os.path.join(staging, MANIFEST_NAME), 'wb') as f:
+            f.write(manifest_bytes)
+        with open(os.path.join(staging, manifest_log.MANIFEST_LOG_NAME), 'w') as f:
+            json.dump(log, f)
+
+        os.rename(staging, snapshot)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    __switch_current(snapshot)
+    logger.info(f'Published snapshot {version}, manifest version {log["version"]}')
+
+    remove_old_snapshots()
+    return snapshot
+
+def remove_old_snapshots(keep: int=KEEP_SNAPSHOTS) -> int:
+    """ Delete all but the newest keep snapshots, and any abandoned staging folders.
+
+    The snapshot current points at is never deleted. Returns how many were.
+    """
+
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return 0
+
+    current = current_snapshot()
+    current_name = os.path.basename(current) if current else None
+
+    names = sorted(os.listdir(SNAPSHOT_DIR), reverse=True)
+    versions = [n for n in names if not n.startswith('.')]
+    stale = [n for n in versions[keep:] if n != current_name]
+    stale += [n for n in names if n.startswith(STAGING_PREFIX)]
+
+    for name in stale:
+        shutil.rmtree(os.path.join(SNAPSHOT_DIR, name), ignore_errors=True)
+
+    if stale:
+        logger.debug(f'Removed {len(stale)} old snapshots')
+
+    return len(stale)
+
+def __new_version() -> str:
+
+    # Sorts in the order they were made
+    version = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+    while os.path.exists(os.path.join(SNAPSHOT_DIR, version)):
+        version += '_'
+    return version
+
+def __link_file(file: FileInformation, snapshot: str) -> None:
+    """ Hard link a file, its compressed copies and its bitmaps into snapshot. """
+
+    source = os.path.join(content_store.SVG_DIR, file['FileName'])
+    if not os.path.exists(source):
+        logger.warning(f'{file["FileName"]} is in the manifest but not in {content_store.SVG_DIR}')
+        return
+
+    paths = [source] + [source + ext for ext in content_store.SIDECAR_EXTENSIONS.values()]
+    paths += [v['url'] for v in file.get('Variants', [])]
+
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+
+        destination = os.path.join(snapshot, path)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        content_store.link_into(path, destination)
+
+def __switch_current(snapshot: str) -> None:
+
+    temp_link = f'{CURRENT_LINK}.{os.getpid()}.tmp'
+    if os.path.lexists(temp_link):
+        os.remove(temp_link)
+
+    os.symlink(snapshot, temp_link)
+    os.replace(temp_link, CURRENT_LINK)
+
+def __read_bytes(path: str) -> Optional[bytes]:
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
@@ -0,0 +1,350 @@
+from __future__ import annotations
+
+import copy
+import io
+import os
+import re
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from typing import TYPE_CHECKING, Optional, TypedDict
+
+if TYPE_CHECKING:
+    # PIL is only needed for the fidelity check, it's imported there
+    from PIL import Image
+
+from GembaFileUpToDater import prerender
+
+from GembaFileUpToDater.package_logger import logger
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+
+# Keep the usual prefixes when writing, instead of ns0:
+ET.register_namespace('', SVG_NS)
+ET.register_namespace('xlink', XLINK_NS)
+
+# Leftovers from the programs that made the file, nothing draws them
+EDITOR_NAMESPACES = (
+    'http://www.inkscape.org/namespaces/inkscape',
+    'http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd',
+    'http://ns.adobe.com/',
+    'http://schemas.microsoft.com/',
+)
+
+# Whitespace is part of the text in these
+TEXT_TAGS = {f'{{{SVG_NS}}}{tag}' for tag in ('text', 'tspan', 'textPath', 'title', 'desc', 'style')}
+
+# Attributes whose numbers are coordinates and can be rounded. Transforms are
+# left alone, a scale of 0.004 rounded to 0 would make everything disappear.
+COORDINATE_ATTRIBUTES = (
+    'd', 'points', 'x', 'y', 'x1', 'y1', 'x2', 'y2',
+    'cx', 'cy', 'r', 'rx', 'ry', 'width', 'height', 'stroke-width',
+)
+
+# Decimal places kept on coordinates. The boards draw at most about 1000px
+# across, a hundredth of a unit is far below a pixel.
+COORDINATE_PRECISION = 2
+
+# How far the rasterized result may move from the original. The mean
+# difference is per channel out of 255, changed pixels are ones that moved by
+# more than 32 in any channel.
+MAX_MEAN_DIFFERENCE = 0.5
+MAX_CHANGED_PIXELS = 0.002
+
+# The fidelity check renders at about the size the boards draw at
+CHECK_SIZE = (1040, 1080)
+
+NUMBER = re.compile(r'[-+]?(?:\d+\.\d*|\.\d+)(?:[eE][-+]?\d+)?')
+REFERENCE = re.compile(r'url\(\s*[\'"]?#([^\'")\s]+)|^#(.+)$')
+
+class OptimizeReport(TypedDict):
+    original_bytes: int
+    optimized_bytes: int
+    # Whether rounding and merging were kept, they are only used when the
+    # fidelity check could be run and passed
+    lossy: bool
+    seconds: float
+    # How long rasterizing took before and after, when cairosvg is installed
+    rasterize_before: Optional[float]
+    rasterize_after: Optional[float]
+
+def optimize_file(path: str) -> Optional[OptimizeReport]:
+    """ Shrink an SVG in place. Returns None if it couldn't be parsed.
+
+    Metadata, empty groups and unused defs are dropped and repeated inline
+    styles become classes, which never changes what is drawn. Rounding
+    coordinates and merging paths can, so they're only kept when the result
+    rasterizes within tolerance of the original.
+    """
+
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        original = f.read()
+
+    try:
+        root = ET.fromstring(original)
+    except ET.ParseError as e:
+        logger.warning(f'Not optimizing {path}, it is not valid XML: {e}')
+        return None
+
+    remove_metadata(root)
+    remove_unused_defs(root)
+    remove_empty_groups(root)
+    strip_whitespace(root)
+
+    # Paths are merged before their styles become classes, while an opacity
+    # can still be seen on them
+    rounded = copy.deepcopy(root) if prerender.can_render() else None
+
+    styles_to_classes(root)
+    optimized = ET.tostring(root, encoding='utf-8')
+    lossy = False
+
+    rasterize_before = rasterize_after = None
+    if rounded is not None:
+        reference, rasterize_before = __rasterize(original)
+
+        round_coordinates(rounded)
+        merge_paths(rounded)
+        styles_to_classes(rounded)
+        candidate = ET.tostring(rounded, encoding='utf-8')
+
+        result, rasterize_after = __rasterize(candidate)
+        if reference is not None and result is not None and __looks_the_same(reference, result):
+            optimized = candidate
+            lossy = True
+        else:
+            logger.debug(f'Rounding {path} changed how it looks, keeping the coordinates')
+            rasterize_after = __rasterize(optimized)[1]
+
+    if len(optimized) < len(original):
+        __write_atomic(path, optimized)
+    else:
+        optimized = original
+
+    return {
+        'original_bytes': len(original),
+        'optimized_bytes': len(optimized),
+        'lossy': lossy,
+        'seconds': time.perf_counter() - start,
+        'rasterize_before': rasterize_before,
+        'rasterize_after': rasterize_after,
+    }
+
+def remove_metadata(root: ET.Element) -> None:
+    """ Drop <metadata> and anything in an editor's namespace. """
+
+    for parent in list(root.iter()):
+        for child in list(parent):
+            if not isinstance(child.tag, str):
+                continue
+            if child.tag == f'{{{SVG_NS}}}metadata' or child.tag.startswith(tuple('{' + ns for ns in EDITOR_NAMESPACES)):
+                parent.remove(child)
+
+        for name in [n for n in parent.attrib if n.startswith(tuple('{' + ns for ns in EDITOR_NAMESPACES))]:
+            del parent.attrib[name]
+
+def remove_unused_defs(root: ET.Element) -> None:
+    """ Drop anything in <defs> nothing refers to. Repeats until nothing else goes. """
+
+    while True:
+        referenced = __referenced_ids(root)
+        removed = False
+        for defs in list(root.iter(f'{{{SVG_NS}}}defs')):
+            for child in list(defs):
+                # Anything without an id, like a <style>, is used by being there
+                if 'id' in child.attrib and child.get('id') not in referenced:
+                    defs.remove(child)
+                    removed = True
+
+        if not removed:
+            break
+
+    for parent in list(root.iter()):
+        for child in list(parent):
+            if child.tag == f'{{{SVG_NS}}}defs' and len(child) == 0:
+                parent.remove(child)
+
+def remove_empty_groups(root: ET.Element) -> None:
+    """ Drop <g> elements with nothing in them, innermost first. """
+
+    def visit(parent: ET.Element) -> None:
+        for child in list(parent):
+            visit(child)
+            if child.tag == f'{{{SVG_NS}}}g' and len(child) == 0 and not (child.text or '').strip() and 'id' not in child.attrib:
+                __remove_keeping_tail(parent, child)
+
+    visit(root)
+
+def strip_whitespace(root: ET.Element) -> None:
+    """ Drop indentation between elements, but not inside text. """
+
+    for parent in root.iter():
+        if parent.tag in TEXT_TAGS:
+            continue
+
+        if parent.text is not None and not parent.text.strip():
+            parent.text = None
+        for child in parent:
+            if child.tail is not None and not child.tail.strip():
+                child.tail = None
+
+def styles_to_classes(root: ET.Element) -> None:
+    """ Move style attributes that are repeated into classes in a <style>.
+
+    A class selector loses to rules the file already has where an inline
+    style would have won, so files that already have a <style> are left alone.
+    """
+
+    if next(root.iter(f'{{{SVG_NS}}}style'), None) is not None:
+        return
+
+    counts: dict[str, int] = {}
+    for element in root.iter():
+        style = element.get('style')
+        if style is not None and 'class' not in element.attrib:
+            style = __normalize_style(style)
+            counts[style] = counts.get(style, 0) + 1
+
+    repeated = sorted(s for s, count in counts.items() if count > 1 and s)
+    if len(repeated) == 0:
+        return
+
+    names = {style: f's{i:x}' for i, style in enumerate(repeated)}
+    for element in root.iter():
+        style = element.get('style')
+        if style is None or 'class' in element.attrib:
+            continue
+
+        name = names.get(__normalize_style(style))
+        if name is not None:
+            del element.attrib['style']
+            element.set('class', name)
+
+    style_element = ET.Element(f'{{{SVG_NS}}}style')
+    style_element.text = ''.join(f'.{name}{{{style}}}' for style, name in names.items())
+    root.insert(0, style_element)
+
+def round_coordinates(root: ET.Element, precision: int=COORDINATE_PRECISION) -> None:
+    """ Round every decimal in coordinate attributes to precision places. """
+
+    def round_number(match: re.Match) -> str:
+        # The sign may be all that separates this number from the one before
+        # it, M5-0.001 has to stay M5-0 and not become M50
+        number = match.group()
+        sign = number[0] if number[0] in '+-' else ''
+        rounded = f'{abs(float(number)):.{precision}f}'.rstrip('0').rstrip('.') or '0'
+        # Likewise the decimal point, M1.004.5 is two numbers and has to
+        # become M1 0.5 and not M10.5
+        if '.' not in rounded and match.string.startswith('.', match.end()):
+            rounded += ' '
+        return sign + rounded
+
+    for element in root.iter():
+        for name in COORDINATE_ATTRIBUTES:
+            value = element.get(name)
+            if value is not None:
+                element.set(name, NUMBER.sub(round_number, value))
+
+def merge_paths(root: ET.Element) -> None:
+    """ Join runs of sibling paths that only differ in their d into one path.
+
+    Paths with an id, markers or any kind of opacity are left alone, those
+    would draw differently once merged.
+    """
+
+    for parent in list(root.iter()):
+        previous = None
+        for child in list(parent):
+            if not __can_merge(child):
+                previous = None
+                continue
+
+            if (previous is not None
+                    and {k: v for k, v in child.attrib.items() if k != 'd'} == {k: v for k, v in previous.attrib.items() if k != 'd'}
+                    and child.get('d', '').lstrip().startswith('M')):
+                previous.set('d', previous.get('d', '') + ' ' + child.get('d', '').strip())
+                __remove_keeping_tail(parent, child)
+            else:
+                previous = child
+
+def __can_merge(element: ET.Element) -> bool:
+    if element.tag != f'{{{SVG_NS}}}path' or 'id' in element.attrib or len(element) > 0:
+        return False
+
+    attributes = ' '.join(f'{k}={v}' for k, v in element.attrib.items() if k != 'd')
+    return 'marker' not in attributes and 'opacity' not in attributes
+
+def __normalize_style(style: str) -> str:
+    return ';'.join(part.strip() for part in style.split(';') if part.strip())
+
+def __referenced_ids(root: ET.Element) -> set[str]:
+    referenced: set[str] = set()
+    for element in root.iter():
+        values = list(element.attrib.values())
+        if element.text and element.tag == f'{{{SVG_NS}}}style':
+            values.append(element.text)
+
+        for value in values:
+            for match in REFERENCE.finditer(value.strip()):
+                referenced.add(match.group(1) or match.group(2))
+
+    return referenced
+
+def __remove_keeping_tail(parent: ET.Element, child: ET.Element) -> None:
+    """ Remove child without losing any text that came after it. """
+
+    if child.tail and child.tail.strip():
+        index = list(parent).index(child)
+        if index > 0:
+            previous = parent[index - 1]
+            previous.tail = (previous.tail or '') + child.tail
+        else:
+            parent.text = (parent.text or '') + child.tail
+
+    parent.remove(child)
+
+def __rasterize(svg: bytes) -> tuple[Optional[Image.Image], Optional[float]]:
+    """ The SVG drawn at the fidelity check size and how long that took. """
+
+    start = time.perf_counter()
+    try:
+        root = ET.fromstring(svg)
+        size = prerender.svg_size_of(root) or CHECK_SIZE
+        width, height = prerender.fit(size, CHECK_SIZE)
+        png = prerender.load_cairosvg().svg2png(bytestring=svg, output_width=width, output_height=height)
+    except Exception as e:
+        logger.debug(f'Could not rasterize for the fidelity check: {e}')
+        return None, None
+
+    seconds = time.perf_counter() - start
+
+    from PIL import Image
+    return Image.open(io.BytesIO(png)).convert('RGBA'), seconds
+
+def __looks_the_same(reference: Image.Image, result: Image.Image) -> bool:
+
+    from PIL import ImageChops, ImageStat
+
+    if reference.size != result.size:
+        return False
+
+    difference = ImageChops.difference(reference, result)
+    mean = sum(ImageStat.Stat(difference).mean) / 4
+
+    # The largest change in any channel, per pixel
+    channels = difference.split()
+    largest = channels[0]
+    for channel in channels[1:]:
+        largest = ImageChops.lighter(largest, channel)
+    changed = sum(largest.histogram()[33:])
+
+    return mean <= MAX_MEAN_DIFFERENCE and changed <= MAX_CHANGED_PIXELS * reference.width * reference.height
+
+def __write_atomic(path: str, data: bytes) -> None:
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.', suffix='.part')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
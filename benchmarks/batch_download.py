@@ -0,0 +1,59 @@
+""" Round trips and wall-clock time of download_files one file at a time
+against one ReadAllFiles request.
+
+--excluded files are left out of the ReadAllFiles response, so the batch has
+to fall back to fetching them one by one.
+
+Run from the repository root:
+
+    python -m benchmarks.batch_download [--files 32] [--latency 0.25] [--excluded 2]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.getcwd())
+
+from benchmarks.mock_kinetic import MockKinetic, use_mock_server
+from GembaFileUpToDater.epicor_communications import EpicorCommunicator
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=32)
+    parser.add_argument('--latency', type=float, default=0.25, help='seconds the mock server waits per request')
+    parser.add_argument('--size', type=int, default=64 * 1024, help='bytes per file')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--excluded', type=int, default=2, help='files ReadAllFiles does not return')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir, MockKinetic(latency=args.latency) as mock:
+        downloader = use_mock_server(mock, work_dir)
+        EpicorCommunicator.pool_size = max(EpicorCommunicator.pool_size, args.workers)
+        os.makedirs('svg_files', exist_ok=True)
+
+        files = []
+        for i in range(args.files):
+            sys_id = f'sys-{i:04d}'
+            mock.add_file(sys_id, f'file_{i}.bin', os.urandom(args.size), '2025-01-01T00:00:00', i)
+            files.append({'SysID': sys_id, 'FileName': f'file_{i}.bin', 'DatePosted': '2025-01-01T00:00:00', 'SequenceNumber': f'{i:05d}'})
+        mock.batch_excluded = {f['SysID'] for f in files[:args.excluded]}
+
+        print(f'{args.files} files of {args.size} bytes, {args.latency}s server latency, {args.workers} workers, '
+              f'{args.excluded} missing from ReadAllFiles')
+        print(f'{"mode":>9} {"round trips":>12} {"ReadAllBytes":>13} {"ReadAllFiles":>13} {"seconds":>8}')
+        for mode, batch in (('per file', False), ('batch', True)):
+            mock.reset_counts()
+            started = time.perf_counter()
+            downloaded = downloader.download_files(files, max_workers=args.workers, batch=batch)
+            elapsed = time.perf_counter() - started
+
+            assert len(downloaded) == len(files), f'only {len(downloaded)} of {len(files)} downloaded'
+            read_all_bytes, read_all_files = mock.count('ReadAllBytes'), mock.count('ReadAllFiles')
+            print(f'{mode:>9} {read_all_bytes + read_all_files:>12} {read_all_bytes:>13} {read_all_files:>13} {elapsed:>8.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+""" A rough model of a kiosk browser loading a board, for the server benchmarks.
+
+It finds what a board page pulls in (scripts, stylesheets, images and the
+manifest), then fetches it the way Chromium would on the 15 minute reload:
+anything still fresh in its cache is not requested, anything stale is
+revalidated with If-None-Match / If-Modified-Since.
+"""
+import http.client
+import json
+import os
+import re
+import time
+from html.parser import HTMLParser
+from typing import Optional
+from urllib.parse import quote, unquote
+
+from GembaFileUpToDater.board_layouts import BOARDS_DIR, layout_images
+
+
+class _AssetParser(HTMLParser):
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.assets: list[str] = []
+        self.board: Optional[str] = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'body' and attrs.get('data-board'):
+            self.board = attrs['data-board']
+        url = attrs.get('src') if tag in ('script', 'img') else attrs.get('href') if tag == 'link' else None
+        if url and not url.startswith(('http:', 'https:', 'data:')):
+            self.assets.append(url)
+
+
+def board_assets(root: str, page: str) -> list[str]:
+    """ Every same-origin URL page loads, plus the manifest the scripts poll.
+
+    A board page's images come from its layout in boards/.
+    """
+
+    parser = _AssetParser()
+    with open(os.path.join(root, page), encoding='utf-8') as f:
+        parser.feed(f.read())
+
+    urls = ['/' + page] + ['/' + a.lstrip('/') for a in parser.assets]
+    if parser.board:
+        layout_url = f'{BOARDS_DIR}/{parser.board}.json'
+        with open(os.path.join(root, layout_url), encoding='utf-8') as f:
+            urls += ['/' + layout_url] + [f'/svg_files/{file}' for file in layout_images(json.load(f))]
+    urls.append('/downloaded_ids.json')
+    return list(dict.fromkeys(quote(u, safe='/?=&') for u in urls))
+
+
+def url_to_path(root: str, url: str) -> str:
+    return os.path.join(root, unquote(url.lstrip('/').split('?')[0]))
+
+
+class CachedEntry:
+
+    def __init__(self, headers: dict[str, str], fetched_at: float) -> None:
+        self.etag = headers.get('etag')
+        self.last_modified = headers.get('last-modified')
+        self.fetched_at = fetched_at
+        self.no_store = 'no-store' in headers.get('cache-control', '')
+
+        match = re.search(r'max-age=(\d+)', headers.get('cache-control', ''))
+        self.max_age = int(match.group(1)) if match and 'no-cache' not in headers.get('cache-control', '') else 0
+
+    def is_fresh(self, now: float) -> bool:
+        return now - self.fetched_at < self.max_age
+
+
+class BoardClient:
+
+    def __init__(self, host: str, port: int, accept_encoding: Optional[str]=None) -> None:
+        self.host = host
+        self.port = port
+        self.accept_encoding = accept_encoding
+        self.cache: dict[str, CachedEntry] = {}
+
+    def load(self, urls: list[str]) -> dict[str, int]:
+        """ Load every url once over a keep-alive connection. """
+
+        totals = {'requests': 0, 'bytes': 0, 'not_modified': 0, 'from_cache': 0}
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+
+        try:
+            for url in urls:
+                now = time.time()
+                cached = self.cache.get(url)
+                if cached is not None and cached.is_fresh(now):
+                    totals['from_cache'] += 1
+                    continue
+
+                headers = {}
+                if self.accept_encoding:
+                    headers['Accept-Encoding'] = self.accept_encoding
+                if cached is not None and not cached.no_store:
+                    if cached.etag:
+                        headers['If-None-Match'] = cached.etag
+                    if cached.last_modified:
+                        headers['If-Modified-Since'] = cached.last_modified
+
+                connection.request('GET', url, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+                response_headers = {k.lower(): v for k, v in response.getheaders()}
+
+                totals['requests'] += 1
+                totals['bytes'] += len(body) + sum(len(k) + len(v) + 4 for k, v in response.getheaders()) + 17
+                if response.status == 304:
+                    totals['not_modified'] += 1
+                    if cached is not None:
+                        cached.fetched_at = now
+                elif response.status == 200:
+                    self.cache[url] = CachedEntry(response_headers, now)
+
+                if response_headers.get('connection', '').lower() == 'close' or response.will_close:
+                    connection.close()
+                    connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        finally:
+            connection.close()
+
+        return totals
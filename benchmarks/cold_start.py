@@ -0,0 +1,110 @@
+""" How long index.py takes when nothing has changed, and what it imports.
+
+Every timer run starts a new python, so on the kiosks start-up is most of a
+refresh that finds nothing new. This runs that refresh in a fresh interpreter
+with -X importtime against the mock Kinetic server, lists the slowest imports
+and fails when it goes over --budget, or when something that's only needed
+for new files (PIL, cairosvg, pandas) gets imported anyway.
+
+Run from the repository root:
+
+    python -m benchmarks.cold_start [--budget 1.0] [--files 16] [--runs 5]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.getcwd())
+
+from benchmarks.mock_kinetic import MockKinetic, use_mock_server
+
+# What index.py does, pointed at the mock server
+REFRESH = '''
+import sys
+sys.path.insert(0, {repo!r})
+from GembaFileUpToDater.parse_args import parse_args
+parse_args()
+from GembaFileUpToDater.epicor_communications import EpicorCommunicator
+from GembaFileUpToDater import download_from_server
+EpicorCommunicator.url_domain = {url!r}
+download_from_server.download_new_files()
+print(' '.join(m for m in {heavy!r} if m in sys.modules))
+'''
+
+# Only needed when there are new files to optimize or render
+HEAVY_MODULES = ('PIL', 'cairosvg', 'pandas')
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def top_level_imports(stderr: str) -> dict[str, float]:
+    """ Cumulative seconds of every import that wasn't made by another import. """
+
+    times = {}
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match and len(match.group(3)) == 1:
+            times[match.group(4)] = int(match.group(2)) / 1e6
+    return times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--budget', type=float, default=1.0, help='seconds for the whole refresh')
+    parser.add_argument('--files', type=int, default=16)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    repo = os.getcwd()
+    with MockKinetic(latency=args.latency) as mock, tempfile.TemporaryDirectory() as work_dir:
+        for i in range(args.files):
+            contents = f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 200 100"><rect width="{i + 1}" height="5"/></svg>'.encode()
+            mock.add_file(f'id{i}', f'board_{i}.svg', contents, f'2025-01-01T00:00:{i:02d}', i + 1)
+
+        # Download everything first, so the timed runs find nothing new
+        use_mock_server(mock, work_dir).download_new_files()
+
+        script = REFRESH.format(repo=repo, url=mock.url_domain, heavy=HEAVY_MODULES)
+        totals, imports, loaded = [], [], set()
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            result = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', script, 'false'],
+                cwd=work_dir, capture_output=True, text=True, check=True,
+            )
+            totals.append(time.perf_counter() - start)
+            imports.append(top_level_imports(result.stderr))
+            lines = result.stdout.splitlines()
+            loaded.update(lines[-1].split() if lines else [])
+
+    total = statistics.median(totals)
+    import_total = statistics.median(sum(times.values()) for times in imports)
+    slowest = sorted(imports[-1].items(), key=lambda item: item[1], reverse=True)[:args.top]
+
+    print(f'No changes refresh of {args.files} files, {args.latency * 1000:.0f} ms per Kinetic request, median of {args.runs}')
+    print(f'  total:   {total:.2f}s (budget {args.budget:.2f}s)')
+    print(f'  imports: {import_total:.2f}s')
+    print('  slowest imports:')
+    for name, seconds in slowest:
+        print(f'    {seconds * 1000:7.1f} ms  {name}')
+
+    failures = []
+    if total > args.budget:
+        failures.append(f'took {total:.2f}s, over the {args.budget:.2f}s budget')
+    if loaded:
+        failures.append(f'imported {", ".join(sorted(loaded))} with nothing to render')
+
+    if failures:
+        print('FAILED: ' + '; '.join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
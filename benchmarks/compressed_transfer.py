@@ -0,0 +1,101 @@
+""" Transfer size and time to first paint of a board with pre-compressed SVGs.
+
+The board is built the same way as static_cache_transfer, then every SVG gets
+the sidecars content_store writes on download. A cold load is made with each
+Accept-Encoding a kiosk might send.
+
+Time to first paint is estimated, not measured in a browser: the time the
+local load took, plus how long the bytes would take over a --mbps link, plus
+decompressing the SVGs on the client.
+
+Run from the repository root:
+
+    python -m benchmarks.compressed_transfer [--page Machining.html] [--svg-kib 2048] [--mbps 20]
+"""
+import argparse
+import gzip
+import os
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import HTTPServer
+
+sys.path.insert(0, os.getcwd())
+
+from benchmarks.board_client import BoardClient, url_to_path
+from benchmarks.static_cache_transfer import QuietCachingHandler, build_site
+from GembaFileUpToDater import content_store
+
+ACCEPT_ENCODINGS = (
+    ('identity', None),
+    ('gzip', 'gzip, deflate'),
+    ('br', 'gzip, deflate, br'),
+)
+
+
+def decode_seconds(site: str, urls: list[str], encoding: str) -> float:
+    """ How long the client spends undoing the encoding on every SVG. """
+
+    if encoding == 'identity':
+        return 0.0
+
+    extension = content_store.SIDECAR_EXTENSIONS[encoding]
+    start = time.perf_counter()
+    for url in urls:
+        path = url_to_path(site, url) + extension
+        if not url.endswith('.svg') or not os.path.exists(path):
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        if encoding == 'gzip':
+            gzip.decompress(data)
+        else:
+            content_store.brotli.decompress(data)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--page', default='Machining.html')
+    parser.add_argument('--svg-kib', type=int, default=2048)
+    parser.add_argument('--mbps', type=float, default=20.0, help='link speed to the kiosk')
+    args = parser.parse_args()
+
+    repo_root = os.getcwd()
+    with tempfile.TemporaryDirectory() as site:
+        urls = build_site(repo_root, site, args.page, args.svg_kib * 1024)
+
+        start = time.perf_counter()
+        for url in urls:
+            if url.endswith('.svg'):
+                content_store.compress_blob(url_to_path(site, url))
+        print(f'{args.page}: {len(urls)} assets, compressing the SVGs took {time.perf_counter() - start:.2f}s (once per download)')
+
+        server = HTTPServer(('127.0.0.1', 0), partial(QuietCachingHandler, directory=site))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        print(f'{"encoding":>9} {"KiB sent":>10} {"load ms":>8} {"link ms":>8} {"decode ms":>10} {"first paint ms":>15}')
+        try:
+            for name, accept_encoding in ACCEPT_ENCODINGS:
+                if name == 'br' and content_store.brotli is None:
+                    print(f'{name:>9}  skipped, brotli is not installed')
+                    continue
+
+                client = BoardClient(*server.server_address[:2], accept_encoding=accept_encoding)
+                start = time.perf_counter()
+                totals = client.load(urls)
+                load = time.perf_counter() - start
+
+                link = totals['bytes'] * 8 / (args.mbps * 1_000_000)
+                decode = decode_seconds(site, urls, name)
+                print(f'{name:>9} {totals["bytes"] / 1024:>10.1f} {load * 1000:>8.1f} {link * 1000:>8.1f} '
+                      f'{decode * 1000:>10.1f} {(load + link + decode) * 1000:>15.1f}')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+""" N simulated boards reloading against the single threaded and pooled servers.
+
+Each board loads a page and all of its SVGs, then polls downloaded_ids.json.
+One extra client downloads the largest SVG at a crawl to show what a slow
+reader does to everyone else.
+
+Run from the repository root:
+
+    python -m benchmarks.concurrent_boards [--boards 12] [--workers 8]
+"""
+import argparse
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+
+sys.path.insert(0, os.getcwd())
+
+from benchmarks.board_client import BoardClient
+from benchmarks.static_cache_transfer import build_site
+from nocache_server import make_handler, make_server
+
+
+def quiet(handler):
+    return type(f'Quiet{handler.__name__}', (handler,), {'log_message': lambda self, format, *args: None})
+
+
+def slow_reader(address: tuple[str, int], url: str, stop: threading.Event) -> None:
+    """ Request url and read it 4 KiB at a time, four times a second. """
+
+    while not stop.is_set():
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            # A small window has to be set before connecting to stick
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+            sock.connect(address)
+            sock.sendall(f'GET {url} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n'.encode())
+            while not stop.is_set() and sock.recv(4096):
+                time.sleep(0.25)
+
+
+def run(args, site: str, urls: list[str], workers: int) -> tuple[float, list[float]]:
+    handler = quiet(make_handler(cache=False, keep_alive=workers > 0))
+    server = make_server('127.0.0.1', 0, workers, partial(handler, directory=site))  # type: ignore[arg-type]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    address = server.server_address[:2]
+
+    stop = threading.Event()
+    latencies: list[float] = []
+    lock = threading.Lock()
+
+    def board() -> None:
+        client = BoardClient(*address)
+        for _ in range(args.reloads):
+            started = time.perf_counter()
+            client.load(urls)
+            for _ in range(args.polls):
+                client.load(['/downloaded_ids.json'])
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    slow = [u for u in urls if u.endswith('.svg')][:1]
+    if args.slow_reader and slow:
+        threading.Thread(target=slow_reader, args=(address, slow[0], stop), daemon=True).start()
+        time.sleep(0.2)
+
+    started = time.perf_counter()
+    boards = [threading.Thread(target=board) for _ in range(args.boards)]
+    for t in boards:
+        t.start()
+    for t in boards:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    server.shutdown()
+    server.server_close()
+    return elapsed, latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--boards', type=int, default=12)
+    parser.add_argument('--reloads', type=int, default=3)
+    parser.add_argument('--polls', type=int, default=5, help='manifest polls after each reload')
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 4, 16],
+                        help='server worker counts to try, 0 is the single threaded server')
+    parser.add_argument('--page', default='Machining.html')
+    parser.add_argument('--svg-kib', type=int, default=1024)
+    parser.add_argument('--no-slow-reader', dest='slow_reader', action='store_false')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as site:
+        urls = build_site(os.getcwd(), site, args.page, args.svg_kib * 1024)
+        print(f'{args.boards} boards x {args.reloads} reloads of {args.page}, slow reader: {args.slow_reader}')
+        print(f'{"workers":>8} {"total s":>8} {"p50 s":>7} {"p95 s":>7} {"max s":>7}')
+
+        for workers in args.workers:
+            elapsed, latencies = run(args, site, urls, workers)
+            latencies.sort()
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            print(f'{workers:>8} {elapsed:>8.2f} {statistics.median(latencies):>7.3f} {p95:>7.3f} {latencies[-1]:>7.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+""" A refresh from a fresh interpreter, like the timer runs index.py, against a
+cycle of the resident daemon.
+
+Both refresh the same files from the mock Kinetic server. Nothing changes
+between refreshes, so what's left is start-up cost and the round trips.
+
+Run from the repository root:
+
+    python -m benchmarks.daemon_vs_cold_start [--files 16] [--runs 3] [--latency 0.05]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.getcwd())
+
+from benchmarks.mock_kinetic import MockKinetic, use_mock_server
+
+COLD_START = '''
+import sys, time
+started = time.perf_counter()
+sys.path.insert(0, {repo!r})
+from GembaFileUpToDater.parse_args import parse_args
+parse_args()
+from GembaFileUpToDater.epicor_communications import EpicorCommunicator
+from GembaFileUpToDater import download_from_server
+EpicorCommunicator.url_domain = {url!r}
+imported = time.perf_counter()
+download_from_server.download_new_files()
+print(imported - started)
+'''
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=16)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    repo = os.getcwd()
+    with MockKinetic(latency=args.latency) as mock, tempfile.TemporaryDirectory() as work_dir:
+        for i in range(args.files):
+            contents = f'<svg xmlns="http://www.w3.org/2000/svg"><rect width="{i + 1}" height="5"/></svg>'.encode()
+            mock.add_file(f'id{i}', f'board_{i}.svg', contents, f'2025-01-01T00:00:{i:02d}', i + 1)
+
+        download_from_server = use_mock_server(mock, work_dir)
+        from GembaFileUpToDater.refresh_daemon import RefreshDaemon
+
+        # The first refresh downloads everything, time the ones after it
+        download_from_server.download_new_files()
+
+        cold_imports, cold_totals = [], []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            output = subprocess.run(
+                [sys.executable, '-c', COLD_START.format(repo=repo, url=mock.url_domain), 'false'],
+                cwd=work_dir, capture_output=True, text=True, check=True,
+            ).stdout.split()
+            cold_totals.append(time.perf_counter() - start)
+            cold_imports.append(float(output[-1]))
+
+        daemon = RefreshDaemon(status_path=os.path.join(work_dir, 'refresh_status.json'),
+                               refresh=download_from_server.download_new_files)
+        cycles = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            daemon.run_cycle()
+            cycles.append(time.perf_counter() - start)
+
+        print(f'{args.files} files, {args.latency * 1000:.0f} ms per Kinetic request, median of {args.runs}')
+        print(f'  fresh interpreter: {statistics.median(cold_totals):.2f}s '
+              f'(of which imports and .env {statistics.median(cold_imports):.2f}s)')
+        print(f'  daemon cycle:      {statistics.median(cycles):.2f}s')
+
+
+if __name__ == '__main__':
+    main()
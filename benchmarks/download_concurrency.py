@@ -0,0 +1,58 @@
+""" Wall-clock time of download_files with 1, 4 and 16 workers.
+
+Run from the repository root:
+
+    python -m benchmarks.download_concurrency [--files 32] [--latency 0.25]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.getcwd())
+
+from benchmarks.mock_kinetic import MockKinetic, use_mock_server
+from GembaFileUpToDater.epicor_communications import EpicorCommunicator
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=32)
+    parser.add_argument('--latency', type=float, default=0.25, help='seconds the mock server waits per request')
+    parser.add_argument('--size', type=int, default=256 * 1024, help='bytes per file')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir, MockKinetic(latency=args.latency) as mock:
+        downloader = use_mock_server(mock, work_dir)
+        EpicorCommunicator.pool_size = max(args.workers)
+        os.makedirs('svg_files', exist_ok=True)
+
+        # Not .svg, so the optimizer stays out of the timings (and out of
+        # the way of random bytes)
+        files = []
+        for i in range(args.files):
+            sys_id = f'sys-{i:04d}'
+            mock.add_file(sys_id, f'file_{i}.bin', os.urandom(args.size), '2025-01-01T00:00:00', i)
+            files.append({'SysID': sys_id, 'FileName': f'file_{i}.bin', 'DatePosted': '2025-01-01T00:00:00', 'SequenceNumber': f'{i:05d}'})
+
+        stats_before = EpicorCommunicator.connection_stats()
+        print(f'{args.files} files of {args.size} bytes, {args.latency}s server latency')
+        print(f'{"workers":>8} {"seconds":>10} {"files/s":>10}')
+        for workers in args.workers:
+            started = time.perf_counter()
+            downloaded = downloader.download_files(files, max_workers=workers)
+            elapsed = time.perf_counter() - started
+
+            assert len(downloaded) == len(files), f'only {len(downloaded)} of {len(files)} downloaded'
+            print(f'{workers:>8} {elapsed:>10.3f} {len(files) / elapsed:>10.1f}')
+
+        stats = EpicorCommunicator.connection_stats()
+        print(f'{stats["requests"] - stats_before["requests"]} requests, '
+              f'{stats["new_connections"] - stats_before["new_connections"]} new connections, '
+              f'{stats["reused_connections"] - stats_before["reused_connections"]} reused')
+
+
+if __name__ == '__main__':
+    main()
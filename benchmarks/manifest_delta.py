@@ -0,0 +1,118 @@
+""" What a board's manifest poll costs with /manifest?since= instead of the whole manifest.
+
+A day of refreshes is published as snapshots, each changing --changed of the
+--files images, and --boards boards poll after every refresh. Each board polls
+both ways: downloaded_ids.json, which is the whole manifest every time, and
+/manifest?since=<the version it saw last>. Every --reconnect-every-th board
+sleeps and only polls every --reconnect-every refreshes, to show catching up
+is still small.
+
+Run from the repository root:
+
+    python -m benchmarks.manifest_delta [--boards 12] [--refreshes 96]
+"""
+import argparse
+import hashlib
+import http.client
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+from functools import partial
+
+sys.path.insert(0, os.getcwd())
+
+from nocache_server import MANIFEST_DELTA_PATH, make_handler, make_server
+
+
+def quiet(handler):
+    return type(f'Quiet{handler.__name__}', (handler,), {'log_message': lambda self, format, *args: None})
+
+
+def manifest_for(sequence: dict[str, int]) -> list[dict]:
+    return [
+        {'FileName': name, 'SysID': name, 'DatePosted': '', 'SequenceNumber': f'{seq:05d}',
+         'ContentHash': hashlib.sha256(f'{name}{seq}'.encode()).hexdigest()}
+        for name, seq in sequence.items()
+    ]
+
+
+def fetch(connection: http.client.HTTPConnection, path: str) -> bytes:
+    connection.request('GET', path)
+    return connection.getresponse().read()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--boards', type=int, default=12)
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--changed', type=int, default=3, help='images changed per refresh')
+    parser.add_argument('--refreshes', type=int, default=96, help='a day at one every 15 minutes')
+    parser.add_argument('--reconnect-every', type=int, default=8)
+    args = parser.parse_args()
+
+    from GembaFileUpToDater import snapshots
+
+    site = tempfile.mkdtemp()
+    repo_root = os.getcwd()
+    try:
+        os.chdir(site)
+        os.makedirs('svg_files')
+        sequence = {f'board_{i}.svg': 0 for i in range(args.files)}
+        for name in sequence:
+            with open(os.path.join('svg_files', name), 'w') as f:
+                f.write('<svg xmlns="http://www.w3.org/2000/svg"/>')
+        snapshots.publish(manifest_for(sequence))  # type: ignore[arg-type]
+
+        handler = quiet(make_handler(cache=False, keep_alive=True))
+        server = make_server('127.0.0.1', 0, 4, partial(handler, directory=site))  # type: ignore[arg-type]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        connection = http.client.HTTPConnection(*server.server_address[:2])
+
+        cursors = [json.loads(fetch(connection, MANIFEST_DELTA_PATH))['version'] for _ in range(args.boards)]
+        full_sizes: list[int] = []
+        delta_sizes: list[int] = []
+        catch_up_sizes: list[int] = []
+        missed = 0
+
+        names = list(sequence)
+        for refresh in range(1, args.refreshes + 1):
+            for i in range(args.changed):
+                sequence[names[(refresh * args.changed + i) % len(names)]] = refresh
+            snapshots.publish(manifest_for(sequence))  # type: ignore[arg-type]
+
+            for board in range(args.boards):
+                # Some boards sleep and only poll every --reconnect-every refreshes
+                asleep = board % args.reconnect_every == 0 and refresh % args.reconnect_every
+                if asleep and refresh < args.refreshes:
+                    continue
+
+                full_sizes.append(len(fetch(connection, '/downloaded_ids.json')))
+                body = fetch(connection, f'{MANIFEST_DELTA_PATH}?since={cursors[board]}')
+                changes = json.loads(body)
+                missed += changes['full']
+                (delta_sizes if changes['version'] - cursors[board] == 1 else catch_up_sizes).append(len(body))
+                cursors[board] = changes['version']
+
+        server.shutdown()
+        server.server_close()
+    finally:
+        os.chdir(repo_root)
+        shutil.rmtree(site, ignore_errors=True)
+
+    print(f'{args.boards} boards, {args.files} images, {args.changed} changed per refresh, {args.refreshes} refreshes')
+    print(f'  whole manifest      {statistics.mean(full_sizes):9.0f} bytes per poll')
+    if delta_sizes:
+        print(f'  since last refresh  {statistics.mean(delta_sizes):9.0f} bytes per poll')
+    if catch_up_sizes:
+        print(f'  catching up         {statistics.mean(catch_up_sizes):9.0f} bytes per poll')
+    print(f'  polls that had to fall back to the whole manifest: {missed}')
+    print(f'  a day of polling: {sum(full_sizes) / 1024:.0f} KiB whole, '
+          f'{(sum(delta_sizes) + sum(catch_up_sizes)) / 1024:.0f} KiB with since')
+
+
+if __name__ == '__main__':
+    main()
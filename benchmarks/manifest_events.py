@@ -0,0 +1,121 @@
+""" How quickly a board hears about a new image over /events, and what idling costs.
+
+A board's worth of files is served with a ManifestWatcher on a temp copy of
+the manifest. --boards clients hold /events open while the manifest is
+rewritten --changes times, the way download_new_files does it, and the delay
+until each client gets the change event is recorded.
+
+The idle cost is compared with polling downloaded_ids.json every
+--poll-seconds, which is what the boards would otherwise do.
+
+Run from the repository root:
+
+    python -m benchmarks.manifest_events [--boards 4] [--changes 5]
+"""
+import argparse
+import http.client
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+
+sys.path.insert(0, os.getcwd())
+
+from benchmarks.static_cache_transfer import build_site
+from nocache_server import EVENTS_HEARTBEAT, EVENTS_PATH, ManifestWatcher, make_handler, make_server
+
+
+def quiet(handler):
+    return type(f'Quiet{handler.__name__}', (handler,), {'log_message': lambda self, format, *args: None})
+
+
+def listen(address: tuple[str, int], received: list[tuple[float, dict]], ready: threading.Barrier) -> None:
+    """ Hold /events open and note when each change event arrives. """
+
+    connection = http.client.HTTPConnection(*address, timeout=60)
+    connection.request('GET', EVENTS_PATH)
+    response = connection.getresponse()
+    ready.wait()
+
+    event = None
+    for line in response:
+        line = line.decode().rstrip('\n')
+        if line.startswith('event: '):
+            event = line[len('event: '):]
+        elif line.startswith('data: ') and event == 'change':
+            received.append((time.perf_counter(), json.loads(line[len('data: '):])))
+            if received[-1][1]['id'] == 'stop':
+                break
+
+
+def write_manifest(path: str, manifest: list[dict]) -> None:
+    with open(path + '.part', 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(path + '.part', path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--page', default='Machining.html')
+    parser.add_argument('--boards', type=int, default=4)
+    parser.add_argument('--changes', type=int, default=5)
+    parser.add_argument('--poll-seconds', type=float, default=30.0)
+    args = parser.parse_args()
+
+    repo_root = os.getcwd()
+    with tempfile.TemporaryDirectory() as site:
+        build_site(repo_root, site, args.page, 64 * 1024)
+        manifest_path = os.path.join(site, 'downloaded_ids.json')
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+        handler = quiet(make_handler(cache=False, keep_alive=True))
+        server = make_server('127.0.0.1', 0, args.boards * 2, partial(handler, directory=site))  # type: ignore[arg-type]
+        server.manifest_watcher = ManifestWatcher(manifest_path)  # type: ignore[attr-defined]
+        server.manifest_watcher.start()  # type: ignore[attr-defined]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        ready = threading.Barrier(args.boards + 1)
+        inboxes: list[list[tuple[float, dict]]] = [[] for _ in range(args.boards)]
+        listeners = [threading.Thread(target=listen, args=(server.server_address[:2], inbox, ready), daemon=True)
+                     for inbox in inboxes]
+        for listener in listeners:
+            listener.start()
+        ready.wait()
+
+        written_at: dict[str, float] = {}
+        for i in range(args.changes):
+            # Spread the writes across the poll interval
+            time.sleep(0.37 + 0.29 * i)
+            manifest[i % len(manifest)]['SequenceNumber'] = f'{i + 2:05d}'
+            write_manifest(manifest_path, manifest)
+            written_at[manifest[i % len(manifest)]['SequenceNumber']] = time.perf_counter()
+
+        time.sleep(0.1)
+        write_manifest(manifest_path, manifest + [{'FileName': 'stop', 'SequenceNumber': 'stop'}])
+        for listener in listeners:
+            listener.join(timeout=10)
+        server.shutdown()
+        server.server_close()
+
+        delays = [(at - written_at[event['seqNumber']]) * 1000
+                  for inbox in inboxes for at, event in inbox if event['seqNumber'] in written_at]
+        print(f'{args.boards} boards, {args.changes} manifest changes, {len(delays)} change events received')
+        print(f'  delay until the board hears about it: median {statistics.median(delays):.0f} ms, '
+              f'max {max(delays):.0f} ms (polling every {args.poll_seconds:.0f}s: '
+              f'median {args.poll_seconds * 500:.0f} ms, max {args.poll_seconds * 1000:.0f} ms)')
+
+        manifest_bytes = os.path.getsize(manifest_path)
+        polls_per_hour = 3600 / args.poll_seconds
+        heartbeats_per_hour = 3600 / EVENTS_HEARTBEAT
+        print(f'  idle traffic per board per hour: polling {polls_per_hour:.0f} requests / '
+              f'{polls_per_hour * (manifest_bytes + 300) / 1024:.0f} KiB, '
+              f'events 0 requests / {heartbeats_per_hour * len(b": heartbeat") / 1024:.1f} KiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+""" A tiny stand-in for the parts of Kinetic the downloader talks to.
+
+Only meant for the benchmarks in this folder. It answers the FileStoreSvc and
+AccessGembaFiles BAQ endpoints from in-memory data, with a fixed delay per
+request to stand in for how slow the real server is.
+"""
+import base64
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from urllib.parse import parse_qs, urlencode
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 makes a burst of workers wait on SYN retries
+    request_queue_size = 128
+
+
+class MockKinetic:
+
+    def __init__(self, latency: float=0.25, page_size: int=0) -> None:
+        self.latency = latency
+        self.page_size = page_size
+        self.files: dict[str, bytes] = {}
+        # Files ReadAllFiles leaves out, as if they hung off another foreign row
+        self.batch_excluded: set[str] = set()
+        self.records: list[dict[str, Any]] = []
+        self.request_counts: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._server = _Server(('127.0.0.1', 0), self.__make_handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url_domain(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def add_file(self, sys_id: str, file_name: str, contents: bytes, post_date: str, sequence: int) -> None:
+        """ Store a file and the UD05 row that points at it. """
+
+        self.files[sys_id] = contents
+        self.records.append({
+            'UD05_Company': 'PAUL01',
+            'UD05_Character01': file_name,
+            'UD05_ShortChar01': post_date,
+            'UD05_Key1': sys_id,
+            'UD05_Key2': f'{sequence:010d}',
+            'UD05_CheckBox02': False,
+            'RowMod': '',
+            'RowIdent': '',
+            'SysRowID': f'row-{sys_id}',
+        })
+
+    def count(self, method_name: str) -> int:
+        with self._lock:
+            return self.request_counts.get(method_name, 0)
+
+    def reset_counts(self) -> None:
+        with self._lock:
+            self.request_counts.clear()
+
+    def __enter__(self) -> 'MockKinetic':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __make_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                self.__handle()
+
+            def do_POST(self):
+                self.__handle()
+
+            def do_PATCH(self):
+                self.__handle()
+
+            def __handle(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'{}')
+                path, _, query_string = self.path.partition('?')
+                method_name = path.rstrip('/').split('/')[-1]
+                query = {k: v[0] for k, v in parse_qs(query_string).items()}
+
+                with mock._lock:
+                    mock.request_counts[method_name] = mock.request_counts.get(method_name, 0) + 1
+
+                time.sleep(mock.latency)
+                status, payload = mock.respond(method_name, body, query)
+                if isinstance(payload, dict) and '@odata.nextLink' in payload:
+                    payload['@odata.nextLink'] = f'{path}?{payload["@odata.nextLink"]}'
+
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+    def respond(self, method_name: str, body: dict[str, Any], query: dict[str, str]) -> tuple[int, Any]:
+        if method_name == 'ReadAllBytes':
+            contents = self.files.get(body.get('id', ''))
+            if contents is None:
+                return 200, {'returnObj': '', 'parameters': {'fileName': ''}}
+            return 200, {
+                'returnObj': base64.b64encode(contents).decode(),
+                'parameters': {'fileName': body['id']},
+            }
+
+        if method_name == 'ReadAllFiles':
+            return 200, {'returnObj': [
+                {'SysRowID': sys_id, 'FileName': sys_id, 'Contents': base64.b64encode(contents).decode()}
+                for sys_id, contents in self.files.items() if sys_id not in self.batch_excluded
+            ]}
+
+        if method_name == 'Delete':
+            if self.files.pop(body.get('id', ''), None) is None:
+                return 400, {'ErrorMessage': 'File not found'}
+            return 200, {}
+
+        if method_name == 'Data' and body.get('RowMod') == 'D' and body.get('UD05_CheckBox02'):
+            # The delete directive behind AccessGembaFiles.delete_record
+            self.records = [r for r in self.records if r['SysRowID'] != body.get('SysRowID')]
+            return 200, {'value': []}
+
+        if method_name == 'Data':
+            return 200, self.__baq_page(query)
+
+        return 404, {'ErrorMessage': f'Unknown method {method_name}'}
+
+    def __baq_page(self, query: dict[str, str]) -> dict[str, Any]:
+        """ Just enough OData for AccessGembaFiles: a PostDate ge filter and paging. """
+
+        rows = self.records
+        match = re.fullmatch(r"UD05_ShortChar01 ge '(.*)'", query.get('$filter', ''))
+        if match:
+            rows = [r for r in rows if r['UD05_ShortChar01'] >= match.group(1).replace("''", "'")]
+        if '$orderby' in query:
+            rows = sorted(rows, key=lambda r: r[query['$orderby']])
+
+        if self.page_size <= 0:
+            return {'value': rows}
+
+        skip = int(query.get('$skip', 0))
+        page: dict[str, Any] = {'value': rows[skip:skip + self.page_size]}
+        if skip + self.page_size < len(rows):
+            page['@odata.nextLink'] = urlencode({**query, '$skip': skip + self.page_size})
+        return page
+
+
+def use_mock_server(mock: MockKinetic, work_dir: str):
+    """ Import the downloader inside work_dir and point it at the mock server.
+
+    download_from_server reads .env from the working directory when it is
+    imported, so a throwaway one is written first.
+    """
+    os.chdir(work_dir)
+    with open('.env', 'w') as f:
+        f.write('DOWNLOAD_KEY=benchmark\nDOWNLOAD_PASS=benchmark\n')
+
+    from GembaFileUpToDater import download_from_server
+    from GembaFileUpToDater.epicor_communications import EpicorCommunicator
+
+    EpicorCommunicator.url_domain = mock.url_domain
+    EpicorCommunicator.url_app_path = 'Kinetic'
+
+    return download_from_server
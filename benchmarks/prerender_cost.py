@@ -0,0 +1,83 @@
+""" What the pre-rendering stage costs the downloader, and what it saves the boards.
+
+Renders --files synthetic SVGs at every RENDER_SIZES box with one worker and
+with --workers, then compares how long a client takes to decode each bitmap
+with how long rasterizing the SVG at that size took. The rasterizing time is
+what every kiosk used to spend on each draw and resize.
+
+Needs cairosvg. Run from the repository root:
+
+    python -m benchmarks.prerender_cost [--files 8] [--svg-kib 1024] [--workers 4]
+"""
+import argparse
+import io
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.getcwd())
+
+from benchmarks.static_cache_transfer import synthetic_paths
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=8)
+    parser.add_argument('--svg-kib', type=int, default=1024)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    os.chdir(work_dir)
+    try:
+        from PIL import Image
+        from GembaFileUpToDater import prerender
+        if not prerender.can_render():
+            print('cairosvg is not installed, nothing to measure')
+            return
+
+        os.makedirs(prerender.SVG_DIR)
+        files = []
+        for i in range(args.files):
+            name = f'board_{i}.svg'
+            with open(os.path.join(prerender.SVG_DIR, name), 'wb') as f:
+                f.write(b'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 2000 1000">\n')
+                f.write(synthetic_paths(args.svg_kib * 1024, seed=i))
+                f.write(b'</svg>\n')
+            files.append({'FileName': name, 'SysID': str(i), 'DatePosted': '', 'SequenceNumber': '00001',
+                          'ContentHash': f'{i:064x}'})
+
+        for workers in (1, args.workers):
+            shutil.rmtree(prerender.RENDER_DIR, ignore_errors=True)
+            start = time.perf_counter()
+            rendered = prerender.render_files(files, workers)  # type: ignore[arg-type]
+            print(f'{workers} worker(s): rendered {len(files)} files in {time.perf_counter() - start:.2f}s')
+
+        svg_path = os.path.join(prerender.SVG_DIR, files[0]['FileName'])
+        print(f'\n{"variant":>10} {"KiB":>8} {"decode ms":>10} {"rasterize ms":>13}')
+        for variant in rendered[0]['Variants']:
+            with open(variant['url'], 'rb') as f:
+                data = f.read()
+
+            decode = []
+            for _ in range(5):
+                start = time.perf_counter()
+                Image.open(io.BytesIO(data)).load()
+                decode.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            prerender.load_cairosvg().svg2png(url=svg_path, output_width=variant['width'], output_height=variant['height'])
+            rasterize = time.perf_counter() - start
+
+            size = f'{variant["width"]}x{variant["height"]}'
+            print(f'{size:>10} {len(data) / 1024:>8.1f} {statistics.median(decode) * 1000:>10.1f} {rasterize * 1000:>13.1f}')
+    finally:
+        os.chdir('/')
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
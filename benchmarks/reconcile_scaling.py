@@ -0,0 +1,131 @@
+""" Start-up cost and scaling of the manifest diff, with and without pandas.
+
+The pandas version is the logic download_new_files used before
+file_reconciliation replaced it. It is only run when pandas is installed, and
+its results are checked against reconcile_files on every size.
+
+Run from the repository root:
+
+    python -m benchmarks.reconcile_scaling [--rows 1000 10000 100000]
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.getcwd())
+
+from GembaFileUpToDater.file_reconciliation import reconcile_files
+
+
+def import_time(module: str) -> float:
+    """ Seconds for a fresh interpreter to import module (best of 3). """
+
+    best = float('inf')
+    for _ in range(3):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', f'import {module}'], check=True, cwd=os.getcwd())
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def make_rows(count: int, distinct_files: int) -> list[dict]:
+    rng = random.Random(count)
+    rows = []
+    for i in range(count):
+        rows.append({
+            'Company': 'PAUL01',
+            'FileName': f'Board_{rng.randrange(distinct_files)}.xlsm_Display.svg',
+            'PostDate': f'2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}.{rng.randrange(10 ** 6):06d}',
+            'FileSysRowID': f'{i:08x}-0000-0000-0000-000000000000',
+            'Key2': f'{i:010d}',
+            'Delete': False,
+            'RowMod': '',
+            'RowIdent': '',
+            'SysRowID': f'row-{i}',
+        })
+    return rows
+
+
+def make_existing(rows: list[dict], rng: random.Random) -> list[dict]:
+    """ A local manifest that is a mix of current, stale and missing files. """
+
+    by_name: dict[str, dict] = {}
+    for row in rows:
+        by_name.setdefault(row['FileName'], row)
+
+    existing = []
+    for name, row in by_name.items():
+        if rng.random() < 0.2:
+            continue
+        existing.append({'FileName': name, 'SysID': row['FileSysRowID'], 'DatePosted': row['PostDate'], 'SequenceNumber': row['Key2'][-5:]})
+    existing.append({'FileName': 'Retired.svg', 'SysID': 'gone', 'DatePosted': '2024-01-01T00:00:00', 'SequenceNumber': '00001'})
+    return existing
+
+
+def pandas_reconcile(existing_files: list[dict], online_files: list[dict]) -> dict[str, list[dict]]:
+    import pandas as pd
+
+    server_files_df = pd.DataFrame(online_files)
+    server_files_df = server_files_df.astype({'PostDate': 'datetime64[ns]'})
+    server_files_df = server_files_df.sort_values(['FileName', 'PostDate'], ascending=[True, False])
+    newest_files_df_2 = server_files_df.groupby(['FileName']).head(1)
+    newest_files = [
+        {'FileName': row['FileName'], 'SysID': row['FileSysRowID'], 'DatePosted': row['PostDate'].isoformat(), 'SequenceNumber': row['Key2'][-5:]}
+        for _, row in newest_files_df_2.iterrows()
+    ]
+
+    newest_ids = [f['SysID'] for f in newest_files]
+    old_files = [f for f in existing_files if f['SysID'] not in newest_ids]
+    old_file_names = [o['FileName'] for o in old_files]
+    files_need_updating = [g for g in newest_files if g['FileName'] in old_file_names]
+    existing_file_names = [e['FileName'] for e in existing_files]
+    files_dont_have = [f for f in newest_files if f['FileName'] not in existing_file_names]
+    files_not_updated = [f for f in existing_files if f not in old_files]
+
+    return {'new': files_dont_have, 'updated': files_need_updating, 'unchanged': files_not_updated}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--files', type=int, default=300, help='distinct FileNames among the rows')
+    args = parser.parse_args()
+
+    try:
+        import pandas  # noqa: F401
+        have_pandas = True
+    except ImportError:
+        have_pandas = False
+
+    print('Fresh interpreter import time')
+    print(f'  file_reconciliation: {import_time("GembaFileUpToDater.file_reconciliation"):.3f}s')
+    if have_pandas:
+        print(f'  pandas:              {import_time("pandas"):.3f}s')
+    print()
+
+    print(f'{"rows":>8} {"dict/set s":>11} {"pandas s":>10}')
+    for count in args.rows:
+        rows = make_rows(count, args.files)
+        existing = make_existing(rows, random.Random(count + 1))
+
+        started = time.perf_counter()
+        diff = reconcile_files(existing, rows)  # type: ignore[arg-type]
+        ours = time.perf_counter() - started
+
+        theirs = float('nan')
+        if have_pandas:
+            started = time.perf_counter()
+            expected = pandas_reconcile(existing, rows)
+            theirs = time.perf_counter() - started
+
+            for key in expected:
+                assert diff[key] == expected[key], f'{key} differs at {count} rows'
+
+        print(f'{count:>8} {ours:>11.4f} {theirs:>10.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+""" Do boards ever get a half written manifest or SVG?
+
+A writer keeps replacing every file and the manifest, while --readers clients
+fetch the manifest and then each file it lists through nocache_server. The
+writer first rewrites the files in place like the downloader used to, then
+publishes snapshots.
+
+Every response is sorted into one of:
+
+- matching: the file the manifest it came with lists
+- newer: a complete file from a later refresh, published between the two
+  requests. The board draws it and catches up on the next change event.
+- torn: a file that was never published, or a response that broke off
+
+Run from the repository root:
+
+    python -m benchmarks.snapshot_consistency [--seconds 5] [--readers 4]
+"""
+import argparse
+import hashlib
+import http.client
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from urllib.parse import quote
+
+sys.path.insert(0, os.getcwd())
+
+from benchmarks.static_cache_transfer import synthetic_paths
+from nocache_server import make_handler, make_server
+
+
+def quiet(handler):
+    return type(f'Quiet{handler.__name__}', (handler,), {'log_message': lambda self, format, *args: None})
+
+
+def make_files(refresh: int, count: int, size: int) -> dict[str, bytes]:
+    return {
+        f'board_{i}.svg': b'<svg xmlns="http://www.w3.org/2000/svg">' + synthetic_paths(size, seed=refresh * count + i) + b'</svg>'
+        for i in range(count)
+    }
+
+
+def manifest_for(files: dict[str, bytes], refresh: int) -> list[dict]:
+    return [
+        {'FileName': name, 'SysID': name, 'DatePosted': '', 'SequenceNumber': f'{refresh:05d}',
+         'ContentHash': hashlib.sha256(data).hexdigest()}
+        for name, data in files.items()
+    ]
+
+
+# Every hash each file has ever been published with
+published: dict[str, set[str]] = {}
+
+
+def record(files: dict[str, bytes]) -> None:
+    for name, data in files.items():
+        published.setdefault(name, set()).add(hashlib.sha256(data).hexdigest())
+
+
+def write_in_place(files: dict[str, bytes], refresh: int) -> None:
+    """ The old way, every file truncated and rewritten where it is served from. """
+
+    record(files)
+    for name, data in files.items():
+        with open(os.path.join('svg_files', name), 'wb') as f:
+            f.write(data)
+    with open('downloaded_ids.json', 'w+') as f:
+        json.dump(manifest_for(files, refresh), f, indent=4)
+
+
+def publish_snapshot(files: dict[str, bytes], refresh: int) -> None:
+    from GembaFileUpToDater import snapshots
+
+    record(files)
+    for name, data in files.items():
+        with open(os.path.join('svg_files', name + '.part'), 'wb') as f:
+            f.write(data)
+        os.replace(os.path.join('svg_files', name + '.part'), os.path.join('svg_files', name))
+    snapshots.publish(manifest_for(files, refresh))  # type: ignore[arg-type]
+
+
+def reader(address: tuple[str, int], stop: threading.Event, totals: dict[str, int], lock: threading.Lock) -> None:
+    connection = http.client.HTTPConnection(*address, timeout=30)
+    while not stop.is_set():
+        try:
+            connection.request('GET', '/downloaded_ids.json')
+            body = connection.getresponse().read()
+            manifest = json.loads(body)
+
+            for file in manifest:
+                connection.request('GET', '/svg_files/' + quote(file['FileName']))
+                content_hash = hashlib.sha256(connection.getresponse().read()).hexdigest()
+                with lock:
+                    if content_hash == file['ContentHash']:
+                        totals['matching'] += 1
+                    elif content_hash in published[file['FileName']]:
+                        totals['newer'] += 1
+                    else:
+                        totals['torn'] += 1
+
+        except (http.client.HTTPException, ValueError, OSError):
+            # A file that changed length under the server breaks the response
+            with lock:
+                totals['torn'] += 1
+            connection.close()
+            connection = http.client.HTTPConnection(*address, timeout=30)
+
+
+def run(writer, args, site: str) -> dict[str, int]:
+    os.chdir(site)
+    shutil.rmtree('svg_files', ignore_errors=True)
+    shutil.rmtree('snapshots', ignore_errors=True)
+    for path in ('current', 'downloaded_ids.json'):
+        if os.path.lexists(path):
+            os.remove(path)
+    os.makedirs('svg_files')
+    writer(make_files(0, args.files, args.svg_kib * 1024), 0)
+
+    handler = quiet(make_handler(cache=False, keep_alive=True))
+    server = make_server('127.0.0.1', 0, args.readers + 2, partial(handler, directory=site))  # type: ignore[arg-type]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    stop = threading.Event()
+    lock = threading.Lock()
+    totals = {'refreshes': 0, 'matching': 0, 'newer': 0, 'torn': 0}
+    readers = [threading.Thread(target=reader, args=(server.server_address[:2], stop, totals, lock), daemon=True)
+               for _ in range(args.readers)]
+    for thread in readers:
+        thread.start()
+
+    refresh = 0
+    deadline = time.perf_counter() + args.seconds
+    while time.perf_counter() < deadline:
+        refresh += 1
+        writer(make_files(refresh, args.files, args.svg_kib * 1024), refresh)
+    totals['refreshes'] = refresh
+
+    stop.set()
+    for thread in readers:
+        thread.join()
+    server.shutdown()
+    server.server_close()
+    return totals
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--files', type=int, default=6)
+    parser.add_argument('--svg-kib', type=int, default=256)
+    args = parser.parse_args()
+
+    site = tempfile.mkdtemp()
+    try:
+        for name, writer in (('in place', write_in_place), ('snapshots', publish_snapshot)):
+            totals = run(writer, args, site)
+            print(f'{name:>10}: {totals["refreshes"]} refreshes, {totals["matching"]} matching, '
+                  f'{totals["newer"]} newer, {totals["torn"]} torn')
+    finally:
+        os.chdir('/')
+        shutil.rmtree(site, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
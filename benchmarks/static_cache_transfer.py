@@ -0,0 +1,118 @@
+""" Bytes sent per board refresh with NoCacheHandler vs CachingHandler.
+
+A copy of a board page, scripts/ and synthetic SVGs for every image it shows
+is served from a temp folder. Each handler gets a cold load followed by
+--refreshes reloads where nothing changed.
+
+Run from the repository root:
+
+    python -m benchmarks.static_cache_transfer [--page Machining.html] [--svg-kib 2048]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+from functools import partial
+from http.server import HTTPServer
+
+sys.path.insert(0, os.getcwd())
+
+from benchmarks.board_client import BoardClient, board_assets, url_to_path
+from nocache_server import CachingHandler, NoCacheHandler
+
+
+class QuietNoCacheHandler(NoCacheHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class QuietCachingHandler(CachingHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def synthetic_paths(size: int, seed: int=0) -> bytes:
+    """ Roughly size bytes of the kind of path soup Excel exports.
+
+    The coordinates vary so it doesn't compress unrealistically well.
+    """
+
+    rng = random.Random(seed)
+    lines = []
+    written = 0
+    while written < size:
+        points = ' L '.join(f'{rng.uniform(0, 2000):.6f} {rng.uniform(0, 1000):.6f}' for _ in range(4))
+        colour = rng.choice(('#4472c4', '#ed7d31', '#a5a5a5', '#ffc000', '#000000'))
+        line = f'<path d="M {points} Z" style="fill:{colour};stroke:#000000;stroke-width:0.75"/>\n'.encode()
+        lines.append(line)
+        written += len(line)
+    return b''.join(lines)
+
+
+def build_site(repo_root: str, site: str, page: str, svg_bytes: int) -> list[str]:
+    """ Copy the page and its scripts into site and make up its SVGs. """
+
+    shutil.copy(os.path.join(repo_root, page), site)
+    for folder in ('scripts', 'styles', 'boards'):
+        shutil.copytree(os.path.join(repo_root, folder), os.path.join(site, folder))
+
+    urls = board_assets(site, page)
+    manifest = []
+    for url in urls:
+        path = url_to_path(site, url)
+        if os.path.exists(path) or not url.endswith('.svg'):
+            continue
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'<svg xmlns="http://www.w3.org/2000/svg">\n')
+            f.write(synthetic_paths(svg_bytes, seed=len(manifest)))
+            f.write(b'</svg>\n')
+        manifest.append({'FileName': os.path.basename(path), 'SysID': url, 'DatePosted': '', 'SequenceNumber': '00001'})
+
+    with open(os.path.join(site, 'downloaded_ids.json'), 'w') as f:
+        json.dump(manifest, f, indent=4)
+
+    # Only keep the assets that exist, like the browser would end up with
+    return [u for u in urls if os.path.exists(url_to_path(site, u))]
+
+
+def run(handler, site: str, urls: list[str], refreshes: int) -> list[dict[str, int]]:
+    server = HTTPServer(('127.0.0.1', 0), partial(handler, directory=site))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        client = BoardClient(*server.server_address[:2])
+        return [client.load(urls) for _ in range(refreshes + 1)]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--page', default='Machining.html')
+    parser.add_argument('--svg-kib', type=int, default=2048)
+    parser.add_argument('--refreshes', type=int, default=3)
+    args = parser.parse_args()
+
+    repo_root = os.getcwd()
+    with tempfile.TemporaryDirectory() as site:
+        urls = build_site(repo_root, site, args.page, args.svg_kib * 1024)
+        print(f'{args.page}: {len(urls)} assets')
+        print(f'{"handler":>15} {"load":>6} {"requests":>9} {"304s":>5} {"cached":>7} {"KiB sent":>10}')
+
+        for name, handler in (('NoCacheHandler', QuietNoCacheHandler), ('CachingHandler', QuietCachingHandler)):
+            for i, totals in enumerate(run(handler, site, urls, args.refreshes)):
+                label = 'cold' if i == 0 else f'#{i}'
+                print(f'{name:>15} {label:>6} {totals["requests"]:>9} {totals["not_modified"]:>5} '
+                      f'{totals["from_cache"]:>7} {totals["bytes"] / 1024:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+""" Peak memory of decoding a ReadAllBytes response, buffered vs streamed.
+
+The buffered path is what read_all_bytes + decode_file did: hold the body,
+parse it, then decode the whole string. The streamed path is decode_stream fed
+64 KiB chunks, which is what download_file does with the live response.
+
+Run from the repository root:
+
+    python -m benchmarks.streaming_decode_memory [--mib 50]
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Iterator
+
+sys.path.insert(0, os.getcwd())
+
+from GembaFileUpToDater.epicor_communications import STREAM_CHUNK_SIZE, File_Operations
+
+# A block of SVG-ish text that base64 encodes without padding
+BLOCK = (b'<path d="M 10.123456 20.654321 L 30.5 40.25 Z" style="fill:#4472c4"/>\n' * 64)[:3 * 1024]
+
+
+def synthetic_body(decoded_size: int) -> Iterator[bytes]:
+    """ The body of a ReadAllBytes response, generated a chunk at a time. """
+
+    yield b'{"returnObj":"'
+
+    encoded_block = base64.b64encode(BLOCK)
+    blocks_per_chunk = max(1, STREAM_CHUNK_SIZE // len(encoded_block))
+    remaining = decoded_size // len(BLOCK)
+    while remaining > 0:
+        count = min(blocks_per_chunk, remaining)
+        yield encoded_block * count
+        remaining -= count
+
+    yield b'","parameters":{"fileName":"synthetic.svg"}}'
+
+
+def buffered(decoded_size: int, path: str) -> None:
+    body = b''.join(synthetic_body(decoded_size))
+    data = json.loads(body)
+    File_Operations.decode_file(contents=data['returnObj'], path=path)
+
+
+def streamed(decoded_size: int, path: str) -> None:
+    File_Operations.decode_stream(synthetic_body(decoded_size), path)
+
+
+def measure(label: str, fn, decoded_size: int, path: str) -> None:
+    tracemalloc.start()
+    started = time.perf_counter()
+    fn(decoded_size, path)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    size = os.path.getsize(path)
+    print(f'{label:>9} {size / 2 ** 20:>10.1f} {peak / 2 ** 20:>10.1f} {elapsed:>8.2f}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--mib', type=int, nargs='+', default=[5, 50], help='decoded payload sizes in MiB')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, 'synthetic.svg')
+
+        print(f'{"path":>9} {"file MiB":>10} {"peak MiB":>10} {"seconds":>8}')
+        for mib in args.mib:
+            measure('buffered', buffered, mib * 2 ** 20, path)
+            measure('streamed', streamed, mib * 2 ** 20, path)
+
+
+if __name__ == '__main__':
+    main()
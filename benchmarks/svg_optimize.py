@@ -0,0 +1,88 @@
+""" How much svg_optimizer shrinks SVGs and what that does to rasterizing them.
+
+Works on copies of the SVGs given, or on a synthetic Excel style export when
+none are. Rasterizing times are only reported when cairosvg is installed,
+without it only the lossless passes run.
+
+Run from the repository root:
+
+    python -m benchmarks.svg_optimize [svg_files/*.svg] [--svg-kib 1024]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.getcwd())
+
+from GembaFileUpToDater import svg_optimizer
+
+
+def excel_like_svg(size: int, seed: int=0) -> bytes:
+    """ Roughly what Excel writes: metadata, a clip path per chart, unused
+    defs and the same handful of inline styles over and over at full precision. """
+
+    rng = random.Random(seed)
+    styles = [
+        f'fill:{c};fill-opacity:1;stroke:#000000;stroke-width:0.75;stroke-linecap:butt;stroke-linejoin:miter'
+        for c in ('#4472c4', '#ed7d31', '#a5a5a5', '#ffc000', '#5b9bd5')
+    ]
+    parts = [
+        b'<?xml version="1.0" encoding="UTF-8"?>\n',
+        b'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" viewBox="0 0 2000 1000">\n',
+        b'  <metadata><dc:title xmlns:dc="http://purl.org/dc/elements/1.1/">Display</dc:title></metadata>\n',
+        b'  <defs>\n',
+    ]
+    parts += [f'    <clipPath id="clip{i}"><rect x="0" y="0" width="2000.000000" height="1000.000000"/></clipPath>\n'.encode()
+              for i in range(20)]
+    parts.append(b'  </defs>\n  <g clip-path="url(#clip0)">\n')
+
+    written = sum(len(p) for p in parts)
+    while written < size:
+        x, y = rng.uniform(0, 1900), rng.uniform(0, 900)
+        w, h = rng.uniform(5, 100), rng.uniform(5, 100)
+        line = (f'    <g>\n      <path d="M {x:.6f} {y:.6f} L {x + w:.6f} {y:.6f} L {x + w:.6f} {y + h:.6f} '
+                f'L {x:.6f} {y + h:.6f} Z" style="{rng.choice(styles)}"/>\n    </g>\n    <g></g>\n').encode()
+        parts.append(line)
+        written += len(line)
+
+    parts.append(b'  </g>\n</svg>\n')
+    return b''.join(parts)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--svg-kib', type=int, default=1024)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        copies = []
+        for path in args.files:
+            copies.append(shutil.copy(path, work_dir))
+        if not copies:
+            path = os.path.join(work_dir, 'synthetic.xlsm_Display.svg')
+            with open(path, 'wb') as f:
+                f.write(excel_like_svg(args.svg_kib * 1024))
+            copies.append(path)
+
+        print(f'{"file":>40} {"KiB before":>11} {"KiB after":>10} {"smaller":>8} {"optimize s":>11} {"raster ms":>16}')
+        for path in copies:
+            report = svg_optimizer.optimize_file(path)
+            if report is None:
+                print(f'{os.path.basename(path)[-40:]:>40}  could not be parsed')
+                continue
+
+            saved = 1 - report['optimized_bytes'] / report['original_bytes']
+            if report['rasterize_before'] is not None and report['rasterize_after'] is not None:
+                raster = f'{report["rasterize_before"] * 1000:.0f} -> {report["rasterize_after"] * 1000:.0f}'
+            else:
+                raster = 'no cairosvg'
+            print(f'{os.path.basename(path)[-40:]:>40} {report["original_bytes"] / 1024:>11.1f} '
+                  f'{report["optimized_bytes"] / 1024:>10.1f} {saved:>8.0%} {report["seconds"]:>11.2f} {raster:>16}')
+
+
+if __name__ == '__main__':
+    main()
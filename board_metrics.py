@@ -0,0 +1,14 @@
+import argparse
+
+from GembaFileUpToDater.parse_args import parse_args, should_show_debug
+parse_args()
+print(f'Should show debug: {should_show_debug()}')
+
+from GembaFileUpToDater.board_metrics import METRICS_FILE, log_board_usage
+
+parser = argparse.ArgumentParser(description='Show how much memory and time every board has been using.')
+parser.add_argument('debug', nargs='?', choices=('true', 'false'), help='false hides debug logging, like index.py')
+parser.add_argument('--file', default=METRICS_FILE, help='metrics the web server logged')
+args = parser.parse_args()
+
+log_board_usage(args.file)
@@ -0,0 +1,18 @@
+import argparse
+import sys
+
+from GembaFileUpToDater.parse_args import parse_args, should_show_debug
+parse_args()
+print(f'Should show debug: {should_show_debug()}')
+
+from GembaFileUpToDater.board_layouts import BOARDS_DIR, check_boards
+
+parser = argparse.ArgumentParser(description='Check every board layout against the files the boards are served.')
+parser.add_argument('debug', nargs='?', choices=('true', 'false'), help='false hides debug logging, like index.py')
+parser.add_argument('--boards', default=BOARDS_DIR, help='folder of board layouts')
+parser.add_argument('--manifest', help='manifest to check against, the current snapshot\'s by default')
+args = parser.parse_args()
+
+results = check_boards(args.boards, args.manifest)
+if any(result['problems'] for result in results.values()):
+    sys.exit(1)
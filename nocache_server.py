@@ -1,6 +1,663 @@
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+import argparse
+import datetime
+import email.utils
+import json
+import os
+import queue
+import selectors
+import socket
+import threading
+import time
+from http import HTTPStatus
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, quote, urlsplit
+
+# Fonts and third party scripts only change when they're reinstalled, so
+# browsers can keep them for a year without asking.
+IMMUTABLE_PREFIXES = ('/fonts/', '/node_modules/')
+
+# Our scripts and styles are only immutable when the page asks for a specific
+# version of them (scripts/x.js?v=2), otherwise an edit would never reach the
+# kiosks.
+VERSIONED_PREFIXES = ('/scripts/', '/styles/')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Everything else, in particular downloaded_ids.json and svg_files/, can be
+# cached but has to be revalidated on every use. A 304 costs a few hundred
+# bytes instead of the whole file.
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+# The downloader writes pre-compressed copies of every SVG next to it (see
+# content_store.SIDECAR_EXTENSIONS), best first. A copy that wouldn't have been
+# any smaller isn't written, and then the SVG itself is sent.
+PRECOMPRESSED_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+PRECOMPRESSED_SUFFIXES = ('.svg',)
+
+# The downloader publishes every refresh as a snapshot and points this
+# symlink at it. These are served out of it so a board never sees the files
+# from one refresh with the manifest from another.
+SNAPSHOT_LINK = 'current'
+SNAPSHOT_PREFIXES = ('/svg_files/',)
+SNAPSHOT_FILES = ('/downloaded_ids.json',)
+
+# Boards subscribe here to hear about new images instead of polling
+EVENTS_PATH = '/events'
+MANIFEST_FILE = 'downloaded_ids.json'
+
+# Boards that come back after a while ask for only what changed since the
+# manifest version they saw last. The downloader logs the changes next to the
+# manifest in every snapshot (GembaFileUpToDater/manifest_log.py).
+MANIFEST_DELTA_PATH = '/manifest'
+MANIFEST_LOG_FILE = 'manifest_changes.json'
+
+# Boards POST their memory use and frame times here every few minutes
+# (scripts/kioskRuntime.js). Each report is a line in METRICS_FILE, which is
+# moved to METRICS_FILE + '.1' once it's bigger than METRICS_MAX_BYTES.
+METRICS_PATH = '/metrics'
+METRICS_FILE = 'board_metrics.jsonl'
+METRICS_MAX_BYTES = 10 * 1024 * 1024
+METRICS_MAX_REPORT = 16 * 1024
+
+# How often the manifest is checked for changes, in seconds
+MANIFEST_POLL_INTERVAL = 1.0
+
+# Send a comment this often so a dead connection gets noticed, in seconds
+EVENTS_HEARTBEAT = 15.0
+
+# Event streams open at once. Each gets a thread of its own rather than one of
+# the workers, so this doesn't take anything away from serving files.
+EVENTS_MAX_CLIENTS = 64
+
+# Events waiting for one browser. One that falls this far behind is dropped
+# and reconnects, which makes it reload the whole manifest.
+EVENTS_QUEUE_SIZE = 256
+
+def describe_file(file: dict) -> dict:
+    """ What a board needs to know about a manifest entry, in imageLoading.js's terms. """
+
+    return {
+        'id': file['FileName'],
+        'url': 'svg_files/' + quote(file['FileName']),
+        'seqNumber': file.get('SequenceNumber'),
+        'hash': file.get('ContentHash'),
+        'variants': file.get('Variants'),
+    }
+
+class ManifestWatcher:
+    """ Watch the manifest and pass on which files changed to every subscriber.
+
+    The server runs on the system python, which has no inotify, so the
+    manifest's mtime is polled instead. That is one stat a second and the file
+    is only read when it changed.
+    """
+
+    def __init__(self, path: Optional[str]=None, poll_interval: float=MANIFEST_POLL_INTERVAL,
+                 max_clients: Optional[int]=None):
+        # None follows the current snapshot, falling back to the manifest
+        # in the working directory before the first one is published
+        self.path = path
+        self.poll_interval = poll_interval
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._subscribers: set[queue.Queue] = set()
+        self._signature = self.__signature()
+        self._files = self.__read_files() or {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.__run, name='gemba-manifest-watcher', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        with self._lock:
+            self._subscribers.clear()
+
+    def subscribe(self) -> Optional[queue.Queue]:
+        """ A queue that gets every change from now on, or None if there are too many already. """
+
+        with self._lock:
+            if self.max_clients is not None and len(self._subscribers) >= self.max_clients:
+                return None
+
+            events: queue.Queue = queue.Queue(maxsize=EVENTS_QUEUE_SIZE)
+            self._subscribers.add(events)
+            return events
+
+    def unsubscribe(self, events: queue.Queue) -> None:
+        with self._lock:
+            self._subscribers.discard(events)
+
+    def is_subscribed(self, events: queue.Queue) -> bool:
+        with self._lock:
+            return events in self._subscribers
+
+    def check(self) -> list[tuple[str, dict]]:
+        """ Look at the manifest once and publish whatever changed since last time. """
+
+        signature = self.__signature()
+        if signature is None or signature == self._signature:
+            return []
+
+        files = self.__read_files()
+        if files is None:
+            # Caught it half written, the next poll will see the rest
+            return []
+
+        previous = self._files
+        self._signature = signature
+        self._files = files
+
+        events: list[tuple[str, dict]] = []
+        for name, file in files.items():
+            described = describe_file(file)
+            if name not in previous or describe_file(previous[name]) != described:
+                events.append(('change', described))
+        events += [('remove', {'id': name}) for name in previous if name not in files]
+
+        with self._lock:
+            for subscriber in list(self._subscribers):
+                for event in events:
+                    try:
+                        subscriber.put_nowait(event)
+                    except queue.Full:
+                        self._subscribers.discard(subscriber)
+                        break
+
+        return events
+
+    def __run(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            self.check()
+
+    def __manifest_path(self) -> str:
+        if self.path is not None:
+            return self.path
+
+        published = os.path.join(SNAPSHOT_LINK, MANIFEST_FILE)
+        return published if os.path.exists(published) else MANIFEST_FILE
+
+    def __signature(self) -> Optional[tuple[int, int, int]]:
+        try:
+            fs = os.stat(self.__manifest_path())
+        except OSError:
+            return None
+        return (fs.st_ino, fs.st_mtime_ns, fs.st_size)
+
+    def __read_files(self) -> Optional[dict[str, dict]]:
+        try:
+            with open(self.__manifest_path(), 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if not isinstance(manifest, list):
+            return None
+
+        return {f['FileName']: f for f in manifest if isinstance(f, dict) and 'FileName' in f}
+
+class ManifestDeltas:
+    """ Answer /manifest?since=<version> from the current snapshot's change log.
+
+    A snapshot never changes once it is published, so its manifest and log are
+    read once and kept until the link points somewhere else.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._folder: Optional[str] = None
+        self._files: dict[str, dict] = {}
+        self._log: dict = {'version': 0, 'oldest': 0, 'changes': []}
+
+    def changes_since(self, since: Optional[int]) -> dict:
+        """ {version, full, images, removed} for a board that last saw since.
+
+        The whole manifest comes back with full=True when since is missing, is
+        older than the log goes back or doesn't exist yet, or when there is no
+        log to go by.
+        """
+
+        with self._lock:
+            self.__load()
+            files, log = self._files, self._log
+
+        version = log['version']
+        if since is None or version == 0 or not log['oldest'] - 1 <= since <= version:
+            return {
+                'version': version,
+                'full': True,
+                'images': [describe_file(f) for f in files.values()],
+                'removed': [],
+            }
+
+        changed = dict.fromkeys(c['FileName'] for c in log['changes'] if c['version'] > since)
+        return {
+            'version': version,
+            'full': False,
+            'images': [describe_file(files[name]) for name in changed if name in files],
+            'removed': [name for name in changed if name not in files],
+        }
+
+    def __load(self) -> None:
+        snapshot = os.path.join(self.directory, SNAPSHOT_LINK)
+        folder = os.path.realpath(snapshot) if os.path.isdir(snapshot) else None
+        if folder is not None and folder == self._folder:
+            return
+
+        # Before the first snapshot there is only the manifest and no log
+        manifest = self.__read_json(os.path.join(folder or self.directory, MANIFEST_FILE))
+        log = self.__read_json(os.path.join(folder, MANIFEST_LOG_FILE)) if folder else None
+
+        self._files = {f['FileName']: f for f in manifest or [] if isinstance(f, dict) and 'FileName' in f}
+        if isinstance(log, dict) and isinstance(log.get('version'), int):
+            self._log = log
+        else:
+            self._log = {'version': 0, 'oldest': 0, 'changes': []}
+        self._folder = folder
+
+    @staticmethod
+    def __read_json(path: str):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+class MetricsLog:
+    """ Append the boards' metric reports to a file, one JSON object a line. """
+
+    def __init__(self, path: str=METRICS_FILE, max_bytes: int=METRICS_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def append(self, report: dict, client: str) -> None:
+        line = json.dumps({'time': round(time.time(), 3), 'client': client, **report}) + '\n'
+
+        with self._lock:
+            try:
+                if os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, self.path + '.1')
+            except OSError:
+                pass
+
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+def stream_events(watcher: ManifestWatcher, events: queue.Queue, write) -> None:
+    """ Write events from the queue as server-sent events until the
+    subscription or the connection ends.
+    """
+
+    try:
+        while watcher.is_subscribed(events):
+            try:
+                event = events.get(timeout=EVENTS_HEARTBEAT)
+            except queue.Empty:
+                write(b': heartbeat\n\n')
+                continue
+
+            name, data = event
+            write(f'event: {name}\ndata: {json.dumps(data)}\n\n'.encode())
+
+    except OSError:
+        # The board closed or reloaded
+        pass
+
+    finally:
+        watcher.unsubscribe(events)
+
+class BoardFileHandler(SimpleHTTPRequestHandler):
+
+    # Close keep-alive connections that sit idle this long, in seconds
+    timeout = 15
+
+    def handle(self):
+        """ Handle the requests on this connection.
+
+        On a PooledHTTPServer a keep-alive connection with nothing more to
+        read is parked with the server instead of holding a worker until the
+        board's next request or the timeout.
+        """
+
+        park = getattr(self.server, 'park', None)
+
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            if park is not None and not self.__has_buffered_request():
+                park(self.connection, self.client_address, self.timeout)
+                return
+            self.handle_one_request()
+
+    def __has_buffered_request(self) -> bool:
+        """ Whether the next request has already been read, or is waiting. """
+
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except (BlockingIOError, OSError):
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
 
-class NoCacheHandler(SimpleHTTPRequestHandler):
+    def end_headers(self):
+
+        # CORS (simple, wildcard)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, HEAD, POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
+        self.send_header("Access-Control-Max-Age", "3600")
+
+        super().end_headers()
+
+    def translate_path(self, path):
+        """ Serve the manifest and SVGs from the current snapshot once there is one. """
+
+        translated = super().translate_path(path)
+
+        request_path = urlsplit(path).path
+        if not request_path.startswith(SNAPSHOT_PREFIXES) and request_path not in SNAPSHOT_FILES:
+            return translated
+
+        snapshot = os.path.join(self.directory, SNAPSHOT_LINK)
+        if not os.path.isdir(snapshot):
+            return translated
+
+        return os.path.join(snapshot, os.path.relpath(translated, self.directory))
+
+    def do_GET(self):
+        request_path = urlsplit(self.path).path
+        if request_path == EVENTS_PATH:
+            return self.send_events()
+        if request_path == MANIFEST_DELTA_PATH:
+            return self.send_manifest_delta()
+
+        return super().do_GET()
+
+    def send_events(self) -> None:
+        """ Stream manifest changes to the browser as server-sent events.
+
+        Each change is a `change` event with the file's id, url, seqNumber and
+        hash. On a PooledHTTPServer the stream is handed to a thread of its
+        own, so an open board doesn't hold a worker.
+        """
+
+        watcher = getattr(self.server, 'manifest_watcher', None)
+        if watcher is None:
+            self.send_error(HTTPStatus.NOT_FOUND, "Events are not enabled")
+            return
+
+        events = watcher.subscribe()
+        if events is None:
+            self.log_message('Turned away an event stream, %s are open already', watcher.max_clients)
+            self.send_error(HTTPStatus.SERVICE_UNAVAILABLE, "Too many event streams")
+            return
+
+        # The stream has no length, it only ends when the connection does
+        self.close_connection = True
+
+        try:
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", "text/event-stream")
+            cache_control = self.cache_control_for(self.path)
+            if cache_control is not None:
+                self.send_header("Cache-Control", cache_control)
+            self.end_headers()
+
+            # Tell EventSource how long to wait before reconnecting, in ms
+            self.wfile.write(b'retry: 5000\n\n')
+            self.wfile.flush()
+        except OSError:
+            watcher.unsubscribe(events)
+            return
+
+        detach = getattr(self.server, 'detach', None)
+        if detach is None:
+            stream_events(watcher, events, self.wfile.write)
+            return
+
+        detach(self.connection)
+        threading.Thread(target=self.__stream_detached, args=(self.connection, watcher, events),
+                         name='gemba-events', daemon=True).start()
+
+    @staticmethod
+    def __stream_detached(connection: socket.socket, watcher: ManifestWatcher, events: queue.Queue) -> None:
+        try:
+            stream_events(watcher, events, connection.sendall)
+        finally:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            connection.close()
+
+    def do_POST(self):
+        if urlsplit(self.path).path == METRICS_PATH:
+            return self.receive_metrics()
+
+        self.send_error(HTTPStatus.NOT_IMPLEMENTED, "Unsupported method ('POST')")
+
+    def receive_metrics(self) -> None:
+        """ Log one board's metrics report, a JSON object. """
+
+        metrics = getattr(self.server, 'metrics_log', None)
+        if metrics is None:
+            self.send_error(HTTPStatus.NOT_FOUND, "Metrics are not enabled")
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            self.send_error(HTTPStatus.LENGTH_REQUIRED)
+            return
+        if not 0 < length <= METRICS_MAX_REPORT:
+            self.send_error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE if length > 0 else HTTPStatus.BAD_REQUEST)
+            return
+
+        try:
+            report = json.loads(self.rfile.read(length))
+        except ValueError:
+            report = None
+        if not isinstance(report, dict):
+            self.send_error(HTTPStatus.BAD_REQUEST, "Expected a JSON object")
+            return
+
+        metrics.append(report, self.client_address[0])
+
+        self.send_response(HTTPStatus.NO_CONTENT)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_manifest_delta(self) -> None:
+        """ Send what changed in the manifest since the version in ?since=.
+
+        The answer depends on when it is asked. It has no validators, so even
+        the caching handler's no-cache means it is fetched every time.
+        """
+
+        deltas = getattr(self.server, 'manifest_deltas', None)
+        if deltas is None:
+            deltas = self.server.manifest_deltas = ManifestDeltas(self.directory)
+
+        since = parse_qs(urlsplit(self.path).query).get('since', [''])[0]
+        body = json.dumps(deltas.changes_since(int(since) if since.isdigit() else None)).encode()
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        cache_control = self.cache_control_for(self.path)
+        if cache_control is not None:
+            self.send_header("Cache-Control", cache_control)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_head(self):
+        """ Serve files with validators so browsers only download what changed.
+
+        Every file gets a strong ETag built from its mtime and size plus a
+        Last-Modified, and conditional requests that still match get a 304.
+        SVGs are swapped for their pre-compressed sidecar when the browser
+        accepts it.
+        """
+
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) or not os.path.isfile(path):
+            # Directory listings, redirects and 404s are left to the base class
+            return super().send_head()
+
+        content_type = self.guess_type(path)
+        varies = path.endswith(PRECOMPRESSED_SUFFIXES)
+        serve_path, encoding = self.choose_encoding(path) if varies else (path, None)
+
+        try:
+            f = open(serve_path, 'rb')
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+
+        try:
+            fs = os.fstat(f.fileno())
+            etag = self.make_etag(fs)
+            cache_control = self.cache_control_for(self.path)
+
+            if self.is_not_modified(etag, fs.st_mtime):
+                f.close()
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_validators(etag, fs.st_mtime, cache_control)
+                if varies:
+                    self.send_header("Vary", "Accept-Encoding")
+                self.end_headers()
+                return None
+
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-type", content_type)
+            self.send_header("Content-Length", str(fs.st_size))
+            if encoding is not None:
+                self.send_header("Content-Encoding", encoding)
+            if varies:
+                self.send_header("Vary", "Accept-Encoding")
+            self.send_validators(etag, fs.st_mtime, cache_control)
+            self.end_headers()
+            return f
+
+        except OSError:
+            f.close()
+            raise
+
+    def choose_encoding(self, path: str) -> tuple[str, Optional[str]]:
+        """ Pick the best pre-compressed copy of path the browser accepts.
+
+        A sidecar older than the file it belongs to is ignored, it was made
+        from old contents.
+        """
+
+        accepted = self.accepted_encodings()
+        if not accepted:
+            return path, None
+
+        original_mtime = os.stat(path).st_mtime_ns
+        for encoding, extension in PRECOMPRESSED_ENCODINGS:
+            if accepted.get(encoding, 0) <= 0:
+                continue
+
+            try:
+                sidecar = os.stat(path + extension)
+            except OSError:
+                continue
+
+            if sidecar.st_mtime_ns >= original_mtime:
+                return path + extension, encoding
+
+        return path, None
+
+    def accepted_encodings(self) -> dict[str, float]:
+        """ The Accept-Encoding header as {encoding: q}. """
+
+        accepted: dict[str, float] = {}
+        for item in self.headers.get('Accept-Encoding', '').split(','):
+            name, _, params = item.partition(';')
+            name = name.strip().lower()
+            if not name:
+                continue
+
+            q = 1.0
+            params = params.strip()
+            if params.startswith('q='):
+                try:
+                    q = float(params[2:])
+                except ValueError:
+                    q = 0.0
+            accepted[name] = q
+
+        return accepted
+
+    @staticmethod
+    def make_etag(fs: os.stat_result) -> str:
+        return f'"{fs.st_mtime_ns:x}-{fs.st_size:x}"'
+
+    @staticmethod
+    def cache_control_for(request_path: str) -> Optional[str]:
+        """ The Cache-Control to send with request_path, None to leave it to end_headers. """
+        return None
+
+    def is_not_modified(self, etag: str, mtime: float) -> bool:
+        """ Check the conditional headers. If-None-Match wins when both are sent. """
+
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            candidates = [c.strip() for c in if_none_match.split(',')]
+            # A weak comparison is fine for GET
+            return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+        if_modified_since = self.__parse_http_date(self.headers.get('If-Modified-Since'))
+        if if_modified_since is not None:
+            return int(mtime) <= if_modified_since
+
+        return False
+
+    def send_validators(self, etag: str, mtime: float, cache_control: Optional[str]) -> None:
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", self.date_time_string(mtime))
+        if cache_control is not None:
+            self.send_header("Cache-Control", cache_control)
+
+    @staticmethod
+    def __parse_http_date(value: Optional[str]) -> Optional[float]:
+        if not value:
+            return None
+
+        try:
+            parsed = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return None
+
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+
+        return parsed.timestamp()
+
+    def copyfile(self, source, outputfile):
+        """ Hand the file to the kernel with sendfile instead of copying it through Python. """
+
+        try:
+            source.fileno()
+        except (AttributeError, OSError):
+            return super().copyfile(source, outputfile)
+
+        # Anything still buffered has to go out before the file does
+        outputfile.flush()
+        try:
+            self.connection.sendfile(source)
+        except (BrokenPipeError, ConnectionResetError):
+            # The browser went away mid-download, not worth a traceback
+            self.close_connection = True
+
+class NoCacheHandler(BoardFileHandler):
     def end_headers(self):
 
         # No-cache headers
@@ -8,13 +665,165 @@ class NoCacheHandler(SimpleHTTPRequestHandler):
         self.send_header("Pragma", "no-cache")
         self.send_header("Expires", "0")
 
-        # CORS (simple, wildcard)
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "GET, HEAD, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
-        self.send_header("Access-Control-Max-Age", "3600")
-        
         super().end_headers()
 
+class CachingHandler(BoardFileHandler):
+    """ Let browsers keep files and revalidate them instead of refetching.
+
+    Immutable assets get a long max-age, everything else has to check its
+    ETag every time.
+    """
+
+    @staticmethod
+    def cache_control_for(request_path: str) -> Optional[str]:
+        url = urlsplit(request_path)
+
+        if url.path.startswith(IMMUTABLE_PREFIXES):
+            return IMMUTABLE_CACHE_CONTROL
+
+        if url.path.startswith(VERSIONED_PREFIXES) and 'v=' in url.query:
+            return IMMUTABLE_CACHE_CONTROL
+
+        return REVALIDATE_CACHE_CONTROL
+
+class PooledHTTPServer(ThreadingHTTPServer):
+    """ Handle connections on a fixed pool of worker threads.
+
+    A slow client streaming a big SVG only ties up its own worker, everything
+    else carries on. Connections past the pool size wait in line rather than
+    getting a thread each.
+
+    Workers are only busy while there is a request to answer. Idle keep-alive
+    connections are parked and watched by one thread, which hands them back
+    to the pool when the next request arrives. Event streams are detached
+    from the pool altogether.
+    """
+
+    # A board opens a handful of connections at once on reload
+    request_queue_size = 64
+
+    # Set to stream manifest changes from /events
+    manifest_watcher: Optional[ManifestWatcher] = None
+
+    # Made by the first /manifest request
+    manifest_deltas: Optional[ManifestDeltas] = None
+
+    def __init__(self, server_address, RequestHandlerClass, workers: int=8):
+        super().__init__(server_address, RequestHandlerClass)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='gemba-http')
+
+        # Connections a handler is done with that aren't to be closed: to be
+        # parked as (client_address, idle timeout), or None when detached
+        self._handoffs: dict[socket.socket, Optional[tuple]] = {}
+        self._handoffs_lock = threading.Lock()
+        self._parked = selectors.DefaultSelector()
+        self._closed = threading.Event()
+        self._idle_thread = threading.Thread(target=self.__watch_parked, name='gemba-keepalive', daemon=True)
+        self._idle_thread.start()
+
+    def process_request(self, request, client_address):
+        self._executor.submit(self.process_request_thread, request, client_address)
+
+    def park(self, request: socket.socket, client_address, timeout: float) -> None:
+        """ Have request watched for its next request once its handler returns. """
+
+        with self._handoffs_lock:
+            self._handoffs[request] = (client_address, timeout)
+
+    def detach(self, request: socket.socket) -> None:
+        """ Leave request open once its handler returns, someone else closes it. """
+
+        with self._handoffs_lock:
+            self._handoffs[request] = None
+
+    def shutdown_request(self, request):
+        with self._handoffs_lock:
+            handoff = self._handoffs.pop(request, False)
+
+        if handoff is False:
+            super().shutdown_request(request)
+        elif handoff is not None and not self._closed.is_set():
+            client_address, timeout = handoff
+            self._parked.register(request, selectors.EVENT_READ, (client_address, time.monotonic() + timeout))
+
+    def server_close(self):
+        if self.manifest_watcher is not None:
+            self.manifest_watcher.stop()
+        self._closed.set()
+        self._idle_thread.join()
+        super().server_close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def __watch_parked(self) -> None:
+        while not self._closed.is_set():
+            for key, _ in self._parked.select(timeout=0.5):
+                # The next request, or the board hanging up, either way a
+                # handler reads it
+                self._parked.unregister(key.fileobj)
+                self._executor.submit(self.process_request_thread, key.fileobj, key.data[0])
+
+            now = time.monotonic()
+            for key in list(self._parked.get_map().values()):
+                if key.data[1] <= now:
+                    self._parked.unregister(key.fileobj)
+                    super().shutdown_request(key.fileobj)
+
+        for key in list(self._parked.get_map().values()):
+            self._parked.unregister(key.fileobj)
+            super().shutdown_request(key.fileobj)
+        self._parked.close()
+
+def make_handler(cache: bool, keep_alive: bool) -> type[BoardFileHandler]:
+    handler = CachingHandler if cache else NoCacheHandler
+    if not keep_alive:
+        return handler
+
+    # HTTP/1.1 keeps the connection open between requests
+    return type(f'KeepAlive{handler.__name__}', (handler,), {'protocol_version': 'HTTP/1.1'})
+
+def make_server(bind: str, port: int, workers: int, handler: type[BoardFileHandler],
+                events: bool=False, metrics: bool=False, max_events: int=EVENTS_MAX_CLIENTS) -> HTTPServer:
+    """ Make the server. With events=True it also serves /events, and with
+    metrics=True it logs what the boards POST to /metrics.
+
+    Event streams are only offered with a worker pool, which gives each one a
+    thread of its own, up to max_events of them. The single threaded server
+    would be stuck on the first stream forever.
+    """
+
+    if workers <= 0:
+        server = HTTPServer((bind, port), handler)
+    else:
+        server = PooledHTTPServer((bind, port), handler, workers=workers)
+        if events:
+            server.manifest_watcher = ManifestWatcher(max_clients=max_events)
+            server.manifest_watcher.start()
+
+    if metrics:
+        server.metrics_log = MetricsLog()  # type: ignore[attr-defined]
+
+    return server
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Serve the Gemba board files.')
+    parser.add_argument('--cache', action='store_true',
+                        help='send ETag/Last-Modified validators instead of no-store')
+    parser.add_argument('--bind', default='127.0.0.1',
+                        help='address to listen on, 0.0.0.0 to serve other kiosks (default 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=8,
+                        help='threads serving requests, 0 for the old single threaded server (default 8)')
+    parser.add_argument('--no-events', dest='events', action='store_false',
+                        help=f'don\'t push manifest changes to boards from {EVENTS_PATH}')
+    parser.add_argument('--max-events', type=int, default=EVENTS_MAX_CLIENTS,
+                        help=f'boards that can listen on {EVENTS_PATH} at once (default {EVENTS_MAX_CLIENTS})')
+    parser.add_argument('--no-metrics', dest='metrics', action='store_false',
+                        help=f'don\'t log what the boards report to {METRICS_PATH} in {METRICS_FILE}')
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    HTTPServer(("127.0.0.1", 8000), NoCacheHandler).serve_forever()
+    args = parse_args()
+    # Only hold connections open when there are threads to spare for them
+    handler = make_handler(args.cache, keep_alive=args.workers > 0)
+    make_server(args.bind, args.port, args.workers, handler,
+                events=args.events, metrics=args.metrics, max_events=args.max_events).serve_forever()
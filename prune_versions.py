@@ -0,0 +1,18 @@
+import argparse
+
+from GembaFileUpToDater.parse_args import parse_args, should_show_debug
+parse_args()
+print(f'Should show debug: {should_show_debug()}')
+
+from GembaFileUpToDater.download_from_server import DOWNLOAD_WORKERS
+from GembaFileUpToDater.prune_versions import DEFAULT_KEEP_VERSIONS, prune_versions
+
+parser = argparse.ArgumentParser(description='Delete all but the newest versions of every Gemba file from Kinetic.')
+parser.add_argument('debug', nargs='?', choices=('true', 'false'), help='false hides debug logging, like index.py')
+parser.add_argument('--keep', type=int, default=DEFAULT_KEEP_VERSIONS, help='versions of each file to keep')
+parser.add_argument('--dry-run', action='store_true', help='only report what would be deleted')
+parser.add_argument('--workers', type=int, default=DOWNLOAD_WORKERS, help='versions deleted at once')
+parser.add_argument('--no-sizes', action='store_true', help="don't stream each file to count the bytes reclaimed")
+args = parser.parse_args()
+
+prune_versions(args.keep, dry_run=args.dry_run, max_workers=args.workers, measure_sizes=not args.no_sizes)
@@ -0,0 +1,10 @@
+import time
+started_at = time.perf_counter()
+
+from GembaFileUpToDater.parse_args import parse_args, should_show_debug
+parse_args()
+print(f'Should show debug: {should_show_debug()}')
+
+from GembaFileUpToDater.refresh_daemon import run_daemon
+
+run_daemon(started_at)
@@ -0,0 +1,278 @@
+// Every department board is this runtime and a layout in boards/<name>.json.
+// The layout lists the board's cells in reading order, each one image, a
+// split of two images stacked, or null for an empty space:
+//
+//     {"title": "...", "heading": "...", "headingSize": "95pt",
+//      "columns": 2 or {"portrait": 2, "landscape": 5}, "decorations": true,
+//      "cells": [{"file": "a.svg", "priority": 1},
+//                {"split": [{"file": "b.svg"}, null]},
+//                null]}
+//
+// The cells are flowed into gridStackConfig like the Gridstack boards use.
+// Only the images a board shows are fetched, a couple at a time and in
+// priority order (lowest first, then reading order), so the first chart is
+// up without waiting on the rest. check_boards.py checks the layouts against
+// the manifest.
+
+const BOARD_LAYOUT_DIR = "boards";
+
+// Widgets drawn at once, the rest wait their turn
+const BOARD_DRAW_CONCURRENCY = 2;
+
+// Gridstack rows a cell takes up, each half of a split cell gets one
+const ROWS_PER_CELL = 2;
+
+// Half the gap between cells, and the border styles/board.css gives them
+const BOARD_MARGIN = 9;
+const BOARD_BORDER = 6;
+
+const BOARD_RELOAD_MINUTES = 15;
+
+let boardLayout = null;
+let boardColumns = 0;
+
+// The grid solved for this screen by layoutSolver.js
+let boardGrid = null;
+
+// Config ids still to be drawn, best first
+let drawQueue = [];
+let drawsInFlight = 0;
+
+// Config ids of the widgets on screen, only those are drawn
+const visibleWidgets = new Set();
+let widgetObserver = null;
+
+let firstChartLogged = false;
+
+// ?board= wins over the page's data-board, so board.html can show any of them
+function boardName() {
+    return new URLSearchParams(window.location.search).get("board") ?? document.body.dataset.board;
+}
+
+async function loadBoardLayout(name) {
+    const res = await fetch(`${BOARD_LAYOUT_DIR}/${encodeURIComponent(name)}.json`, { cache: "no-cache" });
+    if (!res.ok) throw new Error(`Failed to load layout for ${name}: ${res.status}`);
+
+    return res.json();
+}
+
+function columnsFor(layout) {
+    if (typeof layout.columns === "number") return layout.columns;
+
+    const landscape = window.innerWidth >= window.innerHeight;
+    return landscape ? layout.columns.landscape : layout.columns.portrait;
+}
+
+// The images of a layout placed on a grid that many columns wide, as
+// {id, file, url, priority, order, gridPosition}
+function boardWidgets(layout, columns) {
+    const widgets = [];
+
+    layout.cells.forEach((cell, index) => {
+        if (!cell) return;
+
+        const x = index % columns;
+        const y = Math.floor(index / columns) * ROWS_PER_CELL;
+        const parts = cell.split
+            ? cell.split.map((half, i) => [half, `cell${index}-${i}`, { x, y: y + i, w: 1, h: 1 }])
+            : [[cell, `cell${index}`, { x, y, w: 1, h: ROWS_PER_CELL }]];
+
+        for (const [image, id, gridPosition] of parts) {
+            if (!image) continue;
+
+            widgets.push({
+                id,
+                file: image.file,
+                url: `svg_files/${encodeURIComponent(image.file)}`,
+                priority: image.priority ?? Infinity,
+                order: widgets.length,
+                gridPosition,
+            });
+        }
+    });
+
+    return widgets;
+}
+
+function byPriority(a, b) {
+    const configA = gridStackConfig[a], configB = gridStackConfig[b];
+    return (configA.priority - configB.priority) || (configA.order - configB.order);
+}
+
+function queueDraws(ids) {
+    for (const id of ids) {
+        if (!drawQueue.includes(id)) drawQueue.push(id);
+    }
+    drawQueue.sort(byPriority);
+    pumpDraws();
+}
+
+// Start the best queued draws that are on screen, up to BOARD_DRAW_CONCURRENCY
+function pumpDraws() {
+    while (drawsInFlight < BOARD_DRAW_CONCURRENCY) {
+        const next = drawQueue.findIndex(id => visibleWidgets.has(id));
+        if (next < 0) return;
+
+        const [id] = drawQueue.splice(next, 1);
+        drawsInFlight++;
+        drawWidget(id).finally(() => {
+            drawsInFlight--;
+            pumpDraws();
+        });
+    }
+}
+
+async function drawWidget(id) {
+    const config = gridStackConfig[id];
+    if (!config || !document.getElementById(`canvas-${id}`)) return "cancelled";
+
+    const box = solveWidgetBox(boardGrid, config.gridPosition.w, config.gridPosition.h);
+    const outcome = await updateCanvasImage(id, box.width, box.height);
+
+    if (outcome === "drawn" && !firstChartLogged) {
+        firstChartLogged = true;
+        console.log(`First chart drawn ${Math.round(performance.now())} ms after the page started loading`);
+    }
+    return outcome;
+}
+
+function watchVisibility() {
+    widgetObserver?.disconnect();
+    visibleWidgets.clear();
+
+    const items = grid.getGridItems();
+    const configId = el => el.gridstackNode.id.replace("widget-", "");
+
+    if (!window.IntersectionObserver) {
+        items.forEach(el => visibleWidgets.add(configId(el)));
+        return;
+    }
+
+    widgetObserver = new IntersectionObserver(entries => {
+        for (const entry of entries) {
+            if (entry.isIntersecting) {
+                visibleWidgets.add(configId(entry.target));
+            } else {
+                visibleWidgets.delete(configId(entry.target));
+            }
+        }
+        pumpDraws();
+    });
+    items.forEach(el => widgetObserver.observe(el));
+}
+
+// Fill gridStackConfig from the layout and put it on the grid, then draw it
+function layoutBoard() {
+    boardColumns = columnsFor(boardLayout);
+    const rows = Math.ceil(boardLayout.cells.length / boardColumns) * ROWS_PER_CELL;
+    const heading = document.getElementById("GembaName");
+    boardGrid = solveGridLayout({
+        width: document.querySelector(".grid-stack").clientWidth,
+        height: window.innerHeight - heading.offsetHeight,
+        columns: boardColumns,
+        rows,
+        margin: BOARD_MARGIN,
+        border: BOARD_BORDER,
+    });
+    const cellHeight = boardGrid.cellHeight;
+
+    for (const id in gridStackConfig) delete gridStackConfig[id];
+    for (const widget of boardWidgets(boardLayout, boardColumns)) {
+        addGridStackItemConfig(widget.id, widget.url, currentSequenceNumbers.get(widget.file), widget.gridPosition);
+        Object.assign(gridStackConfig[widget.id], { priority: widget.priority, order: widget.order });
+    }
+
+    if (grid) {
+        releaseCanvases(document.querySelector(".grid-stack"));
+        grid.removeAll();
+        grid.column(boardColumns, "none");
+        grid.cellHeight(cellHeight);
+    } else {
+        GridStack.renderCB = (el, w) => {
+            el.innerHTML = w.content;
+        };
+        grid = GridStack.init({
+            staticGrid: true,
+            float: true,
+            column: boardColumns,
+            cellHeight,
+            margin: BOARD_MARGIN,
+        });
+    }
+
+    grid.load(Object.values(gridStackConfig).map(renderGridStackItem));
+
+    drawQueue = [];
+    watchVisibility();
+    queueDraws(Object.keys(gridStackConfig));
+}
+
+// Like redrawChangedImage, but through the queue and without saving anything
+function redrawChangedBoardImage(item) {
+    const changed = [];
+
+    for (const id in gridStackConfig) {
+        const config = gridStackConfig[id];
+        if (!isSameImage(config.imageUrl, item.url)) continue;
+        // Bitmaps turning up is worth a redraw too
+        if (config.seqNumber === item.seqNumber && !item.variants) continue;
+
+        config.seqNumber = item.seqNumber;
+        changed.push(id);
+    }
+
+    if (changed.length > 0) {
+        console.log("Image changed, redrawing:", changed, item.seqNumber);
+        queueDraws(changed);
+    }
+}
+
+function showDecorations() {
+    const flakes = Array.from({ length: 12 }, () => '<div class="snowflake"><div class="inner">❅</div></div>');
+    document.body.insertAdjacentHTML("beforeend",
+        `<div id="lights"></div><div class="snowflakes" aria-hidden="true">${flakes.join("")}</div>`);
+}
+
+async function initializeBoard() {
+    const name = boardName();
+
+    // The manifest says which version of each image to ask for
+    const [layout, changes] = await Promise.all([
+        loadBoardLayout(name),
+        loadManifestChanges().catch(error => {
+            console.error(error);
+            return { images: [] };
+        }),
+    ]);
+    boardLayout = layout;
+
+    document.title = layout.title ?? name;
+    const heading = document.getElementById("GembaName");
+    heading.textContent = layout.heading ?? "";
+    heading.hidden = !layout.heading;
+    if (layout.headingSize) heading.style.fontSize = layout.headingSize;
+    if (layout.decorations) showDecorations();
+
+    for (const item of changes.images) {
+        applyImageChange(item, true);
+    }
+    layoutBoard();
+
+    // Listen for new images instead of waiting for the next reload
+    onImageChange(redrawChangedBoardImage);
+    subscribeToManifest();
+    registerOfflineCache();
+    startKioskRuntime();
+
+    let resizeTimer;
+    window.addEventListener("resize", () => {
+        clearTimeout(resizeTimer);
+        resizeTimer = setTimeout(layoutBoard, 1000);
+    });
+
+    setTimeout(() => {
+        const url = new URL(window.location.href);
+        url.searchParams.set("t", new Date().getTime());
+        window.location.href = url.toString();
+    }, BOARD_RELOAD_MINUTES * 1000 * 60);
+}
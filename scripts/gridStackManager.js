@@ -7,10 +7,49 @@
 const gridStackConfig = {};
 let grid;
 
+// Columns and rows that fill the screen, the cell sizes are solved from the
+// viewport by layoutSolver.js
 const SIZE_CONFIG = {
-    'TV_WIDE_SMALL': { width: 5, height: 270 },
+    'TV_WIDE_SMALL': { columns: 5, rows: 8 },
 };
 
+// Gridstack's margin around every widget, and the border the pages give them
+const GRID_MARGIN = 10;
+const WIDGET_BORDER = 6;
+
+// The solved grid for this screen, null when the page has no TV_SIZE
+let gridLayout = null;
+
+function solveGridStackLayout() {
+    if (typeof TV_SIZE === 'undefined' || !(TV_SIZE in SIZE_CONFIG)) return null;
+
+    const { columns, rows } = SIZE_CONFIG[TV_SIZE];
+    return solveGridLayout({
+        width: document.querySelector('.grid-stack').clientWidth,
+        height: window.innerHeight,
+        columns,
+        rows,
+        margin: GRID_MARGIN,
+        border: WIDGET_BORDER,
+    });
+}
+
+// The CSS size a widget's canvas fills, solved when the grid is and measured
+// when it isn't
+function widgetBox(node) {
+    if (gridLayout) return solveWidgetBox(gridLayout, node.w, node.h);
+
+    const rect = node.el.firstElementChild.getBoundingClientRect();
+    return { width: rect.width - 2 * WIDGET_BORDER, height: rect.height - 2 * WIDGET_BORDER };
+}
+
+function drawGridStackWidget(node) {
+    const configId = node.id.replace('widget-', '');
+    const box = widgetBox(node);
+    console.debug('Drawing', configId, 'at', box);
+    return updateCanvasImage(configId, box.width, box.height);
+}
+
 // We should use local storage to keep a consistent config over reloads
 function loadGridStackConfigFromLocalStorage() {
     const storedConfig = localStorage.getItem(LOCAL_STORAGE_KEY);
@@ -66,6 +105,31 @@ function renderGridStackItem(gridItemConfig) {
     return item;
 }
 
+// Redraw only the widgets showing an image that changed
+function redrawChangedImage(item) {
+    let changed = false;
+
+    for (const id in gridStackConfig) {
+        const config = gridStackConfig[id];
+        if (!config.imageUrl || !isSameImage(config.imageUrl, item.url)) continue;
+        // Bitmaps turning up is worth a redraw too
+        if (config.seqNumber === item.seqNumber && !item.variants) continue;
+
+        config.seqNumber = item.seqNumber;
+        changed = true;
+
+        const node = document.getElementById(`canvas-${id}`)?.closest('.grid-stack-item')?.gridstackNode;
+        if (!node) continue;
+
+        console.log('Image changed, redrawing:', id, item.seqNumber);
+        drawGridStackWidget(node);
+    }
+
+    if (changed) {
+        saveGridStackConfigToLocalStorage();
+    }
+}
+
 function initializeGridStack() {
 
     // Set the render function so we can use raw HTML instead of the sanitized
@@ -80,7 +144,7 @@ function initializeGridStack() {
     // Grid ele
     const gridElement = document.querySelector('.grid-stack');
     
-    grid = GridStack.init(opts={float: true});
+    grid = GridStack.init(opts={float: true, margin: GRID_MARGIN});
     console.log('Gridstack initialized:', grid);
 
     // Watch add event
@@ -96,18 +160,10 @@ function initializeGridStack() {
                 return;
             }
             
-            const widgetId = node.id;
-            const configId = widgetId.replace('widget-', '');
-            const widget = node.el.childNodes[0];
-            const rect = widget.getBoundingClientRect();
-            console.log('Widget added:', widgetId, 'Config ID:', configId, 'Size:', rect);
+            console.log('Widget added:', node.id);
 
             // Draw the image
-            updateCanvasImage(
-                configId,
-                rect.width,
-                rect.height
-            );
+            drawGridStackWidget(node);
         });
     });
     
@@ -125,21 +181,14 @@ function initializeGridStack() {
             return;
         }
         
-        const widget = element.childNodes[0];
         const node = element.gridstackNode;
-        const rect = widget.getBoundingClientRect();
         const gridStackId = element.gridstackNode.id;
         const configId = gridStackId.replace('widget-', '');
         
         console.log('Grid units:', {w: node.w, h: node.h });
-        console.log('Pixel size:', {width: rect.width, height: rect.height});
 
         // Resize the image
-        updateCanvasImage(
-            configId,
-            rect.width,
-            rect.height
-        )
+        drawGridStackWidget(node);
         
         console.debug('Element ID:', element.id);
         temp1 = element;
@@ -195,10 +244,28 @@ function initializeGridStack() {
     }
     console.log('Loading gridstack items:', items);
 
-    if (TV_SIZE in SIZE_CONFIG) {
-        grid.column(SIZE_CONFIG[TV_SIZE].width);
-        grid.cellHeight(SIZE_CONFIG[TV_SIZE].height);
+    gridLayout = solveGridStackLayout();
+    if (gridLayout) {
+        grid.column(gridLayout.columns);
+        grid.cellHeight(gridLayout.cellHeight);
     }
     grid.load(items);
 
+    // A new resolution gets its own solution, and everything is redrawn for it
+    let resizeTimer;
+    window.addEventListener('resize', () => {
+        clearTimeout(resizeTimer);
+        resizeTimer = setTimeout(() => {
+            gridLayout = solveGridStackLayout();
+            if (gridLayout) grid.cellHeight(gridLayout.cellHeight);
+            grid.engine.nodes.filter(node => !node.id.includes('TITLE')).forEach(drawGridStackWidget);
+        }, 1000);
+    });
+
+    // Listen for new images instead of waiting for the next reload
+    onImageChange(redrawChangedImage);
+    subscribeToManifest();
+    registerOfflineCache();
+    startKioskRuntime();
+
 }
\ No newline at end of file
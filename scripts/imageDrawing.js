@@ -1,51 +1,235 @@
+// Images are decoded and scaled in scripts/renderWorker.js where the browser
+// can, so drawing a board doesn't freeze the animations running on it. The
+// worker is found next to this script, wherever the page is.
+const RENDER_WORKER_URL = new URL("renderWorker.js?v=1", document.currentScript.src).href;
+
+let renderWorker = null;
+let renderWorkerBroken = false;
+
+// Every render gets a token. A widget only ever shows its newest render, an
+// older one that finishes late is thrown away.
+let lastRenderToken = 0;
+const latestRenderTokens = {};
+
+// token -> {id, src, maxWidth, maxHeight, cacheAs, resolve} for renders the
+// worker has
+const pendingRenders = new Map();
+
+function canRenderOffscreen() {
+    return !renderWorkerBroken
+        && typeof Worker !== "undefined"
+        && typeof OffscreenCanvas !== "undefined"
+        && typeof createImageBitmap !== "undefined";
+}
+
+function getRenderWorker() {
+    if (renderWorker) return renderWorker;
+
+    renderWorker = new Worker(RENDER_WORKER_URL);
+    renderWorker.onmessage = event => finishWorkerRender(event.data);
+    renderWorker.onerror = event => {
+        console.error("Render worker failed, drawing on the main thread from now on", event);
+        renderWorkerBroken = true;
+        renderWorker = null;
+
+        // Anything it had is drawn here instead
+        const stranded = [...pendingRenders.values()];
+        pendingRenders.clear();
+        stranded.forEach(render => renderOnMainThread(render).then(render.resolve));
+    };
+    return renderWorker;
+}
+
+// The size an image is drawn at to fill maxWidth x maxHeight keeping its
+// aspect ratio
+function fitInside(width, height, maxWidth, maxHeight) {
+    const aspectRatio = width / height;
+
+    if (width / maxWidth >= height / maxHeight) {
+        return { width: Math.max(1, Math.round(maxWidth)), height: Math.max(1, Math.round(maxWidth / aspectRatio)) };
+    }
+    return { width: Math.max(1, Math.round(maxHeight * aspectRatio)), height: Math.max(1, Math.round(maxHeight)) };
+}
+
+function isCurrentRender(id, token) {
+    return latestRenderTokens[id] === token;
+}
+
+// A canvas holds one pixel per device pixel it covers, so the browser draws
+// it without scaling. Setting the size reallocates it, even to the same size.
+function sizeCanvas(canvasEl, width, height) {
+    const dpr = currentDevicePixelRatio();
+    if (canvasEl.width !== width) canvasEl.width = width;
+    if (canvasEl.height !== height) canvasEl.height = height;
+    canvasEl.style.width = `${width / dpr}px`;
+    canvasEl.style.height = `${height / dpr}px`;
+}
+
+// Put an already scaled bitmap on the widget's canvas
+function showBitmap(id, bitmap) {
+    const canvasEl = document.getElementById(`canvas-${id}`);
+    if (!canvasEl) return;
+
+    sizeCanvas(canvasEl, bitmap.width, bitmap.height);
+    console.log(`Rendering at canvas size: width ${canvasEl.width}, height ${canvasEl.height}`);
+
+    const ctx = canvasEl.getContext("2d");
+    ctx.clearRect(0, 0, canvasEl.width, canvasEl.height);
+    ctx.drawImage(bitmap, 0, 0);
+}
+
+// Done with a bitmap a render made. It's kept in the cache in imageLoading.js
+// when the render said what it's a bitmap of, so the next draw is a blit.
+function releaseBitmap({ maxWidth, maxHeight, cacheAs }, bitmap) {
+    if (cacheAs) {
+        cacheBitmap(cacheAs.url, cacheAs.seqNumber, maxWidth, maxHeight, bitmap);
+    } else {
+        bitmap.close();
+    }
+}
+
+function finishWorkerRender({ token, status, bitmap, error }) {
+    const render = pendingRenders.get(token);
+    pendingRenders.delete(token);
+    if (!render) {
+        bitmap?.close();
+        return;
+    }
+
+    if (status === "done" && isCurrentRender(render.id, token)) {
+        showBitmap(render.id, bitmap);
+        releaseBitmap(render, bitmap);
+        render.resolve("drawn");
+    } else if (status === "undecodable") {
+        // Most browsers can't decode SVGs in a worker
+        renderOnMainThread(render).then(render.resolve);
+    } else {
+        if (bitmap) releaseBitmap(render, bitmap);
+        if (status === "error") console.error(`Failed to load image for canvas ${render.id}`, render.src, error);
+        render.resolve(status === "error" ? "failed" : "cancelled");
+    }
+}
+
+// SVGs, or everything when there's no worker. The image is still decoded off
+// the main thread and rasterized once at the size it's shown at.
+async function renderOnMainThread(render) {
+    const img = acquireImage();
+    try {
+        return await renderImageOnMainThread(render, img);
+    } finally {
+        releaseImage(img);
+    }
+}
+
+async function renderImageOnMainThread(render, img) {
+    const { id, token, src, maxWidth, maxHeight } = render;
+    img.src = src;
+
+    try {
+        await img.decode();
+    } catch (error) {
+        if (!isCurrentRender(id, token)) return "cancelled";
+        console.error(`Failed to load image for canvas ${id}`, src, error);
+        return "failed";
+    }
+    if (!isCurrentRender(id, token)) return "cancelled";
+
+    const size = fitInside(img.naturalWidth || img.width, img.naturalHeight || img.height, maxWidth, maxHeight);
+    let bitmap;
+    try {
+        bitmap = await createImageBitmap(img, { resizeWidth: size.width, resizeHeight: size.height, resizeQuality: "high" });
+    } catch (error) {
+        // Old browsers without createImageBitmap, or ones that won't take an SVG
+        if (!isCurrentRender(id, token)) return "cancelled";
+        drawImageScaled(id, img, size);
+        return "drawn";
+    }
+
+    if (!isCurrentRender(id, token)) {
+        releaseBitmap(render, bitmap);
+        return "cancelled";
+    }
+
+    showBitmap(id, bitmap);
+    releaseBitmap(render, bitmap);
+    return "drawn";
+}
+
+function drawImageScaled(id, img, size) {
+    const canvasEl = document.getElementById(`canvas-${id}`);
+    if (!canvasEl) return;
+
+    sizeCanvas(canvasEl, size.width, size.height);
+    const ctx = canvasEl.getContext("2d");
+    ctx.clearRect(0, 0, canvasEl.width, canvasEl.height);
+    ctx.drawImage(img, 0, 0, canvasEl.width, canvasEl.height);
+}
+
+// Draw src on widget id's canvas, fitted inside maxWidth x maxHeight device
+// pixels. A newer call for the same widget cancels this one. Resolves with
+// "drawn", "cancelled" or "failed".
+//
+// With cacheAs = {url, seqNumber} the scaled bitmap is cached as that version
+// of that image, and drawn from the cache when it's there already.
+function renderToCanvas(id, src, maxWidth, maxHeight, cacheAs = null) {
+    const token = ++lastRenderToken;
+    latestRenderTokens[id] = token;
+    const render = { id, token, src, maxWidth, maxHeight, cacheAs };
+
+    const cached = cacheAs && getCachedBitmap(cacheAs.url, cacheAs.seqNumber, maxWidth, maxHeight);
+    if (cached) {
+        showBitmap(id, cached);
+        return Promise.resolve("drawn");
+    }
+
+    const isSvg = new URL(src, window.location.href).pathname.toLowerCase().endsWith(".svg");
+    if (isSvg || !canRenderOffscreen()) {
+        return renderOnMainThread(render);
+    }
+
+    return new Promise(resolve => {
+        pendingRenders.set(token, { ...render, resolve });
+
+        // Let the worker drop what it's doing for this widget
+        getRenderWorker().postMessage({ id, token, url: new URL(src, window.location.href).href, maxWidth, maxHeight });
+    });
+}
+
 // Function to draw image to canvas. It should take a configuration object a
-// name and a source
-function updateCanvasImage(id, maxWidth, maxHeight) {
+// name and a source. The image fills cssWidth x cssHeight, and is rasterized
+// at the device pixels that covers.
+function updateCanvasImage(id, cssWidth, cssHeight) {
 
     const config = gridStackConfig[id];
     const url = config.imageUrl;
     const seqNumber = config.seqNumber;
+    const { width, height } = deviceBox(cssWidth, cssHeight);
 
-    // Get the canvas element
-    const canvasEl = document.getElementById(`canvas-${id}`);
-    console.debug(`Updating canvas image for ${id}`, canvasEl);
-
-    // Load the image to a temporary Image object
-    const img = new Image();
-    img.decoding = "async";
-
-    img.onload = () => {
-        console.debug(`Image loaded for canvas ${id}, drawing to canvas.`);
-
-        // Need to adjust the canvas size based on maxWidth and maxHeight while
-        // maintaining aspect ratio
-        const aspectRatio = img.width / img.height;
-
-        // All I want to do is maximize the image to fit within maxWidth and
-        // maxHeight
-        if (img.width / maxWidth >= img.height / maxHeight) {
-            canvasEl.width = maxWidth;
-            canvasEl.height = maxWidth / aspectRatio;
-        } else {
-            canvasEl.height = maxHeight;
-            canvasEl.width = maxHeight * aspectRatio;
-        }
-
-        console.log(`Rendering at canvas size: width ${canvasEl.width}, height ${canvasEl.height}`);
-        
-        const ctx = canvasEl.getContext('2d');
-
-        // Clear the canvas before drawing
-        ctx.clearRect(0, 0, canvasEl.width, canvasEl.height);
-
-        // Draw the image scaled to fit the canvas
-        ctx.drawImage(img, 0, 0, canvasEl.width, canvasEl.height);
-    };
+    // A pre-rendered bitmap if there is one, so we don't rasterize the SVG
+    const src = chooseImageUrl(url, seqNumber, width, height);
+    console.debug(`Setting image source for canvas ${id} to ${src}`);
 
-    img.onerror = () => {
-        console.error(`Failed to load image for canvas ${id}`, img.src);
-    };
+    return renderToCanvas(id, src, width, height, { url, seqNumber });
+}
+
+// How every image used to be drawn, decoded and scaled on the main thread
+// with no cancelling. Kept for benchmarks/canvas_rendering.html to compare
+// against.
+function drawCanvasImageOnMainThread(id, src, maxWidth, maxHeight) {
+    return new Promise(resolve => {
+        const img = new Image();
+        img.decoding = "async";
+
+        img.onload = () => {
+            drawImageScaled(id, img, fitInside(img.width, img.height, maxWidth, maxHeight));
+            resolve("drawn");
+        };
+
+        img.onerror = () => {
+            console.error(`Failed to load image for canvas ${id}`, img.src);
+            resolve("failed");
+        };
 
-    console.debug(`Setting image source for canvas ${id} to ${withSequence(url, seqNumber)}`);
-    img.src = withSequence(url, seqNumber);
-}
\ No newline at end of file
+        img.src = src;
+    });
+}
@@ -1,6 +1,42 @@
 // Map of id -> current seqNumber to know what we've already loaded
 const currentSequenceNumbers = new Map();
 
+// Functions called with {id, url, seqNumber, hash, variants} whenever an
+// image changes
+const imageChangeListeners = [];
+
+// Map of image path -> pre-rendered bitmaps [{url, width, height}] from the
+// manifest
+const imageVariants = new Map();
+
+// Pages set this to say how big an <img> will be drawn, {width, height} or
+// null when it's not known
+let imageTargetSize = imgEl => null;
+
+// How often to poll the manifest when the server can't push changes
+const MANIFEST_POLL_INTERVAL = 30000;
+
+// The manifest version this page has caught up to, so a poll only brings
+// back what changed since. null until the first answer.
+let manifestVersion = null;
+
+// Set when the server has no /manifest, the whole manifest is polled instead
+let manifestDeltasUnsupported = false;
+
+// Decoded images already scaled for where they're drawn, so drawing the same
+// version of an image at the same size again is just a blit. Kiosks run for
+// weeks, so the least recently used are closed once the pixels add up to more
+// than the budget.
+const BITMAP_CACHE_BUDGET = 64 * 1024 * 1024;
+
+// Map of "path|seqNumber|widthxheight" -> {bitmap, path, seqNumber, bytes},
+// least recently used first
+const bitmapCache = new Map();
+let bitmapCacheBytes = 0;
+
+// Keys of bitmaps being made from an <img> for the cache
+const pendingBitmapKeys = new Set();
+
 async function loadManifest() {
   // Keep JSON fresh during dev & in production if you want quick propagation
   const res = await fetch("/downloaded_ids.json", { cache: "no-store" });
@@ -9,47 +45,256 @@ async function loadManifest() {
   return res.json();
 }
 
+// What changed since the last time we asked, as {full, images, removed}.
+// Older servers without /manifest get the whole manifest every time.
+async function loadManifestChanges() {
+  if (!manifestDeltasUnsupported) {
+    const since = manifestVersion === null ? "" : `?since=${manifestVersion}`;
+    const res = await fetch(`/manifest${since}`, { cache: "no-store" });
+
+    if (res.ok) {
+      const changes = await res.json();
+      manifestVersion = changes.version;
+      return changes;
+    }
+    if (res.status !== 404) throw new Error(`Failed to load manifest changes: ${res.status}`);
+
+    manifestDeltasUnsupported = true;
+  }
+
+  return { full: true, images: manifestImages(await loadManifest()), removed: [] };
+}
+
+// The downloader writes a list of files, turn it into the same shape as the
+// events from the server
+function manifestImages(manifest) {
+  if (!Array.isArray(manifest)) return manifest.images;
+
+  return manifest.map(file => ({
+    id: file.FileName,
+    url: `svg_files/${encodeURIComponent(file.FileName)}`,
+    seqNumber: file.SequenceNumber,
+    hash: file.ContentHash,
+    variants: file.Variants,
+  }));
+}
+
 function withSequence(url, seqNumber) {
   const u = new URL(url, window.location.origin);
   u.searchParams.set("v", seqNumber);
   return u.toString();
 }
 
-function updateImage(id, url, seqNumber) {
-  const imgEl = document.getElementById(`img-${id}`);
-  if (!imgEl) return;
+// Whether two urls point at the same file, ignoring ?v= and the like
+function isSameImage(a, b) {
+  return imagePath(a) === imagePath(b);
+}
+
+function imagePath(url) {
+  return decodeURIComponent(new URL(url, window.location.href).pathname);
+}
+
+// The smallest pre-rendered bitmap that still fills width x height, or the
+// largest one there is. Falls back to the SVG when there aren't any.
+function chooseImageUrl(url, seqNumber, width, height) {
+  const variants = imageVariants.get(imagePath(url));
+  if (!variants || variants.length === 0 || !width || !height) {
+    return withSequence(url, seqNumber);
+  }
+
+  const fitsWidth = v => Math.min(width, height * v.width / v.height);
+  const bySize = [...variants].sort((a, b) => a.width - b.width);
+  const chosen = bySize.find(v => v.width >= fitsWidth(v) - 1) ?? bySize[bySize.length - 1];
+
+  // Bitmaps are named by their contents, so no ?v= is needed
+  return new URL(chosen.url, window.location.origin).toString();
+}
+
+function bitmapCacheKey(url, seqNumber, width, height) {
+  return `${imagePath(url)}|${seqNumber ?? ""}|${Math.round(width)}x${Math.round(height)}`;
+}
+
+// The cached bitmap of url at seqNumber drawn for width x height, or null.
+// It still belongs to the cache, draw it but don't close it.
+function getCachedBitmap(url, seqNumber, width, height) {
+  const key = bitmapCacheKey(url, seqNumber, width, height);
+  const entry = bitmapCache.get(key);
+  if (!entry) return null;
+
+  // Move it to the back, it's the most recently used now
+  bitmapCache.delete(key);
+  bitmapCache.set(key, entry);
+  return entry.bitmap;
+}
+
+// Keep a bitmap of url at seqNumber drawn for width x height. The cache owns
+// it from now on and closes it when it's evicted.
+function cacheBitmap(url, seqNumber, width, height, bitmap) {
+  const key = bitmapCacheKey(url, seqNumber, width, height);
+  const bytes = bitmap.width * bitmap.height * 4;
+
+  if (bitmapCache.get(key)?.bitmap === bitmap) return;
+  removeCachedBitmap(key);
+  if (bytes > BITMAP_CACHE_BUDGET) {
+    bitmap.close();
+    return;
+  }
+
+  bitmapCache.set(key, { bitmap, path: imagePath(url), seqNumber: String(seqNumber ?? ""), bytes });
+  bitmapCacheBytes += bytes;
 
+  for (const oldest of bitmapCache.keys()) {
+    if (bitmapCacheBytes <= BITMAP_CACHE_BUDGET) break;
+    removeCachedBitmap(oldest);
+  }
+}
+
+function removeCachedBitmap(key) {
+  const entry = bitmapCache.get(key);
+  if (!entry) return;
+
+  bitmapCache.delete(key);
+  bitmapCacheBytes -= entry.bytes;
+  entry.bitmap.close();
+}
+
+// Close the cached bitmaps of every other version of url
+function dropStaleBitmaps(url, seqNumber) {
+  const path = imagePath(url);
+  const current = String(seqNumber ?? "");
+  for (const [key, entry] of bitmapCache) {
+    if (entry.path === path && entry.seqNumber !== current) removeCachedBitmap(key);
+  }
+}
+
+// The cached bitmap of what an <img> shows, scaled to width x height. When
+// there isn't one yet it's made from the <img> for next time and null is
+// returned, so the <img> itself is drawn this once.
+function imageBitmapFor(imgEl, width, height) {
+  if (!imgEl.complete || !imgEl.naturalWidth || width < 1 || height < 1) return null;
+
+  const url = imgEl.dataset.imageUrl ?? imgEl.src;
+  const seqNumber = imgEl.dataset.seqNumber ?? new URL(imgEl.src).searchParams.get("v");
+  const cached = getCachedBitmap(url, seqNumber, width, height);
+  if (cached || typeof createImageBitmap === "undefined") return cached;
+
+  const key = bitmapCacheKey(url, seqNumber, width, height);
+  if (pendingBitmapKeys.has(key)) return null;
+  pendingBitmapKeys.add(key);
+
+  const size = { resizeWidth: Math.round(width), resizeHeight: Math.round(height), resizeQuality: "high" };
+  createImageBitmap(imgEl, size)
+    .then(bitmap => cacheBitmap(url, seqNumber, width, height, bitmap))
+    .catch(error => console.debug(`Not caching ${url}`, error))
+    .finally(() => pendingBitmapKeys.delete(key));
+  return null;
+}
+
+function onImageChange(listener) {
+  imageChangeListeners.push(listener);
+}
+
+function updateImage(id, url, seqNumber) {
   // Only update if the seqNumber changed
   if (currentSequenceNumbers.get(id) === seqNumber) return;
 
-  // Preload into an Image object to avoid flicker and broken states
-  const preloader = new Image();
-  preloader.decoding = "async";
-  preloader.onload = () => {
-    // Swap atomically once loaded
-    imgEl.src = preloader.src;
-    currentSequenceNumbers.set(id, seqNumber);
-  };
-  preloader.onerror = () => {
-    console.error(`Failed to load image for ${id}`, preloader.src);
-  };
+  // Either an <img id="img-..."> or any <img> showing the same file
+  const imgEls = Array.from(document.querySelectorAll("img")).filter(img => {
+    const shows = img.dataset.imageUrl ?? (img.getAttribute("src") && img.src);
+    return img.id === `img-${id}` || (shows && isSameImage(shows, url));
+  });
+  currentSequenceNumbers.set(id, seqNumber);
+
+  imgEls.forEach(imgEl => {
+    const size = imageTargetSize(imgEl);
+    const src = chooseImageUrl(url, seqNumber, size?.width, size?.height);
+
+    // Remember which file this is, src may become a bitmap
+    imgEl.dataset.imageUrl = url;
+
+    // Preload into a pooled Image to avoid flicker and broken states
+    const preloader = acquireImage();
+    preloader.onload = () => {
+      // Swap atomically once loaded
+      imgEl.src = preloader.src;
+      imgEl.dataset.seqNumber = seqNumber;
+      releaseImage(preloader);
+    };
+    preloader.onerror = () => {
+      console.error(`Failed to load image for ${id}`, preloader.src);
+      releaseImage(preloader);
+      // Forget the version so the next event or poll for it tries again
+      if (currentSequenceNumbers.get(id) === seqNumber) currentSequenceNumbers.delete(id);
+    };
+
+    preloader.src = src;
+  });
+}
+
+// Apply one changed image. The first time we hear about an image the page
+// already shows it, so it is only remembered unless there's a bitmap of it.
+function applyImageChange(item, initial) {
+  if (item.variants) imageVariants.set(imagePath(item.url), item.variants);
+  if (currentSequenceNumbers.get(item.id) === item.seqNumber) return;
+  dropStaleBitmaps(item.url, item.seqNumber);
+
+  if (initial && !item.variants) {
+    currentSequenceNumbers.set(item.id, item.seqNumber);
+  } else {
+    updateImage(item.id, item.url, item.seqNumber);
+  }
 
-  preloader.src = withSequence(url, seqNumber);
+  imageChangeListeners.forEach(listener => listener(item));
 }
 
-async function refreshImages() {
+async function refreshImages(initial = false) {
   try {
-    const manifest = await loadManifest();
-    for (const item of manifest.images) {
-      updateImage(item.id, item.url, item.seqNumber);
+    const changes = await loadManifestChanges();
+    for (const item of changes.images) {
+      applyImageChange(item, initial);
     }
+    changes.removed.forEach(id => currentSequenceNumbers.delete(id));
   } catch (e) {
     console.error(e);
   }
 }
 
-// // Initial load
-// refreshImages();
+// Let sw.js keep this page's files, so a reload is instant and still works
+// while the server is down. Browsers only allow it on localhost and https.
+function registerOfflineCache() {
+  if (!("serviceWorker" in navigator)) return;
 
-// // Re-check every 30s (tune for your needs, or trigger on a button or SSE)
-// setInterval(refreshImages, 30000);
+  navigator.serviceWorker.register("/sw.js").catch(error => {
+    console.warn("No offline cache for this board:", error);
+  });
+}
+
+// Get told about new images by the server instead of polling for them. Falls
+// back to polling if the server doesn't offer /events.
+function subscribeToManifest() {
+  let synced = false;
+  const resync = () => {
+    // Catch up on anything missed while we weren't listening
+    refreshImages(!synced);
+    synced = true;
+  };
+
+  if (!window.EventSource) {
+    resync();
+    setInterval(refreshImages, MANIFEST_POLL_INTERVAL);
+    return;
+  }
+
+  const events = new EventSource("/events");
+  events.onopen = resync;
+  events.addEventListener("change", e => applyImageChange(JSON.parse(e.data), false));
+  events.addEventListener("remove", e => currentSequenceNumbers.delete(JSON.parse(e.data).id));
+  events.onerror = () => {
+    // EventSource retries by itself unless the server turned it away
+    if (events.readyState !== EventSource.CLOSED) return;
+
+    console.warn("No manifest events from the server, polling instead");
+    resync();
+    setInterval(refreshImages, MANIFEST_POLL_INTERVAL);
+  };
+}
@@ -0,0 +1,159 @@
+// What a board needs to run for weeks without restarting the browser:
+//
+// - A small pool of Image objects that preloading and decoding reuse, instead
+//   of a new one per update that hangs on to its pixels until it's collected.
+// - Canvases emptied before they're thrown away, so their pixels go at once.
+// - Animations (the snowflakes and lights) paused while the page is hidden.
+// - Every KIOSK_METRICS_MINUTES the JS heap, how many decoded images are held
+//   and frame times are POSTed to the server's /metrics. nocache_server.py
+//   keeps them in board_metrics.jsonl, and board_metrics.py shows how each
+//   board's use changes over time.
+//
+// Bitmaps are closed by their owner: the cache in imageLoading.js when it
+// evicts or replaces one, imageDrawing.js for the ones it doesn't cache.
+
+// Idle Images kept for reuse, more are made when they're all busy but only
+// this many are kept
+const IMAGE_POOL_SIZE = 8;
+
+const KIOSK_METRICS_PATH = "/metrics";
+const KIOSK_METRICS_MINUTES = 5;
+
+// Frames timed before each report, in ms
+const FRAME_SAMPLE_MS = 2000;
+
+const idleImages = [];
+let imagesInUse = 0;
+
+// Animations paused because the page was hidden, to be played again
+const pausedAnimations = new Set();
+
+let kioskStarted = false;
+
+// An Image to load something into. Give it back with releaseImage once what
+// it shows has been copied somewhere.
+function acquireImage() {
+    imagesInUse++;
+
+    const img = idleImages.pop() ?? new Image();
+    img.decoding = "async";
+    return img;
+}
+
+// Clear an Image's handlers and src, which lets go of its decoded pixels, and
+// keep it for next time if the pool isn't full
+function releaseImage(img) {
+    imagesInUse--;
+
+    img.onload = null;
+    img.onerror = null;
+    img.removeAttribute("src");
+    if (idleImages.length < IMAGE_POOL_SIZE) idleImages.push(img);
+}
+
+// A canvas that's removed holds its pixels until it's collected. Zero sized
+// it holds none.
+function releaseCanvases(root) {
+    root.querySelectorAll("canvas").forEach(canvasEl => {
+        canvasEl.width = 0;
+        canvasEl.height = 0;
+    });
+}
+
+function pauseAnimationsWhileHidden() {
+    if (!document.getAnimations) return;
+
+    document.addEventListener("visibilitychange", () => {
+        if (document.hidden) {
+            for (const animation of document.getAnimations()) {
+                if (animation.playState !== "running") continue;
+                animation.pause();
+                pausedAnimations.add(animation);
+            }
+        } else {
+            pausedAnimations.forEach(animation => animation.play());
+            pausedAnimations.clear();
+        }
+    });
+}
+
+// {count, mean, p95, max} of the frame times over ms, or null when the page
+// is hidden and isn't drawing frames
+function sampleFrameTimes(ms) {
+    if (document.hidden) return Promise.resolve(null);
+
+    return new Promise(resolve => {
+        const times = [];
+        let start = null, last = null;
+
+        const frame = now => {
+            if (last !== null) times.push(now - last);
+            start ??= now;
+            last = now;
+
+            if (now - start < ms) {
+                requestAnimationFrame(frame);
+                return;
+            }
+
+            times.sort((a, b) => a - b);
+            const round = t => Math.round(t * 10) / 10;
+            resolve(times.length === 0 ? null : {
+                count: times.length,
+                mean: round(times.reduce((sum, t) => sum + t, 0) / times.length),
+                p95: round(times[Math.min(times.length - 1, Math.floor(times.length * 0.95))]),
+                max: round(times[times.length - 1]),
+            });
+        };
+        requestAnimationFrame(frame);
+    });
+}
+
+// Images decoded and held right now: cached bitmaps, pooled Images that are
+// busy and <img>s showing something
+function decodedImageCount() {
+    const shown = Array.from(document.images).filter(img => img.complete && img.naturalWidth > 0).length;
+    return bitmapCache.size + imagesInUse + shown;
+}
+
+async function kioskMetrics() {
+    // Chromium only, the boards' browser
+    const memory = performance.memory;
+
+    return {
+        board: new URLSearchParams(window.location.search).get("board") ?? document.body.dataset.board ?? window.location.pathname,
+        uptimeSeconds: Math.round(performance.now() / 1000),
+        hidden: document.hidden,
+        jsHeapUsed: memory?.usedJSHeapSize ?? null,
+        jsHeapTotal: memory?.totalJSHeapSize ?? null,
+        decodedImages: decodedImageCount(),
+        bitmapCacheBytes,
+        frameTime: await sampleFrameTimes(FRAME_SAMPLE_MS),
+    };
+}
+
+// Send metrics until the server says it doesn't take them
+async function reportKioskMetrics(timer) {
+    try {
+        const res = await fetch(KIOSK_METRICS_PATH, {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify(await kioskMetrics()),
+            keepalive: true,
+        });
+        if (res.status === 404) clearInterval(timer);
+    } catch (error) {
+        // The server is restarting, there's always the next one
+        console.debug("Metrics not sent", error);
+    }
+}
+
+function startKioskRuntime() {
+    if (kioskStarted) return;
+    kioskStarted = true;
+
+    pauseAnimationsWhileHidden();
+
+    const timer = setInterval(() => reportKioskMetrics(timer), KIOSK_METRICS_MINUTES * 60 * 1000);
+    reportKioskMetrics(timer);
+}
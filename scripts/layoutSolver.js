@@ -0,0 +1,57 @@
+// Works out how big a board's grid cells and canvases are from the real
+// viewport and devicePixelRatio, instead of tables of the screens we happen to
+// know about. A solution is kept per resolution, so redrawing a widget
+// doesn't measure anything.
+
+// "widthxheight@dpr|..." -> solved grid
+const layoutSolutions = new Map();
+
+function currentDevicePixelRatio() {
+    return window.devicePixelRatio || 1;
+}
+
+// A grid of columns x rows filling width x height CSS pixels, with margin
+// around every widget and a border inside it
+function solveGridLayout({ width, height, columns, rows, margin, border }) {
+    const dpr = currentDevicePixelRatio();
+    const key = `${width}x${height}@${dpr}|${columns}x${rows}|${margin}|${border}`;
+
+    let solution = layoutSolutions.get(key);
+    if (!solution) {
+        solution = {
+            dpr,
+            margin,
+            border,
+            columns,
+            cellWidth: width / columns,
+            // Gridstack wants whole pixels
+            cellHeight: Math.floor(height / rows),
+            boxes: new Map(),
+        };
+        layoutSolutions.set(key, solution);
+    }
+    return solution;
+}
+
+// The CSS size inside the border of a widget w x h cells big
+function solveWidgetBox(solution, w, h) {
+    const key = `${w}x${h}`;
+
+    let box = solution.boxes.get(key);
+    if (!box) {
+        const inset = 2 * (solution.margin + solution.border);
+        box = {
+            width: Math.max(1, solution.cellWidth * w - inset),
+            height: Math.max(1, solution.cellHeight * h - inset),
+        };
+        solution.boxes.set(key, box);
+    }
+    return box;
+}
+
+// How many device pixels a CSS box covers, the size an image has to be
+// rasterized at to be drawn without scaling
+function deviceBox(cssWidth, cssHeight) {
+    const dpr = currentDevicePixelRatio();
+    return { width: Math.max(1, Math.round(cssWidth * dpr)), height: Math.max(1, Math.round(cssHeight * dpr)) };
+}
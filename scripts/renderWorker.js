@@ -0,0 +1,64 @@
+// Fetches, decodes and scales board images off the main thread for
+// scripts/imageDrawing.js. Each message asks for one widget's image at a size,
+// and a newer message for the same widget cancels the one before it.
+
+// widget id -> token of the newest request for it
+const latestTokens = {};
+
+// widget id -> AbortController of the fetch in flight for it
+const inFlightFetches = {};
+
+// The same fitting as imageDrawing.js
+function fitInside(width, height, maxWidth, maxHeight) {
+    const aspectRatio = width / height;
+
+    if (width / maxWidth >= height / maxHeight) {
+        return { width: Math.max(1, Math.round(maxWidth)), height: Math.max(1, Math.round(maxWidth / aspectRatio)) };
+    }
+    return { width: Math.max(1, Math.round(maxHeight * aspectRatio)), height: Math.max(1, Math.round(maxHeight)) };
+}
+
+self.onmessage = async event => {
+    const { id, token, url, maxWidth, maxHeight } = event.data;
+    const isCurrent = () => latestTokens[id] === token;
+    const reply = (status, extra = {}, transfer = []) => self.postMessage({ id, token, status, ...extra }, transfer);
+
+    latestTokens[id] = token;
+    inFlightFetches[id]?.abort();
+    const controller = new AbortController();
+    inFlightFetches[id] = controller;
+
+    let blob;
+    try {
+        const response = await fetch(url, { signal: controller.signal });
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        blob = await response.blob();
+    } catch (error) {
+        return reply(isCurrent() ? "error" : "cancelled", { error: String(error) });
+    } finally {
+        if (inFlightFetches[id] === controller) delete inFlightFetches[id];
+    }
+    if (!isCurrent()) return reply("cancelled");
+
+    let decoded;
+    try {
+        decoded = await createImageBitmap(blob);
+    } catch (error) {
+        // Hand it back to be decoded on the main thread
+        return reply(isCurrent() ? "undecodable" : "cancelled", { error: String(error) });
+    }
+    if (!isCurrent()) {
+        decoded.close();
+        return reply("cancelled");
+    }
+
+    const size = fitInside(decoded.width, decoded.height, maxWidth, maxHeight);
+    const canvas = new OffscreenCanvas(size.width, size.height);
+    const ctx = canvas.getContext("2d");
+    ctx.imageSmoothingQuality = "high";
+    ctx.drawImage(decoded, 0, 0, size.width, size.height);
+    decoded.close();
+
+    const bitmap = canvas.transferToImageBitmap();
+    reply("done", { bitmap }, [bitmap]);
+};
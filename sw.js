@@ -0,0 +1,240 @@
+// Keeps the boards up while the web server restarts or is down, and makes a
+// reload not wait on the network.
+//
+// - The shell (pages, scripts, styles, fonts, Gridstack) is precached and
+//   served from the cache. Versioned files (?v=) never change, the rest are
+//   refreshed in the background.
+// - SVGs and their bitmaps are served stale-while-revalidate, one copy per
+//   image keyed by its SequenceNumber (?v= on the url). A new version
+//   replaces the old one, and images that leave the manifest are dropped.
+// - The manifest and layouts come from the network, and from the last good
+//   copy when it can't be reached.
+//
+// Browsers only run service workers for pages from localhost or https, so a
+// kiosk showing another machine's server over http goes without.
+
+// Bump when SHELL_FILES changes, the old caches are deleted on activate
+const SHELL_CACHE = "gemba-shell-v3";
+const DATA_CACHE = "gemba-data-v1";
+const IMAGE_CACHE = "gemba-images-v1";
+
+const BOARD_PAGES = [
+    "CustomManufacturing", "FrontOffice", "Integration", "Machining", "MillwrightFactory",
+    "MillwrightPodBoard", "Plate", "ProjectManagement", "SupplyChain", "ToolRoom",
+];
+
+// The pages' versions of each file, anything missing here is cached the
+// first time it's asked for
+const SHELL_FILES = [
+    "/board.html",
+    "/index.html",
+    ...BOARD_PAGES.map(name => `/${name}.html`),
+    "/node_modules/gridstack/dist/gridstack-all.js",
+    "/node_modules/gridstack/dist/gridstack.min.css",
+    "/styles/board.css?v=1",
+    "/scripts/kioskRuntime.js?v=1",
+    "/scripts/imageLoading.js?v=8",
+    "/scripts/layoutSolver.js?v=1",
+    "/scripts/imageDrawing.js?v=6",
+    "/scripts/renderWorker.js?v=1",
+    "/scripts/gridStackManager.js?v=6",
+    "/scripts/boardRuntime.js?v=5",
+];
+
+const DATA_FILES = BOARD_PAGES.map(name => `/boards/${name}.json`);
+
+const SHELL_PREFIXES = ["/scripts/", "/styles/", "/fonts/", "/node_modules/"];
+const IMAGE_PREFIX = "/svg_files/";
+
+// Full manifests are kept under these, a delta is only good for the page that
+// asked for it
+const MANIFEST_PATHS = ["/downloaded_ids.json", "/manifest"];
+
+self.addEventListener("install", event => {
+    event.waitUntil((async () => {
+        // One missing file shouldn't stop the rest from being cached
+        await Promise.all([
+            precache(SHELL_CACHE, SHELL_FILES),
+            precache(DATA_CACHE, DATA_FILES),
+        ]);
+        await self.skipWaiting();
+    })());
+});
+
+self.addEventListener("activate", event => {
+    event.waitUntil((async () => {
+        const current = [SHELL_CACHE, DATA_CACHE, IMAGE_CACHE];
+        for (const name of await caches.keys()) {
+            if (name.startsWith("gemba-") && !current.includes(name)) await caches.delete(name);
+        }
+        await self.clients.claim();
+    })());
+});
+
+self.addEventListener("fetch", event => {
+    const request = event.request;
+    const url = new URL(request.url);
+    if (request.method !== "GET" || url.origin !== self.location.origin) return;
+
+    if (request.mode === "navigate" || url.pathname.endsWith(".html")) {
+        event.respondWith(staleWhileRevalidate(SHELL_CACHE, request, pageKey(url)));
+    } else if (url.pathname.startsWith(IMAGE_PREFIX)) {
+        event.respondWith(serveImage(event, request));
+    } else if (MANIFEST_PATHS.includes(url.pathname)) {
+        event.respondWith(serveManifest(request, url));
+    } else if (url.pathname.startsWith("/boards/")) {
+        event.respondWith(networkFirst(DATA_CACHE, request, url.pathname));
+    } else if (SHELL_PREFIXES.some(prefix => url.pathname.startsWith(prefix))) {
+        event.respondWith(url.searchParams.has("v")
+            ? cacheFirst(SHELL_CACHE, request)
+            : staleWhileRevalidate(SHELL_CACHE, request, request));
+    }
+    // Everything else, /events in particular, goes straight to the server
+});
+
+async function precache(cacheName, urls) {
+    const cache = await caches.open(cacheName);
+    await Promise.all(urls.map(url => cache.add(url).catch(error => {
+        console.warn(`Not precaching ${url}:`, error);
+    })));
+}
+
+// The reload timer adds ?t= and board.html takes ?board=, neither changes
+// the page itself
+function pageKey(url) {
+    return url.origin + url.pathname;
+}
+
+async function staleWhileRevalidate(cacheName, request, key) {
+    const cache = await caches.open(cacheName);
+    const cached = await cache.match(key);
+    const fresh = fetch(request).then(async response => {
+        if (response.ok) await cache.put(key, response.clone());
+        return response;
+    });
+
+    if (cached) {
+        fresh.catch(() => {});
+        return cached;
+    }
+    return fresh;
+}
+
+async function cacheFirst(cacheName, request) {
+    const cache = await caches.open(cacheName);
+    const cached = await cache.match(request);
+    if (cached) return cached;
+
+    const response = await fetch(request);
+    if (response.ok) {
+        await cache.put(request, response.clone());
+        await evictOtherVersions(cache, request.url);
+    }
+    return response;
+}
+
+async function networkFirst(cacheName, request, key) {
+    const cache = await caches.open(cacheName);
+    try {
+        const response = await fetch(request);
+        if (response.ok) await cache.put(key, response.clone());
+        return response;
+    } catch (error) {
+        const cached = await cache.match(key);
+        if (cached) return cached;
+        throw error;
+    }
+}
+
+// The version asked for from the cache, checked with the server afterwards.
+// When it isn't cached and the server can't be reached, the newest version
+// there is beats a broken image.
+async function serveImage(event, request) {
+    const cache = await caches.open(IMAGE_CACHE);
+    const cached = await cache.match(request);
+
+    const fresh = fetch(request).then(async response => {
+        if (response.ok) {
+            await cache.put(request, response.clone());
+            await evictOtherVersions(cache, request.url);
+        }
+        return response;
+    });
+
+    if (cached) {
+        event.waitUntil(fresh.catch(() => {}));
+        return cached;
+    }
+
+    try {
+        return await fresh;
+    } catch (error) {
+        const fallback = await cache.match(request, { ignoreSearch: true });
+        if (fallback) return fallback;
+        throw error;
+    }
+}
+
+// Keep one copy per file: drop every cached url with the same path as url
+// but another ?v=
+async function evictOtherVersions(cache, url) {
+    const { pathname, search } = new URL(url);
+    for (const key of await cache.keys()) {
+        const keyUrl = new URL(key.url);
+        if (keyUrl.pathname === pathname && keyUrl.search !== search) await cache.delete(key);
+    }
+}
+
+async function serveManifest(request, url) {
+    const cache = await caches.open(DATA_CACHE);
+    const key = url.origin + url.pathname;
+
+    try {
+        const response = await fetch(request);
+        if (response.ok) {
+            const manifest = await response.clone().json();
+            const full = Array.isArray(manifest) || manifest.full;
+            if (full) {
+                await cache.put(key, response.clone());
+                await dropRemovedImages(manifest);
+            }
+        }
+        return response;
+    } catch (error) {
+        // Whatever the page asked for, the last whole manifest is the best
+        // there is. Its images are applied like any others.
+        const cached = await cache.match(key);
+        if (cached) return cached;
+        throw error;
+    }
+}
+
+// Forget images that aren't in a whole manifest any more, and bitmaps that
+// aren't any of its images' variants
+async function dropRemovedImages(manifest) {
+    const images = Array.isArray(manifest)
+        ? manifest.map(file => ({ url: `svg_files/${encodeURIComponent(file.FileName)}`, variants: file.Variants }))
+        : manifest.images;
+
+    const keep = new Set();
+    for (const image of images) {
+        keep.add(imagePath(image.url));
+        for (const variant of image.variants ?? []) keep.add(imagePath(variant.url));
+    }
+
+    const cache = await caches.open(IMAGE_CACHE);
+    for (const key of await cache.keys()) {
+        if (!keep.has(imagePath(key.url))) await cache.delete(key);
+    }
+}
+
+// The server quotes file names a little differently than the pages do, so
+// paths are compared decoded
+function imagePath(url) {
+    const pathname = new URL(url, self.location.origin).pathname;
+    try {
+        return decodeURIComponent(pathname);
+    } catch {
+        return pathname;
+    }
+}
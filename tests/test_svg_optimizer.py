@@ -0,0 +1,49 @@
+import re
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from GembaFileUpToDater.svg_optimizer import SVG_NS, round_coordinates
+
+NUMBERS = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+
+def rounded(attributes: dict[str, str]) -> dict[str, str]:
+    root = ET.Element(f'{{{SVG_NS}}}svg')
+    ET.SubElement(root, f'{{{SVG_NS}}}path', attributes)
+    round_coordinates(root)
+    return dict(root[0].attrib)
+
+@pytest.mark.parametrize('d', [
+    'M5-0.001L10 10',
+    'M-0.004-0.003L-1.006-2.5',
+    'M1.5+0.001 2+0.25',
+    'M0.5-.001L.5.5',
+    'M1.004.5L2 2',
+    'M.001.5',
+    'M0.999.5',
+])
+def test_negative_numbers_keep_their_separator(d):
+    result = rounded({'d': d})['d']
+
+    before = [float(n) for n in NUMBERS.findall(d)]
+    after = [float(n) for n in NUMBERS.findall(result)]
+    assert len(after) == len(before)
+    assert after == pytest.approx(before, abs=0.005)
+
+def test_signed_zero_stays_separate():
+    assert rounded({'d': 'M5-0.001L10 10'})['d'] == 'M5-0L10 10'
+
+@pytest.mark.parametrize('d, expected', [
+    ('M1.004.5L2 2', 'M1 0.5L2 2'),
+    ('M.001.5', 'M0 0.5'),
+    ('M0.999.5', 'M1 0.5'),
+])
+def test_packed_decimals_stay_separate(d, expected):
+    assert rounded({'d': d})['d'] == expected
+
+@pytest.mark.parametrize('transform', [
+    'matrix(0.004 0 0 0.004 1.5 2)',
+    'scale(0.001) translate(-0.004 3.333)',
+])
+def test_transforms_are_not_rounded(transform):
+    assert rounded({'d': 'M0 0', 'transform': transform})['transform'] == transform